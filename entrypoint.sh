@@ -1,3 +1,24 @@
 #!/bin/bash
 
-gunicorn -b 0.0.0.0:$SERVICE_PORT --workers=2 -k sync -t $SERVICE_TIMEOUT recommendation_engine.flask_predict:app --log-level $FLASK_LOGGING_LEVEL
+# A worker scores on up to SCORING_THREADS threads, each running up to BLAS_NUM_THREADS BLAS
+# threads: keep SERVICE_WORKERS * SCORING_THREADS * BLAS_NUM_THREADS within the CPU limit.
+BLAS_NUM_THREADS=${BLAS_NUM_THREADS:-1}
+export OMP_NUM_THREADS=${OMP_NUM_THREADS:-$BLAS_NUM_THREADS}
+export OPENBLAS_NUM_THREADS=${OPENBLAS_NUM_THREADS:-$BLAS_NUM_THREADS}
+export MKL_NUM_THREADS=${MKL_NUM_THREADS:-$BLAS_NUM_THREADS}
+
+# gevent workers serve WORKER_CONNECTIONS requests at once and score them on a thread pool.
+# A sync worker serves one request at a time, so MAX_IN_FLIGHT_REQUESTS only limits gevent ones.
+WORKER_CLASS=${WORKER_CLASS:-sync}
+WORKER_OPTIONS=""
+if [ "$WORKER_CLASS" = "gevent" ]; then
+    WORKER_OPTIONS="--worker-connections=${WORKER_CONNECTIONS:-100}"
+fi
+
+# The workers publish their metrics together through METRICS_DIR, emptied on every start.
+export METRICS_DIR=${METRICS_DIR:-/tmp/metrics}
+rm -rf "$METRICS_DIR" && mkdir -p "$METRICS_DIR"
+
+# A short backlog keeps connections from queueing until SERVICE_TIMEOUT. On Linux the SYNs past
+# it are dropped, not refused, and the clients retry them after their connect timeout.
+gunicorn -b 0.0.0.0:$SERVICE_PORT --backlog=${SERVICE_BACKLOG:-128} --workers=${SERVICE_WORKERS:-2} -k $WORKER_CLASS $WORKER_OPTIONS -t $SERVICE_TIMEOUT recommendation_engine.flask_predict:app --log-level $FLASK_LOGGING_LEVEL
@@ -17,7 +17,11 @@ import recommendation_engine.config.params_training as params_training
 from recommendation_engine.autoencoder.pretrain import pretrain
 from recommendation_engine.config.path_constants import TEMPORARY_SDAE_PATH, TEMPORARY_CVAE_PATH, \
     TEMPORARY_USER_ITEM_FILEPATH, TEMPORARY_ITEM_USER_FILEPATH, TEMPORARY_PATH, \
-    TEMPORARY_MODEL_PATH, TEMPORARY_DATASTORE, TEMPORARY_DATA_PATH
+    TEMPORARY_MODEL_PATH, TEMPORARY_DATASTORE, TEMPORARY_DATA_PATH, TEMPORARY_PMF_PATH, \
+    TEMPORARY_SERVING_MODEL_PATH, TEMPORARY_TOP_K_TABLE_PATH, TEMPORARY_ITEM_NEIGHBOURS_PATH
+from recommendation_engine.model.item_neighbours import export_item_neighbours
+from recommendation_engine.model.serving_model import export_serving_model
+from recommendation_engine.model.top_k_table import export_top_k_table
 from recommendation_engine.utils.fileutils import check_path, load_rating
 daiquiri.setup(level=logging.DEBUG)
 from training.datastore.get_preprocess_data import GetPreprocessData
@@ -151,6 +155,17 @@ if __name__ == '__main__':
             item_to_user_matrix=item_to_user_matrix)
     logger.debug("PMF model has been trained.")
     pmf_obj.save_model()
+    export_serving_model(TEMPORARY_PMF_PATH,
+                         os.path.join(TEMPORARY_PATH, 'index_to_package_map.json'),
+                         TEMPORARY_SERVING_MODEL_PATH)
+    logger.debug("Serving model has been exported.")
+    export_top_k_table(TEMPORARY_PMF_PATH, TEMPORARY_TOP_K_TABLE_PATH,
+                       params_training.top_k_table_size)
+    logger.debug("Top-K table has been exported.")
+    export_item_neighbours(TEMPORARY_PMF_PATH, TEMPORARY_ITEM_NEIGHBOURS_PATH,
+                           params_training.item_neighbours_count,
+                           params_training.item_neighbours_metric)
+    logger.debug("Item neighbours have been exported.")
     p.get_preprocess_data.obj_.save_on_s3(TEMPORARY_DATA_PATH)
     p.get_preprocess_data.obj_.save_on_s3(TEMPORARY_PATH)
     p.get_preprocess_data.obj_.save_on_s3(TEMPORARY_MODEL_PATH)
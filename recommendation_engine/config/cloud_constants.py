@@ -18,9 +18,13 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import json
 import os
 
 USE_CLOUD_SERVICES = os.environ.get("USE_CLOUD_SERVICES", True)
 AWS_S3_ACCESS_KEY_ID = os.environ.get('AWS_S3_ACCESS_KEY_ID', '')
 AWS_S3_SECRET_KEY_ID = os.environ.get('AWS_S3_SECRET_ACCESS_KEY', '')
 S3_BUCKET_NAME = os.environ.get('AWS_S3_BUCKET_NAME', 'cvae-insights')
+# Buckets of the ecosystems served besides the one of CHESTER_SCORING_REGION, as a JSON object
+# mapping ecosystem names to bucket names, or to data directories without cloud services
+ECOSYSTEM_BUCKETS = json.loads(os.environ.get('ECOSYSTEM_BUCKETS', '{}'))
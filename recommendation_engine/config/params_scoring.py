@@ -25,7 +25,66 @@ class ScoringParams:
     """This class contains the model hyperparamters."""
 
     a = 1
+    b = 0.01
+    lambda_u = 0.1
     recommendation_threshold = 10
     num_latent_factors = 50
+    # Precision of the latent item matrix used for scoring: float64, float32 or int8; the lower
+    # ones halve or eighth the memory and speed up scoring at the cost of slightly different scores
+    scoring_precision = os.environ.get('SCORING_PRECISION', "float64")
+    # Number of inverted lists of the approximate item index, 0 scores every item exactly
+    mips_nlist = int(os.environ.get('MIPS_NLIST', "0"))
+    # Number of inverted lists scored per stack, the more lists the better the recall
+    mips_nprobe = int(os.environ.get('MIPS_NPROBE', "8"))
     # Minimum confidence required to show recommendation
     min_confidence_prob = np.float64(os.environ.get('MIN_REC_CONFIDENCE', "30"))
+    # Number of stacks whose recommendations are cached, 0 disables the cache
+    result_cache_size = int(os.environ.get('RESULT_CACHE_SIZE', "0"))
+    # Number of seconds a cached recommendation stays valid, 0 keeps it until evicted
+    result_cache_ttl = float(os.environ.get('RESULT_CACHE_TTL_SECONDS', "3600"))
+    # Number of milliseconds concurrent requests are collected for to be scored together,
+    # 0 scores every request on its own
+    micro_batch_window_ms = float(os.environ.get('MICRO_BATCH_WINDOW_MS', "0"))
+    # Number of stacks that makes a micro-batch run without waiting for the window to end
+    micro_batch_max_stacks = int(os.environ.get('MICRO_BATCH_MAX_STACKS', "64"))
+    # Number of threads a gevent worker scores on, workers * threads * BLAS threads should
+    # stay within the CPU limit
+    scoring_threads = int(os.environ.get('SCORING_THREADS', "1"))
+    # Number of milliseconds a request may take to score when it does not set its own time
+    # budget, 0 for no limit
+    time_budget_ms = float(os.environ.get('TIME_BUDGET_MS', "0"))
+    # Number of the most popular packages recommended from when a time budget runs out
+    popular_list_size = int(os.environ.get('POPULAR_LIST_SIZE', "100"))
+    # Number of requests a gevent worker serves at once, the ones over it are turned away with
+    # a 503, 0 for no limit; a sync worker only ever serves one
+    max_in_flight_requests = int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', "32"))
+    # Number of stacks a request may hold, larger ones are turned away with a 413, 0 for no limit
+    max_stacks_per_request = int(os.environ.get('MAX_STACKS_PER_REQUEST', "1000"))
+    # Number of seconds the clients of a worker that is over capacity are asked to wait
+    retry_after_seconds = int(os.environ.get('RETRY_AFTER_SECONDS', "1"))
+    # Number of MinHash permutations of the index matching unseen stacks to similar training
+    # stacks, 0 disables the index
+    minhash_num_perm = int(os.environ.get('MINHASH_NUM_PERM', "0"))
+    # Number of LSH bands the MinHash signatures are cut into, more bands find less similar stacks
+    minhash_num_bands = int(os.environ.get('MINHASH_NUM_BANDS', "16"))
+    # Minimum Jaccard similarity of a training stack served in place of folding in a stack
+    minhash_min_jaccard = float(os.environ.get('MINHASH_MIN_JACCARD', "0.8"))
+    # Scoring of the stacks that are not precomputed: pmf folds them in, item_neighbours sums
+    # the neighbour lists of their packages
+    scoring_mode = os.environ.get('SCORING_MODE', "pmf")
+    # Number of processes the latent item matrix is split across for scoring, each holding only
+    # its shard of the items, 0 scores every item in the worker
+    scoring_shards = int(os.environ.get('SCORING_SHARDS', "0"))
+    # Number of seconds the shards are waited for at most, the worker scores the stacks itself
+    # and restarts the shards that did not reply past it or past the deadline of the request
+    scoring_shard_timeout_seconds = float(os.environ.get('SCORING_SHARD_TIMEOUT_SECONDS', "5"))
+    # Number of megabytes all the models loaded may hold together, the default one included,
+    # the least recently used are unloaded past it and a model whose estimated size does not
+    # fit is not loaded until it does, 0 for no limit
+    models_memory_budget_mb = float(os.environ.get('MODELS_MEMORY_BUDGET_MB', "0"))
+    # Number of seconds before a model of another ecosystem or model version that failed to
+    # load is loaded again, doubling with every failure in a row
+    model_load_retry_seconds = float(os.environ.get('MODEL_LOAD_RETRY_SECONDS', "60"))
+    # Number of seconds between two checks of the model version marker in the data store,
+    # 0 only reads it when the worker starts
+    model_version_poll_seconds = float(os.environ.get('MODEL_VERSION_POLL_SECONDS', "60"))
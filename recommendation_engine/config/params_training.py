@@ -18,3 +18,9 @@ hidden_dims = [200, 100]
 loss_hidden = 'binary_crossentropy'
 activation = 'sigmoid'
 min_iter_pmf = 1
+# Number of the best packages of every training stack kept in the top-K table
+top_k_table_size = 100
+# Number of the most similar items of every item kept for the item neighbours scoring mode
+item_neighbours_count = 50
+# Similarity of the item neighbours, cosine or inner_product
+item_neighbours_metric = 'cosine'
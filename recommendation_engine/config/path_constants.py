@@ -12,6 +12,17 @@ TEMPORARY_LATENT_PATH = os.path.join(TEMPORARY_MODEL_PATH, 'latent_pretrain_all'
 TEMPORARY_SDAE_PATH = os.path.join(TEMPORARY_MODEL_PATH, 'train')
 TEMPORARY_CVAE_PATH = os.path.join(TEMPORARY_MODEL_PATH, 'cvae')
 TEMPORARY_PMF_PATH = os.path.join(TEMPORARY_MODEL_PATH, 'pmf-packagedata.mat')
+TEMPORARY_SERVING_MODEL_PATH = os.path.join(TEMPORARY_PATH, 'pmf-serving-model.bin')
+TEMPORARY_TOP_K_TABLE_PATH = os.path.join(TEMPORARY_PATH, 'pmf-top-k.bin')
+TEMPORARY_ITEM_NEIGHBOURS_PATH = os.path.join(TEMPORARY_PATH, 'pmf-item-neighbours.bin')
+LOCAL_ARTIFACT_PATH = os.environ.get('LOCAL_ARTIFACT_PATH', '/tmp/serving-artifacts/')
+ARTIFACT_CACHE_PATH = os.environ.get('ARTIFACT_CACHE_PATH', '/tmp/artifact-cache/')
+# Data store object naming the model version every worker serves, MODEL_VERSION until written.
+MODEL_VERSION_MARKER_PATH = os.environ.get('MODEL_VERSION_MARKER_PATH',
+                                           'serving-model-version.json')
+# Directory the gunicorn workers share their metrics through, every worker publishes its own
+# metrics when empty.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
 TEMPORARY_USER_ITEM_FILEPATH = os.path.join(TEMPORARY_DATA_PATH,
                                             "packagedata-train-" + str(num_users) + "-users.dat")
 TEMPORARY_ITEM_USER_FILEPATH = os.path.join(TEMPORARY_DATA_PATH,
@@ -25,3 +36,11 @@ PMF_MODEL_PATH = os.path.join(MODEL_VERSION, 'intermediate-model/cvae-model', 'p
 PACKAGE_TO_ID_MAP = os.path.join(MODEL_VERSION, 'trained-model/package_to_index_map.json')
 ID_TO_PACKAGE_MAP = os.path.join(MODEL_VERSION, 'trained-model/index_to_package_map.json')
 PACKAGE_TAG_MAP = os.path.join(MODEL_VERSION, 'trained-model/package_tag_map.json')
+SERVING_MODEL_PATH = os.path.join(MODEL_VERSION, 'trained-model/pmf-serving-model.bin')
+TOP_K_TABLE_PATH = os.path.join(MODEL_VERSION, 'trained-model/pmf-top-k.bin')
+ITEM_NEIGHBOURS_PATH = os.path.join(MODEL_VERSION, 'trained-model/pmf-item-neighbours.bin')
+
+
+def versioned_path(path, model_version):
+    """Get the path of a model artifact for another model version than MODEL_VERSION."""
+    return os.path.join(model_version, os.path.relpath(path, MODEL_VERSION))
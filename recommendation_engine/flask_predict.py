@@ -17,37 +17,305 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import hmac
+import math
 import os
+import time
 
 import flask
 from flask import Flask, request
+from recommendation_engine.predictor.model_manager import ModelManager
+from recommendation_engine.predictor.model_registry import ModelRegistry, ModelLoadBackoff
 from recommendation_engine.predictor.online_recommendation import PMFRecommendation
-from rudra.data_store.aws import AmazonS3
+from rudra.data_store.local_data_store import LocalDataStore
 import recommendation_engine.config.cloud_constants as cloud_constants
 from recommendation_engine.config.cloud_constants import USE_CLOUD_SERVICES
 from recommendation_engine.config.params_scoring import ScoringParams
+from recommendation_engine.config.path_constants import MODEL_VERSION, ARTIFACT_CACHE_PATH, \
+    MODEL_VERSION_MARKER_PATH, METRICS_DIR
+from recommendation_engine.utils.admission import AdmissionControl
+from recommendation_engine.utils.artifact_cache import ArtifactCache
+from recommendation_engine.utils.fileutils import object_exists, write_json
+from recommendation_engine.utils.metrics import REGISTRY, SIZE_BUCKETS, PROMETHEUS_CONTENT_TYPE
+from recommendation_engine.utils.micro_batcher import MicroBatcher
+from recommendation_engine.utils.s3_data_store import StreamingAmazonS3
+from recommendation_engine.utils.scoring_pool import ScoringPool
 from raven.contrib.flask import Sentry
 import logging
 
 app = Flask(__name__)
 
-if USE_CLOUD_SERVICES:
-    s3 = AmazonS3(bucket_name=cloud_constants.S3_BUCKET_NAME,  # pragma: no cover
-                  aws_access_key_id=cloud_constants.AWS_S3_ACCESS_KEY_ID,
-                  aws_secret_access_key=cloud_constants.AWS_S3_SECRET_KEY_ID)
-    s3.connect()
-else:
-    from rudra.data_store.local_data_store import LocalDataStore
-    s3 = LocalDataStore('tests/test_data/')
-    ScoringParams.num_latent_factors = 5
+
+def _data_store(bucket):
+    """Connect to the bucket of an ecosystem and to the local cache of its artifacts."""
+    if USE_CLOUD_SERVICES:
+        store = StreamingAmazonS3(bucket_name=bucket,  # pragma: no cover
+                                  aws_access_key_id=cloud_constants.AWS_S3_ACCESS_KEY_ID,
+                                  aws_secret_access_key=cloud_constants.AWS_S3_SECRET_KEY_ID)
+        store.connect()
+        return store, ArtifactCache(store, ARTIFACT_CACHE_PATH)  # pragma: no cover
+    return LocalDataStore(bucket), None
+
+
+# The ecosystem of CHESTER_SCORING_REGION is served out of the default bucket, the others out of
+# the buckets of ECOSYSTEM_BUCKETS.
+DEFAULT_ECOSYSTEM = os.environ.get("CHESTER_SCORING_REGION")
+if not USE_CLOUD_SERVICES:
+    ScoringParams.num_latent_factors = 50
+data_stores = {ecosystem: _data_store(bucket)
+               for ecosystem, bucket in cloud_constants.ECOSYSTEM_BUCKETS.items()}
+data_stores[DEFAULT_ECOSYSTEM] = _data_store(
+    cloud_constants.S3_BUCKET_NAME if USE_CLOUD_SERVICES else 'tests/test_data/')
+s3, artifact_cache = data_stores[DEFAULT_ECOSYSTEM]
+
+# Scoring runs on OS threads under gevent workers, see ScoringPool. Models are loaded, validated
+# and warmed up on an OS thread of their own, so that a reload does not hold up scoring.
+scoring_pool = ScoringPool(ScoringParams.scoring_threads)
+loading_pool = ScoringPool(1)
+
+
+def _load_recommender(ecosystem, model_version):
+    data_store, ecosystem_artifact_cache = data_stores[ecosystem]
+    return PMFRecommendation(ScoringParams.recommendation_threshold,
+                             data_store,
+                             ScoringParams.num_latent_factors,
+                             model_version=model_version,
+                             artifact_cache=ecosystem_artifact_cache)
+
 
 # This needs to be global as ~200MB of data is loaded from S3 every time an object of this class
-# is instantiated.
-recommender = PMFRecommendation(ScoringParams.recommendation_threshold,
-                                s3,
-                                ScoringParams.num_latent_factors)
+# is instantiated. It is loaded in the background, so the worker answers the liveness probe
+# right away and the readiness probe once the model is loaded and warmed up.
+model_manager = ModelManager(lambda model_version: _load_recommender(DEFAULT_ECOSYSTEM,
+                                                                     model_version),
+                             run=loading_pool.run,
+                             retry_seconds=ScoringParams.model_load_retry_seconds,
+                             on_swap=lambda previous, recommender: recommender.prune_superseded(
+                                 previous))
+
+
+def _marked_model_version():
+    """Get the model version named by the marker in the default bucket, None without a marker."""
+    if not object_exists(MODEL_VERSION_MARKER_PATH, s3):
+        return None
+    return s3.read_json_file(MODEL_VERSION_MARKER_PATH).get('model_version')
+
+
+# Every worker of every pod serves the model version of the marker, also after a restart.
+try:
+    initial_model_version = _marked_model_version() or MODEL_VERSION
+except Exception:
+    app.logger.exception("Could not read the model version marker, serving {}".format(
+        MODEL_VERSION))
+    initial_model_version = MODEL_VERSION
+model_manager.reload_async(initial_model_version)
+if ScoringParams.model_version_poll_seconds > 0:
+    model_manager.watch(lambda: _marked_model_version() or MODEL_VERSION,
+                        ScoringParams.model_version_poll_seconds)
+else:
+    # Without polling the marker, a failed load of the first model version is still retried.
+    model_manager.watch(lambda: None if model_manager.ready else initial_model_version,
+                        ScoringParams.model_load_retry_seconds)
+
+# The models of the other ecosystems and model versions are loaded when first asked for.
+model_registry = ModelRegistry(
+    _load_recommender, ScoringParams.models_memory_budget_mb * 2 ** 20,
+    exists=lambda ecosystem, model_version: PMFRecommendation.model_version_exists(
+        data_stores[ecosystem][0], model_version),
+    estimate=lambda ecosystem, model_version: PMFRecommendation.estimate_nbytes(
+        data_stores[ecosystem][0], model_version),
+    retry_seconds=ScoringParams.model_load_retry_seconds, run=loading_pool.run)
+model_registry.pin(DEFAULT_ECOSYSTEM, None, model_manager)
+
+request_seconds = REGISTRY.histogram('recommendation_request_seconds',
+                                     'Time spent serving a companion recommendation request.')
+batch_size = REGISTRY.histogram('recommendation_batch_size',
+                                'Number of stacks in a companion recommendation request.',
+                                buckets=SIZE_BUCKETS)
+rejected_requests = REGISTRY.counter('recommendation_rejected_requests_total',
+                                     'Companion recommendation requests turned away.',
+                                     ('reason',))
+micro_batch_size = REGISTRY.histogram('recommendation_micro_batch_size',
+                                      'Number of requests scored together by the micro-batcher.',
+                                      buckets=SIZE_BUCKETS)
+
+
+def _result_cache_stats():
+    recommender = model_manager.recommender
+    if recommender is None:
+        return {}
+    stats = recommender.result_cache.stats()
+    return {(event,): stats[event] for event in ('hits', 'misses', 'evictions')}
+
+
+def _score_requests(batch):
+    """Score the (recommender, ecosystem, stacks, thresholds, deadline) requests of a micro-batch.
+
+    The requests are grouped by recommender and ecosystem, as requests may
+    select other models and a model reload can swap one in the middle of a
+    window, and every group is scored as one batch. When a group fails, its
+    requests are scored one by one, so that only the ones failing on their
+    own get the exception.
+    """
+    micro_batch_size.observe(len(batch))
+    groups = {}
+    for position, (recommender, ecosystem, *_) in enumerate(batch):
+        groups.setdefault((id(recommender), ecosystem),
+                          (recommender, ecosystem, []))[2].append(position)
+    responses = [None] * len(batch)
+    for recommender, ecosystem, positions in groups.values():
+        try:
+            group_responses = recommender.predict_requests_json(
+                [batch[position][2:] for position in positions], ecosystem=ecosystem)
+        except Exception:
+            app.logger.exception("Micro-batch of {} requests failed, scoring them one by one"
+                                 .format(len(positions)))
+            group_responses = [_score_request(recommender, ecosystem, batch[position][2:])
+                               for position in positions]
+        for position, response in zip(positions, group_responses):
+            responses[position] = response
+    return responses
+
+
+def _score_request(recommender, ecosystem, recommendation_request):
+    """Score a request of a failed micro-batch, returning the exception if it fails too."""
+    try:
+        return recommender.predict_requests_json([recommendation_request],
+                                                 ecosystem=ecosystem)[0]
+    except Exception as e:
+        return e
+
+
+# Concurrent requests are only scored together when a micro-batching window is configured.
+micro_batcher = None
+if ScoringParams.micro_batch_window_ms > 0:
+    micro_batcher = MicroBatcher(lambda batch: scoring_pool.run(_score_requests, batch),
+                                 ScoringParams.micro_batch_window_ms / 1000,
+                                 ScoringParams.micro_batch_max_stacks)
+
+
+def _parse_stacks(recommendation_requests):
+    """Get the stacks and the companion thresholds of a request.
+
+    They are checked before scoring, as a stack that cannot be scored would
+    otherwise fail every request micro-batched with it.
+
+    :returns: The list of stacks and the list of their thresholds, None for
+              the default threshold.
+    :raises ValueError: If a stack is not a list of package names or a
+                        threshold not an integer.
+    """
+    if not isinstance(recommendation_requests, list):
+        raise ValueError("The request must be a list of stacks")
+    stacks, thresholds = [], []
+    for recommendation_request in recommendation_requests:
+        if not isinstance(recommendation_request, dict):
+            raise ValueError("Every stack must be an object")
+        stack = recommendation_request.get('package_list')
+        if not isinstance(stack, list):
+            raise ValueError("package_list must be a list of package names")
+        if not all(isinstance(package, str) for package in stack):
+            raise ValueError("package_list must be a list of package names")
+        threshold = recommendation_request.get('comp_package_count_threshold')
+        if threshold is not None and type(threshold) is not int:
+            raise ValueError("comp_package_count_threshold must be an integer")
+        stacks.append(stack)
+        thresholds.append(threshold)
+    return stacks, thresholds
+
+
+def _request_deadline(start, recommendation_requests):
+    """Get the time a request has to be scored by out of its time budget.
+
+    The budget is the smallest of the X-Time-Budget-Ms header and the
+    time_budget_ms fields of the stacks, ScoringParams.time_budget_ms if
+    the request sets none.
+
+    :start: The time.monotonic() value the request arrived at.
+    :returns: The time.monotonic() deadline, or None for no deadline.
+    :raises ValueError: If a budget is not a positive number of milliseconds.
+    """
+    budgets = [recommendation_request['time_budget_ms']
+               for recommendation_request in recommendation_requests
+               if 'time_budget_ms' in recommendation_request]
+    if 'X-Time-Budget-Ms' in request.headers:
+        budgets.append(request.headers['X-Time-Budget-Ms'])
+    try:
+        budgets = [float(budget) for budget in budgets]
+    except TypeError:
+        raise ValueError("Time budgets must be numbers")
+    if not budgets and ScoringParams.time_budget_ms > 0:
+        budgets = [ScoringParams.time_budget_ms]
+    if not budgets:
+        return None
+    if not min(budgets) > 0:
+        raise ValueError("Time budgets must be positive")
+    return start + min(budgets) / 1000
+
+
+# Requests over capacity are turned away right away rather than queued until they time out.
+admission_control = AdmissionControl(ScoringParams.max_in_flight_requests)
+
+
+def _overloaded():
+    rejected_requests.inc(reason='overloaded')
+    response = flask.jsonify({"error": "Too many requests in flight, retry later"})
+    response.headers['Retry-After'] = str(ScoringParams.retry_after_seconds)
+    return response, 503
+
+
+def _not_ready(manager):
+    response = flask.jsonify({"error": "The model is still being loaded",
+                              "last_reload_error": manager.last_reload_error})
+    response.headers['Retry-After'] = str(ScoringParams.retry_after_seconds)
+    return response, 503
+
+
+def _valid_model_version(model_version):
+    return bool(model_version) and not model_version.startswith('/') and '..' not in model_version
+
+
+def _selected_model():
+    """Get the ecosystem and the manager of the model a request selects.
+
+    The ecosystem and model_version query parameters select the model, the
+    model being served for CHESTER_SCORING_REGION by default.
+
+    :returns: The ecosystem and the ModelManager of the model.
+    :raises LookupError: If the ecosystem is not served or does not hold the
+                         model version.
+    :raises ModelLoadBackoff: If the model failed to load and is not loaded
+                              again yet.
+    :raises ValueError: If the model version is not valid.
+    """
+    ecosystem = request.args.get('ecosystem', DEFAULT_ECOSYSTEM)
+    model_version = request.args.get('model_version')
+    if ecosystem not in data_stores:
+        raise LookupError("Ecosystem {} is not served".format(ecosystem))
+    if model_version is not None and not _valid_model_version(model_version):
+        raise ValueError("A valid model_version is required")
+    if ecosystem == DEFAULT_ECOSYSTEM and model_version in (None, model_manager.model_version):
+        return ecosystem, model_manager
+    return ecosystem, model_registry.get(ecosystem, model_version or MODEL_VERSION)
+
+
+REGISTRY.gauge('recommendation_result_cache_events',
+               'Result cache hits, misses and evictions of the served model.', ('event',),
+               callback=_result_cache_stats)
+REGISTRY.gauge('recommendation_model_bytes',
+               'Memory held by the models loaded for every ecosystem and model version.',
+               ('ecosystem', 'model_version'),
+               callback=lambda: {(model["ecosystem"] or "", model["model_version"]): model["nbytes"]
+                                 for model in model_registry.status() if model["ready"]})
+REGISTRY.gauge('recommendation_requests_in_flight',
+               'Companion recommendation requests being served, waiting to be scored included.',
+               callback=lambda: {(): admission_control.in_flight})
+if METRICS_DIR:
+    REGISTRY.share(METRICS_DIR)
 
 SENTRY_DSN = os.environ.get("SENTRY_DSN", "")
+# Token the model reload requests have to send as a bearer token, reloads are refused without it.
+MODEL_RELOAD_TOKEN = os.environ.get("MODEL_RELOAD_TOKEN", "")
 sentry = Sentry(app, dsn=SENTRY_DSN, logging=True, level=logging.ERROR)
 app.logger.info('App initialized, ready to roll...')
 
@@ -60,7 +328,15 @@ def liveness():
 
 @app.route('/api/v1/readiness', methods=['GET'])
 def readiness():
-    """Define the readiness probe."""
+    """Define the readiness probe, ready once the model is loaded and warmed up.
+
+    The probe is answered by whichever worker accepts it, so a pod can be
+    ready while another of its workers is still loading its model and
+    answers 503 to the requests it accepts.
+    """
+    if not model_manager.ready:
+        return flask.jsonify({"status": "loading",
+                              "error": model_manager.last_reload_error}), 503
     return flask.jsonify({"status": "ready"}), 200
 
 
@@ -68,19 +344,91 @@ def readiness():
 def recommendation():
     """Endpoint to serve recommendations."""
     app.logger.info("Executed companion recommendation")
-    global recommender
-    response_json = []
-    for recommendation_request in request.json:
-        missing, recommendations, ip_package_to_topic_dict = recommender.predict(
-                recommendation_request['package_list'],
-                companion_threshold=recommendation_request['comp_package_count_threshold'])
-        response_json.append({
-            "missing_packages": missing,
-            "companion_packages": recommendations,
-            "ecosystem": os.environ.get("CHESTER_SCORING_REGION"),
-            "package_to_topic_dict": ip_package_to_topic_dict
-        })
-    return flask.jsonify(response_json), 200
+    start = time.monotonic()
+    with request_seconds.time(), admission_control.admit() as admitted:
+        if not admitted:
+            return _overloaded()
+        try:
+            ecosystem, manager = _selected_model()
+        except LookupError as e:
+            return flask.jsonify({"error": str(e)}), 404
+        except ModelLoadBackoff as e:
+            response = flask.jsonify({"error": "The model failed to load: {}".format(e)})
+            response.headers['Retry-After'] = str(int(math.ceil(e.retry_after)))
+            return response, 503
+        except ValueError as e:
+            return flask.jsonify({"error": str(e)}), 400
+        # Hold on to the model so a concurrent reload does not change it under this request.
+        recommender = manager.recommender
+        if recommender is None:
+            return _not_ready(manager)
+        recommendation_requests = request.get_json(silent=True)
+        if isinstance(recommendation_requests, list):
+            batch_size.observe(len(recommendation_requests))
+            if 0 < ScoringParams.max_stacks_per_request < len(recommendation_requests):
+                rejected_requests.inc(reason='too_many_stacks')
+                return flask.jsonify({"error": "A request holds at most {} stacks".format(
+                    ScoringParams.max_stacks_per_request)}), 413
+        try:
+            stacks, thresholds = _parse_stacks(recommendation_requests)
+            deadline = _request_deadline(start, recommendation_requests)
+        except ValueError as e:
+            rejected_requests.inc(reason='invalid')
+            return flask.jsonify({"error": str(e)}), 400
+        if micro_batcher is None:
+            response_json = scoring_pool.run(
+                recommender.predict_batch_json, stacks, thresholds,
+                ecosystem=ecosystem, deadline=deadline)
+        else:
+            response_json = micro_batcher.submit(
+                (recommender, ecosystem, stacks, thresholds, deadline), size=len(stacks))
+        response = flask.Response(response_json, mimetype='application/json')
+    return response, 200
+
+
+@app.route('/api/v1/metrics', methods=['GET'])
+def metrics():
+    """Publish the service metrics in the Prometheus text format."""
+    return flask.Response(REGISTRY.render(), mimetype=PROMETHEUS_CONTENT_TYPE), 200
+
+
+@app.route('/api/v1/model', methods=['GET'])
+def model_status():
+    """Describe the model being served and the state of its result cache."""
+    status = model_manager.status()
+    recommender = model_manager.recommender
+    status["result_cache"] = recommender.result_cache.stats() if recommender else None
+    status["models"] = model_registry.status()
+    return flask.jsonify(status), 200
+
+
+@app.route('/api/v1/model/reload', methods=['POST'])
+def reload_model():
+    """Have every worker load a new model version and serve it once it is validated.
+
+    The model version is written to the marker of the data store, which
+    every worker checks every MODEL_VERSION_POLL_SECONDS, and this worker
+    starts loading it right away, also when it failed to load before. The
+    answer is 202 when the load started, 200 when the model version is
+    already served and 409 when another model version is being loaded.
+    """
+    token = request.headers.get('Authorization', '')
+    if not MODEL_RELOAD_TOKEN or not hmac.compare_digest(token, 'Bearer ' + MODEL_RELOAD_TOKEN):
+        return flask.jsonify({"error": "A valid reload token is required"}), 403
+    model_version = (request.get_json(silent=True) or {}).get('model_version', '')
+    if not _valid_model_version(model_version):
+        return flask.jsonify({"error": "A valid model_version is required"}), 400
+    if not PMFRecommendation.model_version_exists(s3, model_version):
+        return flask.jsonify({"error": "Model version {} is not available".format(
+            model_version)}), 404
+    write_json(MODEL_VERSION_MARKER_PATH, {"model_version": model_version}, s3)
+    app.logger.info("Reloading model version {}".format(model_version))
+    if model_version == model_manager.model_version:
+        return flask.jsonify(dict(model_manager.status(), reload="already_served")), 200
+    if not model_manager.check_version(lambda: model_version, force=True):
+        # The marker is checked again once the model version being loaded is served.
+        return flask.jsonify(dict(model_manager.status(), reload="in_progress")), 409
+    return flask.jsonify(dict(model_manager.status(), reload="started")), 202
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module contains the latent item matrix used to score user vectors.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+SCORING_PRECISIONS = ('float64', 'float32', 'int8')
+
+
+class ItemFactorMatrix:
+    """The latent item matrix (m_V) stored in the precision used for scoring.
+
+    With float64 or float32 the matrix is kept as an array of that dtype,
+    with int8 every item vector is quantized to int8 with its own scale and
+    dequantized block by block while scoring.
+    """
+
+    def __init__(self, m_V, precision='float32', block_size=8192):
+        """Create the scoring matrix.
+
+        :m_V: The latent item matrix, one row per item.
+        :precision: One of float64, float32 or int8.
+        :block_size: The number of int8 items dequantized at once while scoring.
+        """
+        if precision not in SCORING_PRECISIONS:
+            raise ValueError("Unknown scoring precision {}, use one of {}".format(
+                precision, SCORING_PRECISIONS))
+        self.precision = precision
+        self.block_size = block_size
+        if precision == 'int8':
+            m_V = np.asarray(m_V, dtype=np.float32)
+            scales = np.abs(m_V).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self.matrix = np.round(m_V / scales[:, None]).astype(np.int8)
+            self.scales = scales
+        else:
+            # Keeps a memory-mapped matrix mapped when it already has the right dtype.
+            self.matrix = np.asarray(m_V, dtype=precision)
+            self.scales = None
+
+    @classmethod
+    def from_arrays(cls, arrays, name, block_size=8192):
+        """Get the matrix stored under name by `to_arrays` out of a dict of arrays.
+
+        The arrays are used as they are, so a matrix read from a memory-mapped
+        array bundle stays mapped.
+        """
+        item_matrix = cls.__new__(cls)
+        item_matrix.matrix = arrays[name]
+        item_matrix.scales = arrays.get(name + "_scales")
+        item_matrix.precision = 'int8' if item_matrix.scales is not None else \
+            item_matrix.matrix.dtype.name
+        item_matrix.block_size = block_size
+        return item_matrix
+
+    def to_arrays(self, name):
+        """Get the arrays of the matrix as a dict, to store them under name."""
+        arrays = {name: self.matrix}
+        if self.scales is not None:
+            arrays[name + "_scales"] = self.scales
+        return arrays
+
+    @property
+    def shape(self):
+        """Get the number of items and latent factors."""
+        return self.matrix.shape
+
+    @property
+    def nbytes(self):
+        """Get the memory size of the matrix and its scales."""
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __getitem__(self, key):
+        """Get the (dequantized) vectors of a selection of items, like m_V[items, :]."""
+        rows = self.matrix[key]
+        if self.scales is None:
+            return rows
+        item_key = key[0] if isinstance(key, tuple) else key
+        scales = self.scales[item_key]
+        return rows * (scales[..., None] if rows.ndim > np.ndim(scales) else scales)
+
+    def score(self, user_matrix):
+        """Multiply user vectors with every item vector.
+
+        :user_matrix: A users x latent factors matrix.
+        :returns: A users x items matrix of scores.
+        """
+        dtype = np.float32 if self.precision == 'int8' else self.matrix.dtype
+        user_matrix = np.asarray(user_matrix, dtype=dtype)
+        if self.scales is None:
+            return np.dot(user_matrix, self.matrix.T)
+        scores = np.empty((user_matrix.shape[0], self.matrix.shape[0]), dtype=np.float32)
+        for start in range(0, self.matrix.shape[0], self.block_size):
+            block = self.matrix[start:start + self.block_size].astype(np.float32)
+            scores[:, start:start + self.block_size] = np.dot(user_matrix, block.T)
+        scores *= self.scales
+        return scores
+
+
+def top_k_overlap(m_V, user_matrix, precision, k):
+    """Compare the top-k items of a scoring precision with the float64 ones.
+
+    :m_V: The latent item matrix.
+    :user_matrix: The user vectors to score, one per row.
+    :precision: The scoring precision to check.
+    :k: The number of top items to compare.
+    :returns: The fraction of the float64 top-k items also in the top-k of
+              the precision, for every user.
+    """
+    k = min(k, m_V.shape[0])
+    exact = ItemFactorMatrix(m_V, 'float64').score(user_matrix)
+    reduced = ItemFactorMatrix(m_V, precision).score(user_matrix)
+    exact_top = np.argpartition(-exact, k - 1, axis=1)[:, :k]
+    reduced_top = np.argpartition(-reduced, k - 1, axis=1)[:, :k]
+    return np.array([len(np.intersect1d(exact_row, reduced_row)) / k
+                     for exact_row, reduced_row in zip(exact_top, reduced_top)])
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module contains the item-item neighbour lists of an alternative scoring mode.
+
+Copyright © 2018 Red Hat Inc.
+
+This module contains the item-item neighbour lists of an alternative scoring mode.
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This module contains the item-item neighbour lists of an alternative scoring mode.
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+from scipy.io import loadmat
+
+from recommendation_engine.utils.array_bundle import write_array_bundle, read_array_bundle
+
+NEIGHBOUR_METRICS = ('cosine', 'inner_product')
+# Number of items whose neighbours are computed with a single matrix multiply.
+NEIGHBOUR_BLOCK_SIZE = 1024
+
+
+class ItemNeighbours:
+    """The closest items of every item of m_V, stored as CSR arrays.
+
+    Row i lists the neighbours of item i, most similar first, along with
+    their similarities; only the neighbours with a positive similarity are
+    kept. A stack is scored by summing the neighbour lists of its items,
+    which costs a few hundred additions instead of a fold-in and a product
+    with the whole item matrix.
+    """
+
+    def __init__(self, indptr, indices, similarities):
+        """Create the neighbour lists out of their CSR arrays."""
+        self.indptr = indptr
+        self.indices = indices
+        self.similarities = similarities
+
+    @classmethod
+    def compute(cls, m_V, num_neighbours=50, metric='cosine', block_size=NEIGHBOUR_BLOCK_SIZE):
+        """Find the num_neighbours most similar items of every item, block by block.
+
+        :m_V: The latent item matrix, one row per item.
+        :metric: cosine, or inner_product to favour the items with large vectors.
+        """
+        if metric not in NEIGHBOUR_METRICS:
+            raise ValueError("Unknown neighbour metric {}, use one of {}".format(
+                metric, NEIGHBOUR_METRICS))
+        vectors = np.asarray(m_V, dtype=np.float32)
+        if metric == 'cosine':
+            norms = np.linalg.norm(vectors, axis=1)
+            vectors = vectors / np.where(norms > 0, norms, 1)[:, None]
+        num_items = len(vectors)
+        num_neighbours = max(0, min(num_neighbours, num_items - 1))
+        lengths = np.zeros(num_items, dtype=np.int64)
+        indices, similarities = [], []
+        for start in range(0, num_items, block_size):
+            block = np.dot(vectors[start:start + block_size], vectors.T)
+            rows = np.arange(len(block))
+            # An item is not its own neighbour.
+            block[rows, rows + start] = -np.inf
+            if 0 < num_neighbours < num_items - 1:
+                top = np.argpartition(-block, num_neighbours - 1, axis=1)[:, :num_neighbours]
+            else:
+                top = np.argsort(-block, axis=1, kind='stable')[:, :num_neighbours]
+            top_similarities = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_similarities, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_similarities = np.take_along_axis(top_similarities, order, axis=1)
+            kept = top_similarities > 0
+            lengths[start:start + len(block)] = kept.sum(axis=1)
+            indices.append(top[kept])
+            similarities.append(top_similarities[kept])
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        return cls(indptr, np.concatenate(indices + [[]]).astype(np.int32),
+                   np.concatenate(similarities + [[]]).astype(np.float32))
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map neighbour lists saved to a local file."""
+        arrays = read_array_bundle(path)
+        return cls(arrays["indptr"], arrays["indices"], arrays["similarities"])
+
+    def save(self, path):
+        """Save the neighbour lists to a local file."""
+        write_array_bundle(path, {"indptr": self.indptr, "indices": self.indices,
+                                  "similarities": self.similarities})
+
+    def __len__(self):
+        """Get the number of items."""
+        return len(self.indptr) - 1
+
+    def score(self, stack, count):
+        """Score the neighbours of the items of a stack.
+
+        :stack: The package ids of the stack, left out of the result.
+        :count: The number of packages wanted.
+        :returns: A (package ids, summed similarities) tuple, best first, with
+                  at most count packages.
+        """
+        stack = np.unique(np.asarray(stack, dtype=np.int64))
+        starts, ends = self.indptr[stack], self.indptr[stack + 1]
+        lengths = ends - starts
+        positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths),
+                                                         lengths)
+        neighbours, inverse = np.unique(self.indices[positions], return_inverse=True)
+        scores = np.bincount(inverse, weights=self.similarities[positions],
+                             minlength=len(neighbours))
+        candidates = ~np.isin(neighbours, stack)
+        neighbours, scores = neighbours[candidates], scores[candidates]
+        # Ties go to the lowest package id, the neighbours being sorted.
+        top = np.argsort(-scores, kind='stable')[:max(count, 0)]
+        return neighbours[top].astype(np.int64), scores[top]
+
+
+def export_item_neighbours(pmf_model_path, path, num_neighbours, metric='cosine'):
+    """Compute the neighbour lists of the items of the trained matlab model and save them."""
+    ItemNeighbours.compute(loadmat(pmf_model_path)["m_V"], num_neighbours, metric).save(path)
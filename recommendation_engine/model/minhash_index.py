@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module contains a MinHash index finding the most similar training stacks.
+
+Copyright © 2018 Red Hat Inc.
+
+This module contains a MinHash index finding the most similar training stacks.
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This module contains a MinHash index finding the most similar training stacks.
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+# The Mersenne prime the hash functions work modulo, larger than any package id.
+_PRIME = (1 << 31) - 1
+
+
+class MinHashStackIndex:
+    """Locality sensitive hashing index of the training stacks for the Jaccard similarity.
+
+    Every stack gets a signature of num_perm minimum hashes of its package
+    ids, two stacks agreeing on each of them with a probability equal to
+    their Jaccard similarity. The signatures are cut into num_bands bands
+    and the stacks agreeing on a whole band share a bucket of it. A query
+    is only compared with the stacks sharing at least one bucket with it,
+    so similar stacks are found without a scan over all the stacks. Only
+    the sorted band keys and the stack indices of the buckets are kept.
+    """
+
+    def __init__(self, stacks, num_perm=64, num_bands=16, max_candidates=256, seed=0):
+        """Hash every non empty stack into the buckets of every band.
+
+        :stacks: The RatingMatrix of the training stacks.
+        :num_perm: The number of hash functions of the signatures.
+        :num_bands: The number of bands, num_perm has to be a multiple of it.
+        :max_candidates: The largest number of stacks compared with a query.
+        """
+        if num_perm % num_bands:
+            raise ValueError("The {} permutations do not split into {} bands".format(
+                num_perm, num_bands))
+        self.stacks = stacks
+        self.num_bands = num_bands
+        self.band_rows = num_perm // num_bands
+        self.max_candidates = max_candidates
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+        # Odd multipliers mixing the rows of a band into a single key.
+        self._mixers = rng.randint(0, 1 << 62, size=self.band_rows).astype(np.uint64) * \
+            np.uint64(2) + np.uint64(1)
+        self._stack_sizes = stacks.lengths
+        hashed = np.flatnonzero(self._stack_sizes > 0)
+        keys = self._band_keys(self._signatures(stacks.indices, stacks.indptr[hashed]))
+        order = np.argsort(keys, axis=0, kind='stable')
+        self._bucket_keys = np.take_along_axis(keys, order, axis=0).T.copy()
+        self._bucket_stacks = hashed[order].astype(np.int32).T.copy()
+
+    def _signatures(self, package_ids, starts):
+        """Get the signatures of the stacks whose package ids start at starts."""
+        package_ids = np.asarray(package_ids, dtype=np.uint64)
+        signatures = np.empty((len(starts), len(self._a)), dtype=np.uint64)
+        if len(starts) == 0:
+            return signatures
+        for perm, (a, b) in enumerate(zip(self._a, self._b)):
+            signatures[:, perm] = np.minimum.reduceat((a * package_ids + b) % _PRIME, starts)
+        return signatures
+
+    def _band_keys(self, signatures):
+        """Mix the rows of every band of the signatures into a 32 bits key."""
+        bands = signatures.reshape(len(signatures), self.num_bands, self.band_rows)
+        return ((bands * self._mixers).sum(axis=2) >> np.uint64(32)).astype(np.uint32)
+
+    def query(self, stack, min_jaccard):
+        """Find the training stack most similar to a stack.
+
+        :stack: The package ids of the stack.
+        :min_jaccard: The smallest Jaccard similarity a match may have.
+        :returns: The index of the most similar of the candidate stacks, the
+                  lowest one among equally similar stacks, or None if none
+                  is similar enough.
+        """
+        stack = np.unique(np.asarray(stack, dtype=np.int64))
+        if stack.size == 0:
+            return None
+        keys = self._band_keys(self._signatures(stack, [0]))[0]
+        buckets = []
+        for band, key in enumerate(keys):
+            start = np.searchsorted(self._bucket_keys[band], key, side='left')
+            end = np.searchsorted(self._bucket_keys[band], key, side='right')
+            buckets.append(self._bucket_stacks[band, start:min(end, start + self.max_candidates)])
+        candidates, votes = np.unique(np.concatenate(buckets), return_counts=True)
+        if candidates.size == 0:
+            return None
+        if candidates.size > self.max_candidates:
+            # The stacks sharing the most buckets with the query are the likely similar ones.
+            candidates = np.sort(candidates[np.argsort(-votes, kind='stable')
+                                            [:self.max_candidates]])
+        sizes = self._stack_sizes[candidates]
+        offsets = np.cumsum(sizes) - sizes
+        positions = np.arange(sizes.sum()) + np.repeat(self.stacks.indptr[candidates] - offsets,
+                                                       sizes)
+        shared = np.add.reduceat(np.isin(self.stacks.indices[positions], stack), offsets)
+        similarities = shared / (stack.size + sizes - shared)
+        best = int(np.argmax(similarities))
+        if similarities[best] < min_jaccard:
+            return None
+        return int(candidates[best])
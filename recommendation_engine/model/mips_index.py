@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module contains an approximate maximum inner product index over item vectors.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+
+class IVFInnerProductIndex:
+    """Inverted file index returning the items with the largest inner product with a query.
+
+    Every item vector x gets the extra coordinate sqrt(M^2 - |x|^2), M being
+    the largest item norm, so that all augmented items have the same norm and
+    the largest inner product with a query (extended with a 0) is also the
+    smallest euclidean distance. The augmented items are clustered with
+    k-means into nlist inverted lists and a query only scores the items of
+    the nprobe lists whose centroids are the closest to it.
+    """
+
+    def __init__(self, item_vectors, nlist, num_iterations=10, sample_size=256, seed=0):
+        """Cluster the item vectors into nlist inverted lists.
+
+        :item_vectors: The latent item matrix, or anything indexable like
+                       m_V[items, :] with a shape.
+        :nlist: The number of inverted lists.
+        :num_iterations: The number of k-means iterations.
+        :sample_size: The number of items per list used to fit k-means.
+        """
+        self.item_vectors = item_vectors
+        num_items = item_vectors.shape[0]
+        self.nlist = max(1, min(nlist, num_items))
+        vectors = np.asarray(item_vectors[np.arange(num_items), :], dtype=np.float32)
+        augmented = self._augment(vectors)
+        rng = np.random.RandomState(seed)
+        fit_items = rng.choice(num_items, size=min(num_items, self.nlist * sample_size),
+                               replace=False)
+        self.centroids = self._kmeans(augmented[fit_items], num_iterations, rng)
+        assignments = self._assign(augmented)
+        self.list_items = np.argsort(assignments, kind='stable')
+        self.list_offsets = np.searchsorted(assignments[self.list_items],
+                                            np.arange(self.nlist + 1))
+
+    @staticmethod
+    def _augment(vectors):
+        squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+        extra = np.sqrt(np.maximum(squared_norms.max() - squared_norms, 0))
+        return np.hstack([vectors, extra[:, None]])
+
+    def _assign(self, augmented, centroids=None, block_size=65536):
+        centroids = self.centroids if centroids is None else centroids
+        centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+        assignments = np.empty(len(augmented), dtype=np.int64)
+        for start in range(0, len(augmented), block_size):
+            block = augmented[start:start + block_size]
+            distances = centroid_norms - 2 * np.dot(block, centroids.T)
+            assignments[start:start + block_size] = np.argmin(distances, axis=1)
+        return assignments
+
+    def _kmeans(self, augmented, num_iterations, rng):
+        centroids = augmented[rng.choice(len(augmented), size=self.nlist, replace=False)]
+        for _ in range(num_iterations):
+            assignments = self._assign(augmented, centroids)
+            counts = np.bincount(assignments, minlength=self.nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, augmented)
+            empty = counts == 0
+            centroids = sums / np.maximum(counts, 1)[:, None]
+            # Restart empty lists from random items so that no list stays unused.
+            centroids[empty] = augmented[rng.choice(len(augmented), size=int(empty.sum()))]
+        return centroids
+
+    def search(self, user_vector, nprobe):
+        """Score the items of the lists closest to a user vector.
+
+        :user_vector: The latent user vector.
+        :nprobe: The number of inverted lists to score.
+        :returns: The ids of the scored items and their scores.
+        """
+        query = np.append(np.asarray(user_vector, dtype=np.float32).ravel(), 0)
+        centroid_distances = np.einsum('ij,ij->i', self.centroids, self.centroids) - \
+            2 * np.dot(self.centroids, query)
+        nprobe = max(1, min(nprobe, self.nlist))
+        probed = np.argpartition(centroid_distances, nprobe - 1)[:nprobe]
+        candidates = np.concatenate([
+            self.list_items[self.list_offsets[probe]:self.list_offsets[probe + 1]]
+            for probe in probed])
+        scores = np.dot(np.asarray(self.item_vectors[candidates, :], dtype=np.float32),
+                        query[:-1])
+        return candidates, scores
@@ -19,23 +19,47 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import numpy as np
-import scipy
+import scipy.linalg
 
 from recommendation_engine.config.params_scoring import ScoringParams
+from recommendation_engine.utils.rating_matrix import RatingMatrix
 
 
 class PMFScoring:
     """This class defines the PMF scoring logic.
 
     This is decoupled from the training logic to run inside openshift without using tensorflow.
+    A new user vector is the solution of the same linear system the training
+    solves for every user:
+
+        (b * V_r^T V_r + lambda_u * I + (a - b) * V_s^T V_s) u = a * sum(V_s)
+
+    where V_r holds the latent vectors of the items rated by at least one
+    user and V_s the ones of the items in the user's stack.
     """
 
     def __init__(self, model_dict, items):
-        """Create an instance of PMF scoring."""
+        """Create an instance of PMF scoring.
+
+        The stack independent part of the system and its Cholesky factorization
+        are computed here, so an instance should be created once per model.
+
+        :model_dict: The model matrices, m_V is the only one used.
+        :items: The item to user rating lists, used to find the rated items.
+        """
         self.params = ScoringParams()
         self.m_V = model_dict["m_V"]
         self.m_U = model_dict["m_U"]
         self.items = items
+        if isinstance(items, RatingMatrix):
+            rated_items = np.flatnonzero(items.lengths)
+        else:
+            rated_items = np.array([idx for idx, users in enumerate(items) if len(users) > 0],
+                                   dtype=np.int64)
+        rated_item_vectors = np.asarray(self.m_V[rated_items, :], dtype=np.float64)
+        self.gram = self.params.b * np.dot(rated_item_vectors.T, rated_item_vectors) + \
+            self.params.lambda_u * np.eye(self.m_V.shape[1])
+        self.gram_factor = scipy.linalg.cho_factor(self.gram)
 
     def predict_transform(self, user_item_vector, num_latent):
         """Create this users' m_U vector.
@@ -44,11 +68,29 @@ class PMFScoring:
         can then be multiplied by the latent item space mapping
         to get the recommendations for this user.
 
+        The stack only adds a rank len(stack) term to the precomputed system,
+        which is applied with the Woodbury identity while the stack is smaller
+        than the number of latent factors.
+
         :user_vector: A list containing the items in the users' stack.
         :num_latent: The number of latent factors to use.
         :returns: A numpy array containing the user vector calculated
                   based on the latent item vectors.
         """
-        # VV^T for v_j that has at least one user liked
-        x = self.params.a * np.sum(self.m_V[user_item_vector, :], axis=0)
-        return scipy.linalg.solve(self.params.a, x).reshape(1, num_latent)
+        stack_vectors = np.asarray(self.m_V[np.unique(user_item_vector), :], dtype=np.float64)
+        x = self.params.a * np.sum(stack_vectors, axis=0)
+        weight = self.params.a - self.params.b
+        if weight == 0 or len(stack_vectors) == 0:
+            user_vector = scipy.linalg.cho_solve(self.gram_factor, x)
+        elif len(stack_vectors) < num_latent:
+            gram_inv_x = scipy.linalg.cho_solve(self.gram_factor, x)
+            gram_inv_stack = scipy.linalg.cho_solve(self.gram_factor, stack_vectors.T)
+            capacitance = np.eye(len(stack_vectors)) / weight + np.dot(stack_vectors,
+                                                                       gram_inv_stack)
+            correction = scipy.linalg.solve(capacitance, np.dot(stack_vectors, gram_inv_x),
+                                            assume_a='sym')
+            user_vector = gram_inv_x - np.dot(gram_inv_stack, correction)
+        else:
+            user_vector = scipy.linalg.solve(
+                self.gram + weight * np.dot(stack_vectors.T, stack_vectors), x, assume_a='pos')
+        return user_vector.reshape(1, num_latent)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module contains the serving model artifact written after training.
+
+The artifact is an array bundle holding m_U, m_V, m_theta and the package
+names in id order, so the scoring service can memory-map it instead of
+parsing the matlab file and the JSON id maps in every worker.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+
+import numpy as np
+from scipy.io import loadmat
+
+from recommendation_engine.utils.array_bundle import write_array_bundle, read_array_bundle
+from recommendation_engine.utils.string_table import PackageNameIndex, StringTable
+
+MODEL_MATRICES = ("m_U", "m_V", "m_theta")
+
+
+def save_serving_model(path, model_dict, id_to_package_map):
+    """Write the serving model artifact.
+
+    :path: The local path of the artifact.
+    :model_dict: A dict with the m_U, m_V and m_theta matrices, matrices that
+                 are not numeric (like an unset m_theta) are left out.
+    :id_to_package_map: The package-id to name mapping, keyed by the
+                        stringified id as in index_to_package_map.json.
+    """
+    arrays = {}
+    for name in MODEL_MATRICES:
+        matrix = np.asarray(model_dict.get(name))
+        if matrix.dtype.kind in 'fiu':
+            arrays[name] = matrix
+    package_names = [id_to_package_map[str(idx)] for idx in range(len(id_to_package_map))]
+    arrays.update(PackageNameIndex.from_strings(package_names).to_arrays("package_names"))
+    write_array_bundle(path, arrays)
+
+
+def export_serving_model(pmf_model_path, id_to_package_map_path, path):
+    """Convert the trained matlab model and the id map into a serving model artifact."""
+    with open(id_to_package_map_path) as id_to_package_map:
+        save_serving_model(path, loadmat(pmf_model_path), json.load(id_to_package_map))
+
+
+def load_serving_model(path):
+    """Memory-map the serving model artifact.
+
+    :path: The local path of the artifact.
+    :returns: A dict with the read-only m_U, m_V and m_theta matrices (None
+              when m_theta was not stored) and the PackageNameIndex of the
+              package names as "package_index".
+    """
+    arrays = read_array_bundle(path)
+    model_dict = {name: arrays.get(name) for name in MODEL_MATRICES}
+    if "package_names_order" in arrays:
+        model_dict["package_index"] = PackageNameIndex.from_arrays(arrays, "package_names")
+    else:
+        # Artifacts exported before the index was added only hold the names in id order.
+        model_dict["package_index"] = PackageNameIndex.from_strings(
+            StringTable.from_arrays(arrays, "package_names"))
+    return model_dict
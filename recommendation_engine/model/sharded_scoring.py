@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module contains the scoring of an item matrix split into shards served by other processes.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+
+import daiquiri
+import numpy as np
+
+from recommendation_engine.model.item_factors import ItemFactorMatrix
+from recommendation_engine.utils.array_bundle import read_array_bundle
+from recommendation_engine.utils.metrics import REGISTRY
+
+daiquiri.setup(level=logging.WARNING)
+_logger = daiquiri.getLogger(__name__)
+_shard_restarts = REGISTRY.counter('recommendation_scoring_shard_restarts_total',
+                                   'Scoring shard processes restarted after they died or hung.')
+
+
+def top_k_rows(scores, counts, item_ids):
+    """Select the best scoring items of every row of a score matrix.
+
+    :scores: A users x items matrix of scores, the items to leave out
+             being set to -inf.
+    :counts: The number of items wanted for every row.
+    :item_ids: The ids of the columns of the matrix.
+    :returns: A list with an (item ids, scores) tuple per row, best first,
+              ties going to the lowest id.
+    """
+    selected = []
+    for row, count in zip(scores, counts):
+        count = min(max(count, 0), len(row))
+        candidates = np.argpartition(-row, count - 1)[:count] if 0 < count < len(row) else \
+            np.arange(len(row))[:count]
+        candidates = candidates[np.isfinite(row[candidates])]
+        ids, row_scores = item_ids[candidates], row[candidates]
+        order = np.lexsort((ids, -row_scores))
+        selected.append((ids[order], row_scores[order]))
+    return selected
+
+
+def serve_shard(connection, path, name, start, end):
+    """Score user vectors against a shard of the items until asked to stop.
+
+    Every request is a (sequence number, user matrix, stacks, counts) tuple
+    and gets back (sequence number, "ok", selected) with the selection of
+    `top_k_rows` for every user, or (sequence number, "error", message).
+    None stops the loop. The connection is a pipe to the process the shard
+    was started by.
+
+    :path: The array bundle holding the item matrix, see ShardedItemScorer.
+    :name: The name the item matrix is stored under in the bundle.
+    :start: The id of the first item of the shard.
+    :end: The id following the last item of the shard.
+    """
+    # Only the rows of the shard are mapped in, straight from the page cache.
+    arrays = {key: array[start:end] for key, array in read_array_bundle(path).items()
+              if key in (name, name + "_scales")}
+    item_matrix = ItemFactorMatrix.from_arrays(arrays, name)
+    item_ids = np.arange(start, end)
+    while True:
+        request = connection.recv()
+        if request is None:
+            connection.close()
+            return
+        sequence = request[0]
+        try:
+            _, user_matrix, new_user_stacks, counts = request
+            scores = item_matrix.score(user_matrix)
+            for row, new_user_stack in zip(scores, new_user_stacks):
+                local = np.asarray(new_user_stack, dtype=np.int64) - start
+                row[local[(local >= 0) & (local < len(item_ids))]] = -np.inf
+            connection.send((sequence, "ok", top_k_rows(scores, counts, item_ids)))
+        except Exception as e:
+            connection.send((sequence, "error", "{}: {}".format(type(e).__name__, e)))
+
+
+class ShardedItemScorer:
+    """Score user vectors against an item matrix split into shards of consecutive items.
+
+    The item matrix is read from an array bundle in its scoring precision,
+    which every worker of a node maps from the same file, see
+    `write_shared_array_bundle`. Every shard is served by a process of its
+    own memory-mapping only its rows of the bundle, so the pages of every
+    item are held once by the page cache however many processes read them.
+
+    A scoring request is sent to all the shards before any reply is read,
+    so they score in parallel, and the best items of every shard are merged
+    into the overall best items. Requests of concurrent callers are served
+    one after the other. A shard that does not reply in time, or whose
+    process died, is started again and the request fails, so that the
+    caller scores it some other way; the late replies of a restarted or
+    slow shard are told apart by their sequence number and dropped.
+    """
+
+    def __init__(self, path, num_shards, name="m_V", timeout_seconds=5):
+        """Start the shard processes.
+
+        :path: The array bundle holding the item matrix, one row per item.
+        :num_shards: The number of shards, at most the number of items.
+        :name: The name the item matrix is stored under in the bundle.
+        :timeout_seconds: The number of seconds a request waits for the
+                          shards at most when it has no earlier deadline.
+        """
+        self.path = path
+        self.name = name
+        self.timeout_seconds = timeout_seconds
+        num_items = read_array_bundle(path)[name].shape[0]
+        self.num_items = num_items
+        self.boundaries = np.linspace(0, num_items, max(1, min(num_shards, num_items)) + 1)\
+            .astype(np.int64)
+        # Spawned processes do not inherit the threads and the event loop of the worker.
+        self._context = multiprocessing.get_context('spawn')
+        self._connections = []
+        self._processes = []
+        for shard in range(len(self.boundaries) - 1):
+            self._connections.append(None)
+            self._processes.append(None)
+            self._start(shard)
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _start(self, shard):
+        connection, shard_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=serve_shard, name='scoring-shard-{}'.format(shard),
+            args=(shard_connection, self.path, self.name, int(self.boundaries[shard]),
+                  int(self.boundaries[shard + 1])),
+            daemon=True)
+        process.start()
+        shard_connection.close()
+        self._connections[shard] = connection
+        self._processes[shard] = process
+
+    def _restart(self, shard):
+        _logger.warning("Restarting scoring shard {}".format(shard))
+        _shard_restarts.inc()
+        self._connections[shard].close()
+        if self._processes[shard].is_alive():
+            # A hung shard may not even handle a SIGTERM.
+            self._processes[shard].kill()
+        self._processes[shard].join(timeout=5)
+        self._start(shard)
+
+    @property
+    def num_shards(self):
+        """Get the number of shards."""
+        return len(self._processes)
+
+    def _send(self, shard, request):
+        try:
+            self._connections[shard].send(request)
+        except (OSError, EOFError):
+            self._restart(shard)
+            self._connections[shard].send(request)
+
+    def _receive(self, shard, sequence, wait_until):
+        connection = self._connections[shard]
+        try:
+            while connection.poll(max(wait_until - time.monotonic(), 0)):
+                reply = connection.recv()
+                if reply[0] == sequence:
+                    return reply[1:]
+        except (OSError, EOFError):
+            self._restart(shard)
+            raise RuntimeError("Scoring shard {} died".format(shard))
+        # A hung shard would stall every later request of the worker as well.
+        self._restart(shard)
+        raise RuntimeError("Scoring shard {} did not reply in time".format(shard))
+
+    def top_k(self, user_matrix, new_user_stacks, counts, deadline=None):
+        """Get the best items of every user vector, leaving out the items of its stack.
+
+        :deadline: The time.monotonic() value to wait for the shards until at
+                   most, timeout_seconds from now by default.
+        :returns: A list with a (item ids, scores) tuple per user vector, best first.
+        :raises RuntimeError: If a shard failed to score the request in time.
+        """
+        with self._lock:
+            self._sequence += 1
+            request = (self._sequence, np.asarray(user_matrix),
+                       [np.asarray(stack) for stack in new_user_stacks], list(counts))
+            wait_until = time.monotonic() + self.timeout_seconds
+            if deadline is not None:
+                wait_until = min(wait_until, deadline)
+            try:
+                for shard in range(self.num_shards):
+                    self._send(shard, request)
+                replies = [self._receive(shard, self._sequence, wait_until)
+                           for shard in range(self.num_shards)]
+            except (OSError, EOFError) as e:
+                raise RuntimeError("Scoring shards failed: {}".format(e))
+        errors = [message for status, message in replies if status != "ok"]
+        if errors:
+            raise RuntimeError("Scoring shards failed: {}".format("; ".join(errors)))
+        merged = []
+        for row, count in enumerate(counts):
+            ids = np.concatenate([selected[row][0] for _, selected in replies])
+            scores = np.concatenate([selected[row][1] for _, selected in replies])
+            order = np.lexsort((ids, -scores))[:max(count, 0)]
+            merged.append((ids[order], scores[order]))
+        return merged
+
+    def close(self):
+        """Stop the shard processes, the bundle is left to the other workers mapping it."""
+        with self._lock:
+            for connection, process in zip(self._connections, self._processes):
+                try:
+                    connection.send(None)
+                    connection.close()
+                except (OSError, ValueError):
+                    pass
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self._connections, self._processes = [], []
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This module contains the table of the best scoring packages of every training stack.
+
+The table is computed after training and stored as an array bundle next to
+the serving model, so the service memory-maps it and serves precomputed
+stacks without scoring the whole item matrix.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+from scipy.io import loadmat
+
+from recommendation_engine.model.item_factors import ItemFactorMatrix
+from recommendation_engine.utils.array_bundle import write_array_bundle, read_array_bundle
+
+# Number of users scored with a single matrix multiply while computing the table.
+TOP_K_BLOCK_SIZE = 1024
+
+
+class TopKTable:
+    """The K best scoring packages of every user of m_U, best first, with their scores.
+
+    The recommendations of a precomputed stack are then a slice of its row
+    instead of a product with the whole item matrix. K has to leave room
+    for the packages of the incoming stack that are filtered out.
+    """
+
+    def __init__(self, ids, logits):
+        """Create a table out of users x K arrays of package ids and scores."""
+        self.ids = ids
+        self.logits = logits
+
+    @classmethod
+    def compute(cls, user_matrix, item_matrix, k, block_size=TOP_K_BLOCK_SIZE):
+        """Score every user vector against every item, block by block.
+
+        :user_matrix: The latent user matrix (m_U).
+        :item_matrix: The ItemFactorMatrix the service scores with.
+        :k: The number of packages kept per user, at most the number of items.
+        :block_size: The number of users scored at once.
+        """
+        num_users, num_items = len(user_matrix), item_matrix.shape[0]
+        k = min(k, num_items)
+        ids = np.empty((num_users, k), dtype=np.int32)
+        logits = np.empty((num_users, k), dtype=np.float32)
+        for start in range(0, num_users, block_size):
+            scores = item_matrix.score(np.asarray(user_matrix[start:start + block_size]))
+            if k < num_items:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(num_items), (len(scores), 1))
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            ids[start:start + block_size] = np.take_along_axis(top, order, axis=1)
+            logits[start:start + block_size] = np.take_along_axis(top_scores, order, axis=1)
+        return cls(ids, logits)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a table saved to a local file."""
+        arrays = read_array_bundle(path)
+        return cls(arrays["ids"], arrays["logits"])
+
+    def save(self, path):
+        """Save the table to a local file."""
+        write_array_bundle(path, {"ids": self.ids, "logits": self.logits})
+
+    @property
+    def k(self):
+        """Get the number of packages kept per user."""
+        return self.ids.shape[1]
+
+    def __len__(self):
+        """Get the number of users."""
+        return len(self.ids)
+
+    def top(self, user, exclude, count):
+        """Get the best packages of a user leaving out some packages.
+
+        :user: The row of the user in m_U.
+        :exclude: The package ids to leave out, like the ones of the stack.
+        :count: The number of packages wanted.
+        :returns: A (package ids, scores) tuple, or None when the row is too
+                  short to hold count packages once exclude is left out.
+        """
+        ids = self.ids[user]
+        kept = np.flatnonzero(~np.isin(ids, exclude))[:count]
+        if len(kept) < count:
+            return None
+        return ids[kept].astype(np.int64), self.logits[user, kept]
+
+
+def export_top_k_table(pmf_model_path, path, k, precision='float32'):
+    """Compute the top-K table of the trained matlab model and save it.
+
+    :precision: The scoring precision of the service, so the table holds the
+                scores the service would compute.
+    """
+    model_dict = loadmat(pmf_model_path)
+    TopKTable.compute(model_dict["m_U"], ItemFactorMatrix(model_dict["m_V"], precision),
+                      k).save(path)
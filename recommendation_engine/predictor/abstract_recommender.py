@@ -19,6 +19,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
+import json
 from abc import abstractmethod, ABCMeta
 
 
@@ -31,3 +32,28 @@ class AbstractRecommender:
     def predict(self, _user_stack, _companion_threshold):
         """Generate companion recommendation for this user's stack."""
         raise NotImplementedError()
+
+    def predict_batch(self, _user_stacks, _companion_thresholds=None):
+        """Generate companion recommendations for several stacks."""
+        if _companion_thresholds is None:
+            _companion_thresholds = [None] * len(_user_stacks)
+        return [self.predict(user_stack, companion_threshold)
+                for user_stack, companion_threshold in zip(_user_stacks, _companion_thresholds)]
+
+    def predict_batch_json(self, _user_stacks, _companion_thresholds=None, ecosystem=None,
+                           deadline=None):
+        """Generate companion recommendations for several stacks as the JSON API response.
+
+        Recommenders without cheaper scoring paths ignore the deadline.
+        """
+        return json.dumps([{
+            "missing_packages": missing,
+            "companion_packages": recommendations,
+            "ecosystem": ecosystem,
+            "package_to_topic_dict": package_topic_dict
+        } for missing, recommendations, package_topic_dict in self.predict_batch(
+            _user_stacks, _companion_thresholds)], sort_keys=True)
+
+    def warm_up(self):
+        """Exercise the recommender before it starts serving requests."""
+        pass
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains the holder of the model that is being served.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import threading
+import time
+
+import daiquiri
+
+from recommendation_engine.utils.metrics import REGISTRY
+
+daiquiri.setup(level=logging.WARNING)
+_logger = daiquiri.getLogger(__name__)
+_model_load_seconds = REGISTRY.gauge('recommendation_model_load_seconds',
+                                     'Time it took to load and validate a model version.',
+                                     ('model_version',))
+
+
+class ModelManager:
+    """Hold the recommender being served and swap in newly trained model versions.
+
+    A new model version is loaded, validated and warmed up in a background
+    thread while the current one keeps serving. The swap is a single
+    reference assignment, so a request that fetched `recommender` before the
+    swap finishes on the old model and the next one gets the new model.
+    Until the first model version has been swapped in the manager is not
+    ready and `recommender` is None.
+
+    Every worker process has a manager of its own. To have all of them
+    serve the same model version, each one watches the model version named
+    by a marker in the data store and loads it when it changes, see `watch`.
+    A model version that failed to load is loaded again once a backoff
+    doubling with every failure in a row has passed, and given up on after
+    max_failures failures in a row.
+    """
+
+    def __init__(self, loader, run=None, retry_seconds=60, max_failures=5, on_swap=None):
+        """Create a new manager.
+
+        :loader: A callable that builds a recommender for a model version.
+        :run: A callable running a function with its arguments and returning
+              its result, like ScoringPool.run, that builds, validates and
+              warms up the models; they are built in place by default.
+        :retry_seconds: The backoff after the first failure of a model version.
+        :max_failures: The number of failures in a row after which a model
+                       version is only loaded again when forced.
+        :on_swap: A callable called with the previous and the new recommender
+                  once a model version replaced another one.
+        """
+        self._loader = loader
+        self._run = run if run is not None else lambda func, *args: func(*args)
+        self.retry_seconds = retry_seconds
+        self.max_failures = max_failures
+        self._on_swap = on_swap
+        self._served = (None, None)
+        self._reload_lock = threading.Lock()
+        self.last_reload_error = None
+        # (model version, time of its last failure, failures in a row) of the last failed load.
+        self._failure = None
+        self._ready = threading.Event()
+
+    @property
+    def recommender(self):
+        """Get the recommender being served."""
+        return self._served[1]
+
+    @property
+    def model_version(self):
+        """Get the version of the model being served."""
+        return self._served[0]
+
+    @property
+    def reloading(self):
+        """Check whether a model version is being loaded."""
+        return self._reload_lock.locked()
+
+    @property
+    def ready(self):
+        """Check whether a model is loaded, validated and warmed up."""
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout=None):
+        """Block until a model is being served.
+
+        :timeout: The number of seconds to wait at most, forever by default.
+        :returns: True if a model is being served.
+        """
+        return self._ready.wait(timeout)
+
+    def load(self, model_version):
+        """Load, validate and warm up a model version, then start serving it.
+
+        :model_version: The model version to load.
+        """
+        start = time.perf_counter()
+        recommender = self._run(self._build, model_version)
+        _model_load_seconds.set(time.perf_counter() - start, model_version=model_version)
+        previous = self.recommender
+        self._served = (model_version, recommender)
+        self._ready.set()
+        _logger.warning("Serving model version {}".format(model_version))
+        if self._on_swap is not None and previous is not None:
+            try:
+                self._on_swap(previous, recommender)
+            except Exception:
+                _logger.exception("Could not clean up after swapping in model version {}".format(
+                    model_version))
+
+    def _build(self, model_version):
+        recommender = self._loader(model_version)
+        recommender.validate()
+        recommender.warm_up()
+        return recommender
+
+    def reload_async(self, model_version):
+        """Load a model version in the background and swap it in once warmed up.
+
+        This also loads the first model version, so that the worker can
+        answer the health probes while the model is being loaded.
+
+        :model_version: The model version to load.
+        :returns: False if another model version is already being loaded.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._reload, args=(model_version,), daemon=True).start()
+        return True
+
+    def _reload(self, model_version):
+        try:
+            self.load(model_version)
+            self.last_reload_error = None
+            self._failure = None
+        except Exception as e:
+            _logger.exception("Could not reload model version {}".format(model_version))
+            self.last_reload_error = "{}: {}".format(model_version, e)
+            failed_version, _, count = self._failure or (None, None, 0)
+            count = count + 1 if failed_version == model_version else 1
+            self._failure = (model_version, time.monotonic(), count)
+            if count >= self.max_failures:
+                _logger.error("Gave up on model version {} after {} failures in a row".format(
+                    model_version, count))
+        finally:
+            self._reload_lock.release()
+
+    def _backing_off(self, model_version):
+        if self._failure is None or self._failure[0] != model_version:
+            return False
+        _, failed_at, count = self._failure
+        if count >= self.max_failures:
+            return True
+        return time.monotonic() < failed_at + self.retry_seconds * 2 ** min(count - 1, 6)
+
+    def check_version(self, read_version, force=False):
+        """Load the model version read unless it is served or backing off after failing to load.
+
+        :read_version: A callable returning the model version to serve, None
+                       to keep the one being served.
+        :force: Whether to load a model version that is backing off anyway.
+        :returns: True if a reload of the model version was started.
+        """
+        try:
+            model_version = read_version()
+        except Exception:
+            _logger.exception("Could not read the model version to serve")
+            return False
+        if model_version in (None, self.model_version):
+            return False
+        if not force and self._backing_off(model_version):
+            return False
+        return self.reload_async(model_version)
+
+    def watch(self, read_version, interval_seconds):
+        """Check the model version to serve every interval in the background.
+
+        :read_version: A callable returning the model version to serve, see
+                       `check_version`.
+        :interval_seconds: The number of seconds between two checks.
+        """
+        def check_forever():
+            while True:
+                time.sleep(interval_seconds)
+                self.check_version(read_version)
+        threading.Thread(target=check_forever, name='model-version-watcher', daemon=True).start()
+
+    def status(self):
+        """Get the state of the served model as a dict."""
+        return {
+            "model_version": self.model_version,
+            "ready": self.ready,
+            "reloading": self.reloading,
+            "last_reload_error": self.last_reload_error
+        }
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains the registry of the models served for several ecosystems and model versions.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import daiquiri
+
+from recommendation_engine.predictor.model_manager import ModelManager
+from recommendation_engine.utils.metrics import REGISTRY
+
+daiquiri.setup(level=logging.WARNING)
+_logger = daiquiri.getLogger(__name__)
+_model_unloads = REGISTRY.counter('recommendation_model_unloads_total',
+                                  'Models unloaded to stay within the model memory budget.')
+
+
+class ModelLoadBackoff(RuntimeError):
+    """A model that failed to load, not loaded again until its backoff has passed."""
+
+    def __init__(self, message, retry_after):
+        """Create the error.
+
+        :retry_after: The number of seconds until the model is loaded again.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelRegistry:
+    """Serve the models of several ecosystems and model versions from one process.
+
+    A model is keyed by its ecosystem and model version, and is loaded in
+    the background by a ModelManager of its own the first time it is asked
+    for; the caller gets a manager that is not ready yet until then. Only
+    the model versions the data store of the ecosystem holds are loaded.
+
+    The memory budget is the one of all the models together. The memory a
+    model needs is estimated before it is loaded and reserved until it is
+    loaded and its actual size known, so that concurrent loads do not get
+    past the budget together. When the models hold more than the budget,
+    the least recently asked for ones are unloaded, pinned and loading ones
+    never, and a model that does not fit even then is not loaded until the
+    others leave room for it. An unloaded model is only freed once the
+    requests still scoring on it are done.
+
+    A model that failed to load is dropped, and the failure remembered, so
+    that it is only loaded again once a backoff doubling with every failure
+    in a row has passed. Model versions missing from the data store are
+    remembered the same way, so asking for them does not reach the data
+    store every time.
+    """
+
+    def __init__(self, loader, total_budget_bytes=0, exists=None, retry_seconds=60,
+                 max_failures=256, run=None, estimate=None):
+        """Create an empty registry.
+
+        :loader: A callable that builds a recommender for an ecosystem and a
+                 model version.
+        :total_budget_bytes: The memory the loaded models may hold together,
+                             0 for no limit.
+        :exists: A callable checking whether the data store of an ecosystem
+                 holds a model version, every version is loaded by default.
+        :retry_seconds: The backoff after the first failure of a model, and
+                        the time a model that does not fit is retried after.
+        :max_failures: The number of failed models remembered at most.
+        :run: The callable the models are built on, see ModelManager.
+        :estimate: A callable estimating the memory the model of an ecosystem
+                   and a model version needs before it is loaded, 0 by default.
+        """
+        self._loader = loader
+        self.total_budget_bytes = total_budget_bytes
+        self._exists = exists
+        self._estimate = estimate
+        self.retry_seconds = retry_seconds
+        self.max_failures = max_failures
+        self._run = run
+        self._managers = OrderedDict()
+        self._pinned = set()
+        # (ecosystem, model_version) -> the memory estimated for the model before it was loaded
+        self._estimates = {}
+        # (ecosystem, model_version) -> (time of the last failure, failures in a row, error,
+        # whether the data store holds the model version)
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def pin(self, ecosystem, model_version, manager):
+        """Serve a model that is loaded elsewhere and never unloaded, like the default one.
+
+        :ecosystem: The ecosystem of the model.
+        :model_version: The model version of the model.
+        :manager: The ModelManager holding the model.
+        """
+        with self._lock:
+            self._managers[(ecosystem, model_version)] = manager
+            self._pinned.add((ecosystem, model_version))
+
+    def get(self, ecosystem, model_version):
+        """Get the manager of a model, loading the model if it is not loaded yet.
+
+        :ecosystem: The ecosystem of the model.
+        :model_version: The model version of the model.
+        :returns: The ModelManager of the model, not ready while it is loaded.
+        :raises LookupError: If the data store does not hold the model version.
+        :raises ModelLoadBackoff: If the model failed to load and its backoff
+                                  has not passed yet.
+        """
+        key = (ecosystem, model_version)
+        with self._lock:
+            self._drop_failed()
+            manager = self._managers.get(key)
+            if manager is not None:
+                return self._use(key, manager)
+            self._check_backoff(key)
+        # The data store is not reached while holding the lock.
+        exists = self._exists is None or self._exists(ecosystem, model_version)
+        estimate = self._estimate(ecosystem, model_version) \
+            if exists and self._estimate is not None else 0
+        with self._lock:
+            manager = self._managers.get(key)
+            if manager is not None:
+                return self._use(key, manager)
+            if not exists:
+                self._record_failure(key, "Model version {} of {} is not available".format(
+                    model_version, ecosystem), exists)
+                self._check_backoff(key)
+            if not self._unload_least_recently_used(list(self._managers.items()), estimate):
+                raise ModelLoadBackoff(
+                    "Model version {} of {} needs {} bytes, more than the memory budget has "
+                    "left".format(model_version, ecosystem, estimate), self.retry_seconds)
+            manager = ModelManager(lambda version: self._loader(ecosystem, version), self._run)
+            manager.reload_async(model_version)
+            self._managers[key] = manager
+            self._estimates[key] = estimate
+            _logger.warning("Loading model version {} of {}".format(model_version, ecosystem))
+            return self._use(key, manager)
+
+    def _use(self, key, manager):
+        if manager.ready:
+            self._failures.pop(key, None)
+        self._managers.move_to_end(key)
+        # The model asked for last is at the end and is never unloaded to make room.
+        self._unload_least_recently_used(list(self._managers.items())[:-1])
+        return manager
+
+    def _record_failure(self, key, error, exists=True):
+        _, count, _, _ = self._failures.pop(key, (None, 0, None, None))
+        self._failures[key] = (time.monotonic(), count + 1, error, exists)
+        while len(self._failures) > self.max_failures:
+            self._failures.popitem(last=False)
+
+    def _check_backoff(self, key):
+        if key not in self._failures:
+            return
+        failed_at, count, error, exists = self._failures[key]
+        retry_after = failed_at + self.retry_seconds * 2 ** min(count - 1, 6) - time.monotonic()
+        if retry_after <= 0:
+            return
+        if not exists:
+            raise LookupError(error)
+        raise ModelLoadBackoff(error, retry_after)
+
+    def _drop_failed(self):
+        for key, manager in list(self._managers.items()):
+            if key in self._pinned or manager.ready or manager.reloading:
+                continue
+            del self._managers[key]
+            self._estimates.pop(key, None)
+            self._record_failure(key, manager.last_reload_error)
+            _logger.warning("Dropped model version {} of {} that failed to load".format(
+                key[1], key[0]))
+
+    def _nbytes(self, key, manager):
+        """Get the memory held by a model, the memory estimated for it while it is loaded."""
+        recommender = manager.recommender
+        if recommender is not None:
+            return recommender.nbytes
+        return self._estimates.get(key, 0) if manager.reloading else 0
+
+    @property
+    def nbytes(self):
+        """Get the memory held by the models loaded and reserved for the ones being loaded."""
+        with self._lock:
+            return sum(self._nbytes(key, manager) for key, manager in self._managers.items())
+
+    def _unload_least_recently_used(self, candidates, reserve=0):
+        """Unload models out of candidates, least recently used first, until the rest fit.
+
+        :candidates: The (key, manager) pairs that may be unloaded, in LRU order.
+        :reserve: The memory to leave room for besides the models.
+        :returns: True if the models and reserve fit in the budget.
+        """
+        if self.total_budget_bytes <= 0:
+            return True
+        total = reserve + sum(self._nbytes(key, manager)
+                              for key, manager in self._managers.items())
+        for key, manager in candidates:
+            if total <= self.total_budget_bytes:
+                break
+            if key in self._pinned or manager.reloading or not manager.ready:
+                continue
+            total -= self._nbytes(key, manager)
+            del self._managers[key]
+            self._estimates.pop(key, None)
+            _model_unloads.inc()
+            _logger.warning("Unloaded model version {} of {}".format(key[1], key[0]))
+        return total <= self.total_budget_bytes
+
+    def status(self):
+        """Get the state of the models in least recently used order, as a list of dicts."""
+        with self._lock:
+            self._drop_failed()
+            managers = list(self._managers.items())
+        return [dict(manager.status(), ecosystem=ecosystem, requested_version=model_version,
+                     pinned=(ecosystem, model_version) in self._pinned,
+                     nbytes=self._nbytes((ecosystem, model_version), manager))
+                for (ecosystem, model_version), manager in managers]
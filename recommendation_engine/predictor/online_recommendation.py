@@ -17,20 +17,55 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import hashlib
+import json
 import logging
-import sys
+import os
+import time
+import weakref
 import daiquiri
 import numpy as np
+from rudra.data_store.local_data_store import LocalDataStore
 from recommendation_engine.config.params_scoring import ScoringParams
 from recommendation_engine.config.path_constants import PMF_MODEL_PATH, PACKAGE_TAG_MAP, \
-    ITEM_USER_FILEPATH, PRECOMPUTED_MANIFEST_PATH, ID_TO_PACKAGE_MAP, PACKAGE_TO_ID_MAP
+    ITEM_USER_FILEPATH, PRECOMPUTED_MANIFEST_PATH, ID_TO_PACKAGE_MAP, \
+    SERVING_MODEL_PATH, TOP_K_TABLE_PATH, ITEM_NEIGHBOURS_PATH, LOCAL_ARTIFACT_PATH, \
+    MODEL_VERSION, versioned_path
+from recommendation_engine.model.item_factors import ItemFactorMatrix
+from recommendation_engine.model.item_neighbours import ItemNeighbours
+from recommendation_engine.model.minhash_index import MinHashStackIndex
+from recommendation_engine.model.mips_index import IVFInnerProductIndex
 from recommendation_engine.model.pmf_prediction import PMFScoring
+from recommendation_engine.model.serving_model import load_serving_model
+from recommendation_engine.model.sharded_scoring import ShardedItemScorer
+from recommendation_engine.model.top_k_table import TopKTable
 from recommendation_engine.predictor.abstract_recommender import AbstractRecommender
-from recommendation_engine.utils.fileutils import load_rating
+from recommendation_engine.utils.array_bundle import read_array_bundle, \
+    write_shared_array_bundle
+from recommendation_engine.utils.fileutils import load_rating_matrix, object_exists, \
+    object_size, get_local_copy, rating_path
+from recommendation_engine.utils.lru_cache import LRUCache
+from recommendation_engine.utils.metrics import REGISTRY
+from recommendation_engine.utils.string_table import PackageNameIndex, StringTable
 from recommendation_engine.config.cloud_constants import S3_BUCKET_NAME
 
 daiquiri.setup(level=logging.WARNING)
 _logger = daiquiri.getLogger(__name__)
+_stage_seconds = REGISTRY.histogram('recommendation_stage_seconds',
+                                    'Time spent in every stage of scoring a stack.', ('stage',))
+_scoring_paths = REGISTRY.counter('recommendation_scoring_path_total',
+                                  'Number of stacks served by every scoring path.', ('path',))
+_shard_failovers = REGISTRY.counter('recommendation_scoring_shard_failovers_total',
+                                    'Scoring passes done in the worker after the shards failed.')
+# The scoring paths that do not depend on the time left, the only ones cached.
+_CACHED_PATHS = ('precomputed', 'similar_user', 'fold_in', 'item_neighbours')
+SCORING_MODES = ('pmf', 'item_neighbours')
+# Weight of the latest measurement in the moving averages of the cost of the scoring stages.
+_COST_SMOOTHING = 0.2
+# Number of decoded topic lists kept, the ones of the packages recommended most often.
+TOPIC_CACHE_SIZE = 4096
+# Number of stack indices counted at most when looking for the nearest precomputed stack.
+NEAREST_USER_MAX_POSTINGS = 1 << 16
 
 
 class PMFRecommendation(AbstractRecommender):
@@ -42,26 +77,184 @@ class PMFRecommendation(AbstractRecommender):
     precomputed latent item vectors.
     """
 
-    def __init__(self, M, data_store, num_latent=ScoringParams.num_latent_factors):
+    def __init__(self, M, data_store, num_latent=ScoringParams.num_latent_factors,
+                 model_version=MODEL_VERSION, artifact_cache=None):
         """Construct a new instance.
 
         :M: This parameter controls the number of recommendations that will
             be served by the PMF model.
+        :model_version: The version of the model to load from the data store.
+        :artifact_cache: An optional ArtifactCache of data_store, the model
+                         artifacts are then fetched concurrently into it and
+                         loaded from the local copies.
         """
         AbstractRecommender.__init__(self)
         self._M = M
         self.num_latent = num_latent
+        self.model_version = model_version
         self.user_matrix = None
         self.latent_item_rep_mat = None
         self.weight_matrix = None
+        has_serving_model = object_exists(self._path(SERVING_MODEL_PATH), data_store)
+        has_top_k_table = object_exists(self._path(TOP_K_TABLE_PATH), data_store)
+        if ScoringParams.scoring_mode not in SCORING_MODES:
+            raise ValueError("Unknown scoring mode {}, use one of {}".format(
+                ScoringParams.scoring_mode, SCORING_MODES))
+        has_item_neighbours = ScoringParams.scoring_mode == 'item_neighbours' and \
+            object_exists(self._path(ITEM_NEIGHBOURS_PATH), data_store)
+        # The binary copies of the rating files are used whenever the model has them.
+        self._item_ratings_path = rating_path(self._path(ITEM_USER_FILEPATH), data_store)
+        self._user_stacks_path = rating_path(self._path(PRECOMPUTED_MANIFEST_PATH), data_store)
+        self._artifact_cache = artifact_cache
+        # Data store path -> cached blob of every artifact, removed once the model is superseded.
+        self._artifact_blobs = {}
+        if artifact_cache is not None:
+            artifact_paths = self._artifact_paths(has_serving_model, has_top_k_table,
+                                                  has_item_neighbours)
+            data_store = artifact_cache.fetch_all(artifact_paths)
+            self._artifact_blobs = artifact_cache.blob_paths(artifact_paths)
         self.s3_client = data_store
-        self._load_model_output_matrices(model_path=PMF_MODEL_PATH)
-        self._load_package_id_to_name_map()
-        self._package_tag_map = self.s3_client.read_json_file(PACKAGE_TAG_MAP)
-        self.item_ratings = load_rating(ITEM_USER_FILEPATH, data_store)
-        self.user_stacks = load_rating(PRECOMPUTED_MANIFEST_PATH, data_store)
+        if has_serving_model:
+            self._load_serving_model(model_path=self._path(SERVING_MODEL_PATH))
+        else:
+            self._load_model_output_matrices(model_path=self._path(PMF_MODEL_PATH))
+            self._load_package_index()
+        package_tag_map = self.s3_client.read_json_file(self._path(PACKAGE_TAG_MAP))
+        self.sharded_scorer = None
+        self._finalizer = None
+        if ScoringParams.scoring_shards > 0:
+            self._map_scoring_bundle(
+                artifact_cache, self._path(SERVING_MODEL_PATH if has_serving_model else
+                                           PMF_MODEL_PATH), package_tag_map)
+        else:
+            # Scoring and the fold-in both use m_V in the configured precision.
+            self.latent_item_rep_mat = ItemFactorMatrix(self.latent_item_rep_mat,
+                                                        ScoringParams.scoring_precision)
+            self._build_package_fragments(package_tag_map)
+        self.model_dict["m_V"] = self.latent_item_rep_mat
+        # Models trained before the table was added score precomputed stacks in full.
+        self.top_k_table = None
+        if has_top_k_table:
+            self.top_k_table = TopKTable.load(get_local_copy(
+                self._path(TOP_K_TABLE_PATH), self.s3_client, LOCAL_ARTIFACT_PATH))
+        self.item_neighbours = None
+        if has_item_neighbours:
+            self.item_neighbours = ItemNeighbours.load(get_local_copy(
+                self._path(ITEM_NEIGHBOURS_PATH), self.s3_client, LOCAL_ARTIFACT_PATH))
+        elif ScoringParams.scoring_mode == 'item_neighbours':
+            _logger.warning("The model has no item neighbours, computing them")
+            self.item_neighbours = ItemNeighbours.compute(self.latent_item_rep_mat[
+                np.arange(self.latent_item_rep_mat.shape[0]), :])
+        self.mips_index = None
+        if ScoringParams.mips_nlist > 0:
+            self.mips_index = IVFInnerProductIndex(self.latent_item_rep_mat,
+                                                   ScoringParams.mips_nlist)
+        self.item_ratings = load_rating_matrix(self._item_ratings_path, data_store)
+        self.user_stacks = load_rating_matrix(self._user_stacks_path, data_store)
+        self.scoring = PMFScoring(self.model_dict, self.item_ratings)
+        self._build_package_stack_index()
+        self.stack_index = None
+        if ScoringParams.minhash_num_perm > 0:
+            self.stack_index = MinHashStackIndex(self.user_stacks, ScoringParams.minhash_num_perm,
+                                                 ScoringParams.minhash_num_bands)
+        self._build_popular_packages()
+        # Moving averages of the seconds a fold-in and a scoring pass take, for deadlines.
+        self._stage_costs = {'fold_in': 0.0, 'score': 0.0}
+        # The cache belongs to this model, so a new model version starts with an empty one.
+        self.result_cache = LRUCache(ScoringParams.result_cache_size,
+                                     ScoringParams.result_cache_ttl)
+        self._topic_cache = LRUCache(TOPIC_CACHE_SIZE)
         _logger.info("Created an instance of pmf-recommendation, loaded data from S3")
 
+    def _path(self, path):
+        """Get the data store path of a model artifact for the version of this instance."""
+        return versioned_path(path, self.model_version)
+
+    @staticmethod
+    def model_version_exists(data_store, model_version):
+        """Check whether the data store holds a model of a model version."""
+        return any(object_exists(versioned_path(path, model_version), data_store)
+                   for path in (SERVING_MODEL_PATH, PMF_MODEL_PATH))
+
+    @staticmethod
+    def estimate_nbytes(data_store, model_version):
+        """Estimate the memory the model of a model version needs before loading it.
+
+        The estimate is the size of the artifacts the model is loaded from, as
+        the data store reports it, which is close to the arrays they hold.
+        """
+        model_paths = [SERVING_MODEL_PATH] \
+            if object_exists(versioned_path(SERVING_MODEL_PATH, model_version), data_store) \
+            else [PMF_MODEL_PATH, ID_TO_PACKAGE_MAP]
+        paths = [versioned_path(path, model_version) for path in
+                 model_paths + [TOP_K_TABLE_PATH, ITEM_NEIGHBOURS_PATH, PACKAGE_TAG_MAP]]
+        paths += [rating_path(versioned_path(path, model_version), data_store)
+                  for path in (ITEM_USER_FILEPATH, PRECOMPUTED_MANIFEST_PATH)]
+        return sum(object_size(path, data_store) for path in paths)
+
+    def _artifact_paths(self, has_serving_model, has_top_k_table, has_item_neighbours):
+        """Get the data store paths of every artifact the model is loaded from."""
+        model_paths = [SERVING_MODEL_PATH] if has_serving_model else \
+            [PMF_MODEL_PATH, ID_TO_PACKAGE_MAP]
+        if has_top_k_table:
+            model_paths.append(TOP_K_TABLE_PATH)
+        if has_item_neighbours:
+            model_paths.append(ITEM_NEIGHBOURS_PATH)
+        return [self._path(path) for path in model_paths + [PACKAGE_TAG_MAP]] + \
+            [self._item_ratings_path, self._user_stacks_path]
+
+    def _scoring_bundle_path(self, artifact_cache, model_path):
+        """Get the local path of the scoring bundle of the model artifacts.
+
+        The path is named after the scoring precision and the versions of the
+        model and the package tag map, so a new version gets a bundle of its
+        own. With an artifact cache the bundle is kept next to the cached
+        model and removed along with it.
+        """
+        identities = [ScoringParams.scoring_precision]
+        for path in (model_path, self._path(PACKAGE_TAG_MAP)):
+            if isinstance(self.s3_client, LocalDataStore):
+                stat = os.stat(os.path.join(self.s3_client.src_dir, path))
+                identities.append("{}-{}-{}-{}".format(stat.st_dev, stat.st_ino, stat.st_size,
+                                                       stat.st_mtime_ns))
+            else:
+                identities.append("{}/{}".format(self.s3_client.get_name(), path))
+        name = 'scoring-{}.bin'.format(
+            hashlib.sha256("\n".join(identities).encode('utf-8')).hexdigest()[:16])
+        if artifact_cache is not None:
+            return artifact_cache.derived_path(model_path, name)
+        return os.path.join(LOCAL_ARTIFACT_PATH, '.scoring', name)
+
+    def _map_scoring_bundle(self, artifact_cache, model_path, package_tag_map):
+        """Map the item matrix and the package fragments from a bundle shared by the workers.
+
+        The first worker of the node loading the model writes the bundle, the
+        others map it as it is, so the worker and the shard processes of
+        every worker share the pages of the item matrix and of the package
+        name and topic fragments instead of holding copies of their own. The
+        worker only reads the rows of the stacks it folds in, and all of
+        them when the shards fail and it scores on its own.
+        """
+        path = self._scoring_bundle_path(artifact_cache, model_path)
+        m_V = self.latent_item_rep_mat
+
+        def build():
+            arrays = ItemFactorMatrix(m_V, ScoringParams.scoring_precision).to_arrays("m_V")
+            self._build_package_fragments(package_tag_map)
+            arrays.update(self._name_fragments.to_arrays("name_fragments"))
+            arrays.update(self._topic_fragments.to_arrays("topic_fragments"))
+            return arrays
+        write_shared_array_bundle(path, build)
+        arrays = read_array_bundle(path)
+        self.latent_item_rep_mat = ItemFactorMatrix.from_arrays(arrays, "m_V")
+        self._name_fragments = StringTable.from_arrays(arrays, "name_fragments")
+        self._topic_fragments = StringTable.from_arrays(arrays, "topic_fragments")
+        self.sharded_scorer = ShardedItemScorer(path, ScoringParams.scoring_shards, "m_V",
+                                                ScoringParams.scoring_shard_timeout_seconds)
+        # The shard processes stop once a reload has dropped the model and its last
+        # request is done.
+        self._finalizer = weakref.finalize(self, self.sharded_scorer.close)
+
     def _load_model_output_matrices(self, model_path):
         """Load the m_U, m_V and m_theta matrices.
 
@@ -76,84 +269,641 @@ class PMFRecommendation(AbstractRecommender):
         self.latent_item_rep_mat = self.model_dict["m_V"]
         self.weight_matrix = self.model_dict["m_theta"]
 
-    def _load_package_id_to_name_map(self):
-        """Load the package-id to name mapping."""
-        _logger.warning("Reading package id map from: {}".format(PACKAGE_TO_ID_MAP))
-        self.package_id_name_map = self.s3_client.read_json_file(filename=ID_TO_PACKAGE_MAP)
-        self.package_name_id_map = self.s3_client.read_json_file(filename=PACKAGE_TO_ID_MAP)
+    def _load_serving_model(self, model_path):
+        """Memory-map the serving model artifact with the matrices and package names.
+
+        :model_path: The data store path of the serving model artifact.
+        """
+        _logger.warning("S3 bucket is: {}".format(S3_BUCKET_NAME))
+        _logger.warning("Mapping serving model from {}".format(model_path))
+        self.model_dict = load_serving_model(get_local_copy(model_path, self.s3_client,
+                                                            LOCAL_ARTIFACT_PATH))
+        self.user_matrix = self.model_dict["m_U"]
+        self.latent_item_rep_mat = self.model_dict["m_V"]
+        self.weight_matrix = self.model_dict["m_theta"]
+        self.package_index = self.model_dict.pop("package_index")
+
+    def _load_package_index(self):
+        """Build the package name index out of the package-id to name mapping."""
+        _logger.warning("Reading package id map from: {}".format(self._path(ID_TO_PACKAGE_MAP)))
+        package_id_name_map = self.s3_client.read_json_file(filename=self._path(ID_TO_PACKAGE_MAP))
+        self.package_index = PackageNameIndex.from_strings(
+            [package_id_name_map[str(package_id)]
+             for package_id in range(len(package_id_name_map))])
+
+    def _build_package_fragments(self, package_tag_map):
+        """Precompute the JSON encodings of the name and of the topics of every package id.
+
+        Responses are assembled out of these, so a recommended package does
+        not have its name and its topic list encoded again. They are kept in
+        string tables rather than as Python strings.
+
+        :package_tag_map: The package name to topic list mapping.
+        """
+        self._name_fragments = StringTable.from_strings(
+            json.dumps(package_name) for package_name in self.package_index)
+        self._topic_fragments = StringTable.from_strings(
+            json.dumps(package_tag_map.get(package_name, []))
+            for package_name in self.package_index)
+
+    def _package_topics(self, package_id):
+        """Get the topic list of a package id, which is shared and must not be modified.
+
+        Only the JSON responses are assembled out of the topic fragments, the
+        other ones get the topic lists decoded once and cached.
+        """
+        topics = self._topic_cache.get(package_id)
+        if topics is None:
+            topics = json.loads(self._topic_fragments[package_id])
+            self._topic_cache.put(package_id, topics)
+        return topics
+
+    def _build_package_stack_index(self):
+        """Build the package-id to precomputed-stack posting lists.
+
+        Every posting list is a sorted array of the indices of the stacks in
+        `user_stacks` that contain the package, so a superset lookup only has
+        to intersect the lists of the packages in the incoming stack.
+        """
+        self._stack_sizes = self.user_stacks.lengths
+        package_ids = self.user_stacks.indices.astype(np.int64)
+        stack_ids = np.repeat(np.arange(len(self.user_stacks)), self._stack_sizes)
+        # A stable sort keeps the stack indices of every posting list in ascending order.
+        order = np.argsort(package_ids, kind='stable')
+        package_ids, stack_ids = package_ids[order], stack_ids[order]
+        packages, starts = np.unique(package_ids, return_index=True)
+        self._package_stack_index = dict(zip(packages.tolist(), np.split(stack_ids, starts[1:])))
+
+    def _build_popular_packages(self):
+        """Rank the packages by the number of training users that have them.
+
+        The most popular packages make the recommendations of last resort,
+        served without any scoring when a deadline leaves no time for it.
+        """
+        counts = self.item_ratings.lengths
+        size = min(ScoringParams.popular_list_size, len(counts))
+        self._popular_packages = np.argsort(-counts, kind='stable')[:size]
+        self._popular_logits = np.log1p(counts[self._popular_packages])
 
     def _find_closest_user_in_training_set(self, new_user_stack):
-        """Check if we already have the recommendations for the stack precomputed."""
+        """Check if we already have the recommendations for the stack precomputed.
+
+        Returns the index of the smallest precomputed stack that contains every
+        package of the new stack (an exact match being the smallest possible),
+        preferring the lowest index among equally sized candidates.
+        """
         new_user_stack = set(new_user_stack)
-        minDiff = sys.maxsize
-        closest = None
-        for idx, stack in enumerate(self.user_stacks):
-            stack = set(stack)
-            diff = len(stack.difference(new_user_stack))
-            if stack == new_user_stack:
-                closest = idx
-                break
-            elif new_user_stack.issubset(stack) and diff < minDiff:
-                minDiff = diff
-                closest = idx
-        return closest
+        if not new_user_stack:
+            candidates = np.arange(len(self.user_stacks))
+        else:
+            posting_lists = []
+            for package_id in new_user_stack:
+                posting_list = self._package_stack_index.get(package_id)
+                if posting_list is None:
+                    return None
+                posting_lists.append(posting_list)
+            posting_lists.sort(key=len)
+            candidates = posting_lists[0]
+            for posting_list in posting_lists[1:]:
+                candidates = np.intersect1d(candidates, posting_list, assume_unique=True)
+                if candidates.size == 0:
+                    return None
+        if candidates.size == 0:
+            return None
+        return int(candidates[np.argmin(self._stack_sizes[candidates])])
+
+    def _find_nearest_user_in_training_set(self, new_user_stack):
+        """Find the precomputed stack sharing the most packages with the stack.
+
+        Unlike `_find_closest_user_in_training_set` the precomputed stack does
+        not have to contain the whole stack. Only the shortest posting lists,
+        up to NEAREST_USER_MAX_POSTINGS stack indices, are counted, so the
+        rarest packages decide and the cost stays bounded.
+
+        :returns: The index of the smallest of the stacks with the largest
+                  overlap, or None if no package of the stack is in any.
+        """
+        posting_lists = sorted((self._package_stack_index[package_id]
+                                for package_id in set(new_user_stack)
+                                if package_id in self._package_stack_index), key=len)
+        if not posting_lists:
+            return None
+        num_lists = np.searchsorted(np.cumsum([len(posting_list)
+                                               for posting_list in posting_lists]),
+                                    NEAREST_USER_MAX_POSTINGS, side='right')
+        stacks, overlaps = np.unique(np.concatenate(posting_lists[:max(num_lists, 1)]),
+                                     return_counts=True)
+        candidates = stacks[overlaps == overlaps.max()]
+        return int(candidates[np.argmin(self._stack_sizes[candidates])])
+
+    def _observe_cost(self, stage, seconds):
+        """Fold a measured duration into the moving average of the cost of a stage."""
+        cost = self._stage_costs[stage]
+        self._stage_costs[stage] = seconds if cost == 0 else \
+            cost + _COST_SMOOTHING * (seconds - cost)
 
     def _sigmoid(self, x):
         return 1 / (1 + np.exp(-x))
 
-    def predict(self, new_user_stack, companion_threshold=None):
-        """Predict companion packages."""
-        missing = []
-        avail = []
-        if not companion_threshold:
-            companion_threshold = self._M
-        for package in new_user_stack:
-            pkg_id = self.package_name_id_map.get(package, -1)
-            if pkg_id == -1:
-                missing.append(package)
-            else:
-                avail.append(pkg_id)
-        package_topic_dict = {
-            self.package_id_name_map[str(package_id)]: self._package_tag_map.get(
-                self.package_id_name_map[str(package_id)], []) for package_id in avail
-        }
-        # if more than half the packages are missing
-        if len(avail) == 0 or len(missing) > len(avail):
-            return missing, [], package_topic_dict
-        new_user_stack = avail
-        # Check whether we have already seen this stack.
-        user = self._find_closest_user_in_training_set(new_user_stack)
-        if user is not None:
+    def _resolve_packages(self, new_user_stack):
+        """Map the package names of a stack to package ids.
+
+        :returns: The names that are unknown to the model and the ids of the
+                  known packages.
+        """
+        package_ids = self.package_index.lookup(new_user_stack)
+        missing = [package for package, package_id in zip(new_user_stack, package_ids.tolist())
+                   if package_id == -1]
+        return missing, package_ids[package_ids != -1].tolist()
+
+    def _user_latent_vector(self, new_user_stack, user, deadline=None, user_path='precomputed',
+                            num_scored=1):
+        """Get the latent user vector of a stack of package ids.
+
+        Without a deadline, a stack that is not precomputed is folded in.
+        With one, the paths that no longer fit in the time left, going by
+        the moving averages of their cost, give way to cheaper ones: the
+        nearest precomputed stack, then the popularity list. The stacks are
+        scored together, so the time left has to hold the scoring of all of
+        them.
+
+        :user: The closest precomputed stack, None if there is none.
+        :deadline: The time.monotonic() value the stack has to be scored by.
+        :user_path: The scoring path reported when user is served.
+        :num_scored: The number of stacks the scoring pass holds at most,
+                     this one included.
+        :returns: A (latent vector, scoring path) tuple, the vector being None
+                  on the popularity path.
+        """
+        time_left = np.inf if deadline is None else deadline - time.monotonic()
+        score_cost = self._stage_costs['score'] * num_scored
+        if user is not None and time_left > score_cost:
             _logger.info("Have precomputed stack")
-            recommendation = np.dot(self.user_matrix[int(user), :].reshape([1, self.num_latent]),
-                                    self.latent_item_rep_mat.T)
-        else:
+            return self.user_matrix[int(user), :], user_path
+        if time_left > self._stage_costs['fold_in'] + score_cost:
             _logger.info("Calculating latent representation, have not seen this combination before")
-            scoring = PMFScoring(self.model_dict, self.item_ratings)
-            user_latent_rep = scoring.predict_transform(new_user_stack, self.num_latent)
-            recommendation = np.dot(user_latent_rep.reshape([1, self.num_latent]),
-                                    self.latent_item_rep_mat.T)
-        packages = np.argsort(recommendation)[0][::-1].tolist()
-        # Filter packages that are present in the input
-        packages_filtered = []
-        user_stack_lookup = set(new_user_stack)
-        recommendation_count = 0
-        for package in packages:
-            if package not in user_stack_lookup:
-                packages_filtered.append(package)
-                recommendation_count += 1
-            if recommendation_count >= companion_threshold:
-                break
-        logits = np.take(recommendation[0], np.array(packages_filtered)).tolist()
-        mean = np.mean(logits)
-        recommendations = []
-        for idx, package in enumerate(packages_filtered):
-            recommendation = {
-                "package_name": self.package_id_name_map[str(package)],
-                "cooccurrence_probability": self._sigmoid(logits[idx] - mean) * 100,
-                "topic_list": self._package_tag_map.get(
-                        self.package_id_name_map[str(package)], [])
-            }
-            if recommendation.get('cooccurrence_probability') >= ScoringParams.min_confidence_prob:
-                recommendations.append(recommendation)
-        return missing, recommendations, package_topic_dict
+            start = time.perf_counter()
+            user_vector = self.scoring.predict_transform(new_user_stack, self.num_latent)
+            elapsed = time.perf_counter() - start
+            _stage_seconds.observe(elapsed, stage='fold_in')
+            self._observe_cost('fold_in', elapsed)
+            return user_vector, 'fold_in'
+        if time_left > score_cost:
+            with _stage_seconds.time(stage='nearest_user'):
+                user = self._find_nearest_user_in_training_set(new_user_stack)
+            if user is not None:
+                return self.user_matrix[user, :], 'nearest_user'
+        return None, 'popular'
+
+    @staticmethod
+    def _top_k(recommendation_matrix, new_user_stacks, companion_thresholds):
+        """Select the best scoring packages of every row of the score matrix.
+
+        The packages of the input stack are masked to -inf before a partial
+        selection of the largest scores, and only the selected packages get
+        sorted, so the cost depends on the number of companions asked for
+        rather than on the size of the catalog.
+
+        :returns: A list with an array of package ids, best first, per row.
+        """
+        num_items = recommendation_matrix.shape[1]
+        rows = np.repeat(np.arange(len(new_user_stacks)),
+                         [len(stack) for stack in new_user_stacks])
+        recommendation_matrix[rows, np.concatenate(new_user_stacks)] = -np.inf
+        top_counts = [min(companion_threshold, num_items - len(set(stack)))
+                      for stack, companion_threshold in zip(new_user_stacks, companion_thresholds)]
+        max_count = max(top_counts)
+        if max_count <= 0:
+            return [np.array([], dtype=np.int64) for _ in top_counts]
+        if max_count < num_items:
+            candidates = np.argpartition(-recommendation_matrix, max_count - 1,
+                                         axis=1)[:, :max_count]
+        else:
+            candidates = np.tile(np.arange(num_items), (len(top_counts), 1))
+        packages = []
+        for recommendation, row_candidates, top_count in zip(
+                recommendation_matrix, candidates, top_counts):
+            order = np.argsort(-recommendation[row_candidates], kind='stable')
+            packages.append(row_candidates[order[:max(top_count, 0)]])
+        return packages
+
+    def _score_stacks(self, user_matrix, new_user_stacks, companion_thresholds, nprobe,
+                      deadline=None):
+        """Get the best scoring packages of every user vector along with their scores.
+
+        All the items are scored with a single matrix multiply, by the shard
+        processes when the item matrix is sharded, unless the approximate
+        item index is enabled and asked to probe only part of its lists. The
+        worker scores the items itself when the shards fail or do not reply
+        by the deadline.
+
+        :deadline: The time.monotonic() value the shards are waited for until
+                   at most.
+        :returns: A list with a (package ids, scores) tuple per user vector.
+        """
+        if self.sharded_scorer is not None and \
+                (self.mips_index is None or nprobe >= self.mips_index.nlist):
+            num_items = self.latent_item_rep_mat.shape[0]
+            try:
+                return self.sharded_scorer.top_k(
+                    user_matrix, new_user_stacks,
+                    [min(companion_threshold, num_items - len(set(new_user_stack)))
+                     for new_user_stack, companion_threshold in zip(new_user_stacks,
+                                                                    companion_thresholds)],
+                    deadline)
+            except RuntimeError:
+                _logger.exception("Scoring shards failed, scoring in the worker")
+                _shard_failovers.inc()
+        if self.mips_index is None or nprobe >= self.mips_index.nlist:
+            recommendation_matrix = self.latent_item_rep_mat.score(user_matrix)
+            top_packages = self._top_k(recommendation_matrix, new_user_stacks,
+                                       companion_thresholds)
+            return [(packages, recommendation[packages])
+                    for recommendation, packages in zip(recommendation_matrix, top_packages)]
+        scored = []
+        for user_vector, new_user_stack, companion_threshold in zip(
+                user_matrix, new_user_stacks, companion_thresholds):
+            candidates, scores = self.mips_index.search(user_vector, nprobe)
+            input_positions = np.flatnonzero(np.isin(candidates, new_user_stack))
+            top = self._top_k(scores[None, :], [input_positions], [companion_threshold])[0]
+            scored.append((candidates[top], scores[top]))
+        return scored
+
+    def _recommend(self, packages, logits):
+        """Select the confident packages out of the selected packages and their scores.
+
+        :returns: A list of (package id, probability) tuples, best first.
+        """
+        if len(packages) == 0:
+            return []
+        probabilities = self._sigmoid(logits - np.mean(logits)) * 100
+        confident = probabilities >= ScoringParams.min_confidence_prob
+        return list(zip(packages[confident].tolist(), probabilities[confident].tolist()))
+
+    def _top_k_table_recommendations(self, user, new_user_stack, companion_threshold):
+        """Recommend the best packages of a precomputed stack out of the top-K table.
+
+        :returns: The recommendations, or None when the row of the table runs
+                  out of packages once the ones of the stack are left out.
+        """
+        count = min(companion_threshold,
+                    self.latent_item_rep_mat.shape[0] - len(set(new_user_stack)))
+        top = self.top_k_table.top(user, new_user_stack, max(count, 0))
+        if top is None:
+            return None
+        return self._recommend(*top)
+
+    def _popular_recommendations(self, new_user_stack, companion_threshold):
+        """Recommend the most popular packages that are not in the stack."""
+        keep = ~np.isin(self._popular_packages, new_user_stack)
+        return self._recommend(self._popular_packages[keep][:companion_threshold],
+                               self._popular_logits[keep][:companion_threshold])
+
+    def _package_topic_dict(self, avail):
+        """Get the topic map of the known packages of a stack."""
+        return {self.package_index[package_id]: self._package_topics(package_id)
+                for package_id in avail}
+
+    def predict(self, new_user_stack, companion_threshold=None, nprobe=None, deadline=None):
+        """Predict companion packages."""
+        return self.predict_batch([new_user_stack], [companion_threshold], nprobe=nprobe,
+                                  deadline=deadline)[0]
+
+    def predict_batch(self, new_user_stacks, companion_thresholds=None, nprobe=None,
+                      deadline=None):
+        """Predict companion packages for several stacks at once.
+
+        :new_user_stacks: A list of stacks, each one a list of package names.
+        :companion_thresholds: The number of companions wanted for every stack,
+                               defaults to the one the instance was created with.
+        :nprobe: The number of lists of the approximate item index to score,
+                 trading recall for latency, ScoringParams.mips_nprobe by default.
+        :deadline: The time.monotonic() value the stacks have to be scored by,
+                   cheaper scoring paths are taken as it gets close.
+        :returns: A list with a (missing, recommendations, package_topic_dict)
+                  tuple per stack.
+        """
+        results = []
+        for missing, avail, scored, _ in self._score_batch(
+                new_user_stacks, companion_thresholds, nprobe,
+                [deadline] * len(new_user_stacks)):
+            recommendations = [{
+                "package_name": self.package_index[package_id],
+                "cooccurrence_probability": probability,
+                "topic_list": self._package_topics(package_id)
+            } for package_id, probability in scored]
+            results.append((missing, recommendations, self._package_topic_dict(avail)))
+        return results
+
+    def predict_batch_json(self, new_user_stacks, companion_thresholds=None, nprobe=None,
+                           ecosystem=None, deadline=None):
+        """Predict companion packages for several stacks and encode the API response.
+
+        The response is the JSON list of the companion recommendation
+        endpoint, with the keys of every object sorted, assembled out of the
+        JSON fragments precomputed for every package and the probabilities.
+        Every stack also reports the scoring path that served it.
+
+        :ecosystem: The ecosystem reported with every stack.
+        :returns: The JSON text of the response.
+        """
+        return self._encode_response(
+            self._score_batch(new_user_stacks, companion_thresholds, nprobe,
+                              [deadline] * len(new_user_stacks)), ecosystem)
+
+    def predict_requests_json(self, requests, nprobe=None, ecosystem=None):
+        """Predict companion packages for the stacks of several requests at once.
+
+        The stacks of all the requests are scored as a single batch, then
+        every request gets its own response, like with `predict_batch_json`.
+
+        :requests: A list of (stacks, companion thresholds, deadline) tuples.
+        :ecosystem: The ecosystem reported with every stack.
+        :returns: A list with the JSON text of the response of every request.
+        """
+        scored_stacks = self._score_batch(
+            [stack for stacks, _, _ in requests for stack in stacks],
+            [threshold for stacks, thresholds, _ in requests
+             for threshold in (thresholds or [None] * len(stacks))], nprobe,
+            [deadline for stacks, _, deadline in requests for _ in stacks])
+        responses = []
+        start = 0
+        for stacks, _, _ in requests:
+            responses.append(self._encode_response(scored_stacks[start:start + len(stacks)],
+                                                   ecosystem))
+            start += len(stacks)
+        return responses
+
+    def _encode_response(self, scored_stacks, ecosystem):
+        """Encode the API response of scored stacks out of the precomputed JSON fragments."""
+        with _stage_seconds.time(stage='json'):
+            ecosystem_fragment = json.dumps(ecosystem)
+            stack_fragments = []
+            for missing, avail, scored, scoring_path in scored_stacks:
+                companion_fragments = [
+                    '{{"cooccurrence_probability": {}, "package_name": {}, '
+                    '"topic_list": {}}}'.format(repr(probability),
+                                                self._name_fragments[package_id],
+                                                self._topic_fragments[package_id])
+                    for package_id, probability in scored]
+                input_packages = sorted(set(avail), key=self.package_index.encoded)
+                topic_fragments = ['{}: {}'.format(self._name_fragments[package_id],
+                                                   self._topic_fragments[package_id])
+                                   for package_id in input_packages]
+                stack_fragments.append(
+                    '{{"companion_packages": [{}], "ecosystem": {}, "missing_packages": {}, '
+                    '"package_to_topic_dict": {{{}}}, "scoring_path": {}}}'.format(
+                        ', '.join(companion_fragments), ecosystem_fragment, json.dumps(missing),
+                        ', '.join(topic_fragments), json.dumps(scoring_path)))
+            return '[' + ', '.join(stack_fragments) + ']'
+
+    def _cache_key(self, avail, companion_threshold, nprobe):
+        """Get the result cache key of a stack of package ids.
+
+        The key holds the model version, so that no recommendation of another
+        model version is ever served out of the cache.
+        """
+        return self.model_version, frozenset(avail), companion_threshold, nprobe
+
+    def _cached_recommendations(self, avail, companion_threshold, nprobe):
+        """Get the cached recommendations of a stack, None if there are none."""
+        return self.result_cache.get(self._cache_key(avail, companion_threshold, nprobe))
+
+    def _find_user(self, avail):
+        """Find the precomputed stack that stands in for a stack.
+
+        :returns: A (user, scoring path) tuple, user being None if no
+                  precomputed stack is the same as, or similar enough to, the
+                  stack.
+        """
+        # Check whether we have already seen this stack, or one close enough to it.
+        with _stage_seconds.time(stage='closest_user'):
+            user = self._find_closest_user_in_training_set(avail)
+        if user is not None or self.stack_index is None:
+            return user, 'precomputed'
+        with _stage_seconds.time(stage='similar_user'):
+            return self.stack_index.query(avail, ScoringParams.minhash_min_jaccard), \
+                'similar_user'
+
+    def _score_with_top_k_table(self, user, avail, companion_threshold, nprobe):
+        """Recommend the packages of a precomputed stack out of the top-K table.
+
+        :returns: The recommendations, None if the table has too few of them.
+        """
+        with _stage_seconds.time(stage='top_k_table'):
+            recommendations = self._top_k_table_recommendations(user, avail,
+                                                                companion_threshold)
+        if recommendations is not None:
+            self.result_cache.put(self._cache_key(avail, companion_threshold, nprobe),
+                                  recommendations)
+        return recommendations
+
+    def _score_with_item_neighbours(self, avail, companion_threshold, nprobe):
+        """Recommend the packages the item neighbours of a stack score best."""
+        with _stage_seconds.time(stage='item_neighbours'):
+            recommendations = self._recommend(*self.item_neighbours.score(
+                avail, companion_threshold))
+        self.result_cache.put(self._cache_key(avail, companion_threshold, nprobe),
+                              recommendations)
+        return recommendations
+
+    def _route_stack(self, avail, companion_threshold, nprobe, deadline, num_scored):
+        """Pick the scoring path of a stack and score it unless it needs the user matrix.
+
+        :num_scored: The number of stacks the scoring pass holds at most,
+                     this one included.
+        :returns: A (recommendations, scoring path, user vector) tuple, the
+                  user vector being set only for the stacks left to score in
+                  the scoring pass.
+        """
+        recommendations = self._cached_recommendations(avail, companion_threshold, nprobe)
+        if recommendations is not None:
+            return recommendations, 'cache', None
+        user, user_path = self._find_user(avail)
+        if user is not None and self.top_k_table is not None:
+            recommendations = self._score_with_top_k_table(user, avail, companion_threshold,
+                                                           nprobe)
+            if recommendations is not None:
+                return recommendations, user_path, None
+        if user is None and self.item_neighbours is not None:
+            return self._score_with_item_neighbours(avail, companion_threshold, nprobe), \
+                'item_neighbours', None
+        user_vector, scoring_path = self._user_latent_vector(avail, user, deadline, user_path,
+                                                             num_scored)
+        if user_vector is None:
+            return self._popular_recommendations(avail, companion_threshold), scoring_path, None
+        return [], scoring_path, user_vector
+
+    def _score_user_vectors(self, results, queued, nprobe, deadlines):
+        """Score the queued stacks in one pass over the item matrix or the item index.
+
+        :results: The results of the batch, the ones of the queued stacks are
+                  filled in.
+        :queued: A list with a (position, package ids, companion threshold,
+                 scoring path, user vector) tuple per stack left to score.
+        """
+        user_matrix = np.vstack([user_vector for *_, user_vector in queued]).reshape(
+            [len(queued), self.num_latent])
+        start = time.perf_counter()
+        scored = self._score_stacks(
+            user_matrix,
+            [avail for _, avail, _, _, _ in queued],
+            [companion_threshold for _, _, companion_threshold, _, _ in queued],
+            nprobe, min((deadlines[position] for position, *_ in queued
+                         if deadlines[position] is not None), default=None))
+        elapsed = time.perf_counter() - start
+        _stage_seconds.observe(elapsed, stage='top_k')
+        # The deadlines are checked stack by stack, against the cost of scoring one.
+        self._observe_cost('score', elapsed / len(queued))
+        for (packages, logits), (position, avail, companion_threshold, scoring_path, _) in zip(
+                scored, queued):
+            with _stage_seconds.time(stage='format'):
+                recommendations = self._recommend(packages, logits)
+            if scoring_path in _CACHED_PATHS:
+                self.result_cache.put(self._cache_key(avail, companion_threshold, nprobe),
+                                      recommendations)
+            results[position] = (results[position][0], avail, recommendations, scoring_path)
+
+    def _score_batch(self, new_user_stacks, companion_thresholds=None, nprobe=None,
+                     deadlines=None):
+        """Score several stacks at once.
+
+        The latent vectors of all the stacks that can be scored are stacked
+        into a single user matrix, which is multiplied with the latent item
+        matrix in one go, but for the precomputed stacks the top-K table has
+        the recommendations of and, in the item_neighbours scoring mode, the
+        stacks that are not precomputed. Only the recommendations of the
+        scoring paths that do not depend on the deadline are cached.
+
+        :deadlines: The time.monotonic() value every stack has to be scored
+                    by, or None for no deadline.
+        :returns: A list with a (missing, known package ids, recommendations,
+                  scoring path) tuple per stack, the recommendations being a
+                  list of (package id, probability) tuples and the path
+                  'skipped' for the stacks that were not scored.
+        """
+        if companion_thresholds is None:
+            companion_thresholds = [None] * len(new_user_stacks)
+        if deadlines is None:
+            deadlines = [None] * len(new_user_stacks)
+        if self.mips_index is None:
+            nprobe = None
+        elif nprobe is None:
+            nprobe = ScoringParams.mips_nprobe
+        results = []
+        queued = []
+        for position, (new_user_stack, companion_threshold, deadline) in enumerate(zip(
+                new_user_stacks, companion_thresholds, deadlines)):
+            with _stage_seconds.time(stage='resolve'):
+                missing, avail = self._resolve_packages(new_user_stack)
+            # if more than half the packages are missing
+            if len(avail) == 0 or len(missing) > len(avail):
+                results.append((missing, avail, [], 'skipped'))
+                _scoring_paths.inc(path='skipped')
+                continue
+            companion_threshold = companion_threshold or self._M
+            # The stacks queued for scoring and, at most, all the ones left to look at.
+            recommendations, scoring_path, user_vector = self._route_stack(
+                avail, companion_threshold, nprobe, deadline,
+                len(queued) + len(new_user_stacks) - position)
+            _scoring_paths.inc(path=scoring_path)
+            results.append((missing, avail, recommendations, scoring_path))
+            if user_vector is not None:
+                queued.append((position, avail, companion_threshold, scoring_path, user_vector))
+        if queued:
+            self._score_user_vectors(results, queued, nprobe, deadlines)
+        return results
+
+    def close(self):
+        """Stop the shard processes of a sharded item matrix, if any."""
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def prune_superseded(self, previous):
+        """Remove the cached artifacts of the model this one superseded.
+
+        The artifacts this model shares with the previous one are kept.
+
+        :previous: The PMFRecommendation served before this one.
+        """
+        if self._artifact_cache is None or previous._artifact_cache is not self._artifact_cache:
+            return
+        current = set(self._artifact_blobs.values())
+        self._artifact_cache.prune({path: blob_path
+                                    for path, blob_path in previous._artifact_blobs.items()
+                                    if blob_path not in current})
+
+    @property
+    def nbytes(self):
+        """Get the memory size of the arrays the model holds, memory-mapped ones included.
+
+        Arrays sharing the memory of another one, like an item matrix scored
+        at the precision it was stored in, are counted once.
+        """
+        holders = [self.model_dict, vars(self.latent_item_rep_mat), vars(self.package_index),
+                   vars(self.item_ratings), vars(self.user_stacks)]
+        holders += [vars(index) for index in (self.top_k_table, self.item_neighbours,
+                                              self.mips_index, self.stack_index)
+                    if index is not None]
+        arrays = {array.__array_interface__['data'][0]: array.nbytes
+                  for holder in holders for array in holder.values()
+                  if isinstance(array, np.ndarray)}
+        return sum(arrays.values())
+
+    def sample_stacks(self, count):
+        """Get the package names of up to count precomputed stacks."""
+        stacks = [stack for stack in self.user_stacks if len(stack) > 0][:count]
+        return [[self.package_index[package_id] for package_id in stack] for stack in stacks]
+
+    def warm_up(self, num_stacks=4, seed=0):
+        """Score a few stacks so that the first requests do not start cold.
+
+        The latent user matrix is read once to fault in the pages of a
+        memory-mapped model, then precomputed stacks and synthetic stacks of
+        random packages, small and large enough to take both fold-in solves,
+        are scored alone and as a batch to initialize BLAS and measure the
+        cost of scoring. The result cache starts afresh afterwards.
+
+        :num_stacks: The number of precomputed and of synthetic stacks.
+        """
+        float(np.sum(self.user_matrix))
+        num_items = self.latent_item_rep_mat.shape[0]
+        rng = np.random.RandomState(seed)
+        sizes = np.linspace(1, min(num_items, 2 * self.num_latent), num_stacks).astype(int)
+        stacks = self.sample_stacks(num_stacks) + [
+            [self.package_index[package_id]
+             for package_id in rng.choice(num_items, size=size, replace=False)]
+            for size in sizes]
+        for stack in stacks:
+            self.predict(stack)
+        # The first calls pay for initializing BLAS, deadlines go by the costs measured after.
+        self._stage_costs = dict.fromkeys(self._stage_costs, 0.0)
+        self.result_cache.clear()
+        self.predict_batch(stacks)
+        self.result_cache = LRUCache(self.result_cache.maxsize, self.result_cache.ttl)
+
+    def validate(self):
+        """Check that the loaded model is consistent and able to serve recommendations.
+
+        :raises ValueError: If the matrices, the top-K table, the item neighbours or
+                            the package maps do not fit together or scoring a
+                            precomputed stack fails.
+        """
+        num_items, num_latent = self.latent_item_rep_mat.shape
+        if self.user_matrix.shape[1] != num_latent or num_latent != self.num_latent:
+            raise ValueError("Latent dimensions of m_U, m_V and the scoring parameters differ")
+        if len(self.package_index) != num_items:
+            raise ValueError("The package map does not match the {} items of m_V"
+                             .format(num_items))
+        if self.item_neighbours is not None and len(self.item_neighbours) != num_items:
+            raise ValueError("The item neighbours do not match the {} items of m_V"
+                             .format(num_items))
+        if self.top_k_table is not None and len(self.top_k_table) != len(self.user_matrix):
+            raise ValueError("The top-K table does not match the {} users of m_U"
+                             .format(len(self.user_matrix)))
+        for missing, recommendations, _ in self.predict_batch(self.sample_stacks(3)):
+            if missing:
+                raise ValueError("Packages of precomputed stacks are unknown: {}".format(missing))
+            if not all(np.isfinite(recommendation["cooccurrence_probability"])
+                       for recommendation in recommendations):
+                raise ValueError("Model produced non finite scores")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains the admission control of the requests a worker serves at once.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+from contextlib import contextmanager
+
+
+class AdmissionControl:
+    """A thread safe count of the requests in flight, bounded by max_in_flight.
+
+    A request that finds the limit reached is not admitted, so a worker
+    under a burst turns requests away right away instead of queueing them
+    until they time out.
+    """
+
+    def __init__(self, max_in_flight):
+        """Create a new admission control.
+
+        :max_in_flight: The maximum number of requests in flight, 0 for no limit.
+        """
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_enter(self):
+        """Admit a request if there is room for it.
+
+        :returns: Whether the request was admitted, admitted requests have to
+                  call `exit` once they are done.
+        """
+        with self._lock:
+            if 0 < self.max_in_flight <= self.in_flight:
+                return False
+            self.in_flight += 1
+            return True
+
+    def exit(self):
+        """Release the place of an admitted request."""
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def admit(self):
+        """Admit a request for the duration of the block, yielding whether it was admitted."""
+        admitted = self.try_enter()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.exit()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Read and write bundles of named numpy arrays stored as aligned raw data.
+
+A bundle is a single file made of a magic string, the length of a JSON
+header, the JSON header describing every array (dtype, shape and offset)
+and the raw array data, every array starting at a 64 byte boundary. Reading
+a bundle memory-maps it read-only, so the arrays are views over the page
+cache that every process mapping the same file shares.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import fcntl
+import json
+import os
+import struct
+
+import numpy as np
+
+BUNDLE_MAGIC = b'CHSTRBDL'
+_ALIGNMENT = 64
+_PREAMBLE = struct.Struct('<8sQ')
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def write_array_bundle(path, arrays):
+    """Write a dict of numpy arrays to a bundle file.
+
+    The file is written next to its final location and renamed into place,
+    so a reader never maps a partially written bundle.
+
+    :path: The local path of the bundle.
+    :arrays: A dict mapping array names to numpy arrays.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise ValueError("Array {} has dtype object and can not be stored raw".format(name))
+    header = {}
+    # The header length decides where the data starts, so settle it before the offsets.
+    header_size = len(json.dumps({name: {"dtype": array.dtype.str,
+                                         "shape": list(array.shape),
+                                         "offset": 2 ** 63} for name, array in arrays.items()}))
+    offset = _aligned(_PREAMBLE.size + header_size)
+    for name, array in arrays.items():
+        header[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8').ljust(header_size)
+    temporary_path = path + '.part'
+    with open(temporary_path, 'wb') as bundle:
+        bundle.write(_PREAMBLE.pack(BUNDLE_MAGIC, header_size))
+        bundle.write(header_bytes)
+        for name, array in arrays.items():
+            bundle.seek(header[name]["offset"])
+            bundle.write(array.tobytes())
+        bundle.truncate(offset)
+    os.replace(temporary_path, path)
+
+
+def write_shared_array_bundle(path, build):
+    """Write the bundle of the arrays build returns, unless another process already did.
+
+    Processes writing the same bundle at once wait for the first one, so the
+    arrays are only built and written once and all of them map the same file.
+
+    :path: The local path of the bundle.
+    :build: A callable returning the dict of arrays to write.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(path):
+            write_array_bundle(path, build())
+
+
+def read_array_bundle_from_buffer(buffer):
+    """Get the arrays of a bundle held in a buffer without copying them.
+
+    :buffer: A bytes-like object or a uint8 memory map with the bundle.
+    :returns: A dict mapping the array names to read-only numpy arrays.
+    """
+    buffer = np.frombuffer(buffer, dtype=np.uint8)
+    magic, header_size = _PREAMBLE.unpack(buffer[:_PREAMBLE.size].tobytes())
+    if magic != BUNDLE_MAGIC:
+        raise ValueError("Not an array bundle")
+    header = json.loads(buffer[_PREAMBLE.size:_PREAMBLE.size + header_size].tobytes())
+    arrays = {}
+    for name, spec in header.items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                     offset=spec["offset"]).reshape(spec["shape"])
+    return arrays
+
+
+def read_array_bundle(path):
+    """Memory-map a bundle file read-only.
+
+    :path: The local path of the bundle.
+    :returns: A dict mapping the array names to read-only numpy arrays.
+    """
+    return read_array_bundle_from_buffer(np.memmap(path, dtype=np.uint8, mode='r'))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains a local on-disk cache of the model artifacts of a data store.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import daiquiri
+from rudra.data_store.local_data_store import LocalDataStore
+
+from recommendation_engine.utils.fileutils import check_path
+
+daiquiri.setup(level=logging.WARNING)
+_logger = daiquiri.getLogger(__name__)
+
+
+class ArtifactCache:
+    """Local copies of data store objects that are only downloaded again when they changed.
+
+    Every version of an object is downloaded once to cache_dir/<digest of
+    the store name>/.blobs/<digest of the version>, the version being the
+    S3 ETag, or the key, the size and the modification time for a local
+    data store, and hard-linked to cache_dir/<digest>/<object key>. The
+    download holds an exclusive lock on the blob, so the workers of a node
+    starting together download an object once and all map the same inode,
+    sharing its pages. A restart on the same node only compares the
+    versions with the store, and a LocalDataStore over the cache directory
+    of the store serves the same keys as the store itself. Once a model
+    version is superseded, its keys are removed, and so are the blobs no
+    key links to anymore along with the files derived from them, see
+    `prune`.
+    """
+
+    def __init__(self, data_store, cache_dir, max_workers=6):
+        """Create a cache of the objects of data_store.
+
+        :data_store: The data store to fetch objects from.
+        :cache_dir: The local directory holding the cached copies.
+        :max_workers: The number of objects fetched concurrently.
+        """
+        self.data_store = data_store
+        self.max_workers = max_workers
+        store_digest = hashlib.sha256(data_store.get_name().encode('utf-8')).hexdigest()[:16]
+        self.store_dir = os.path.join(cache_dir, store_digest)
+        self.blob_dir = os.path.join(self.store_dir, '.blobs')
+        self.local_store = LocalDataStore(self.store_dir)
+        # Data store path -> blob of the version fetched last.
+        self._blobs = {}
+
+    def _source_version(self, path):
+        if isinstance(self.data_store, LocalDataStore):
+            stat = os.stat(os.path.join(self.data_store.src_dir, path))
+            return "{}-{}-{}".format(path, stat.st_size, stat.st_mtime_ns)
+        for summary in self.data_store.list_bucket_objects(prefix=path):
+            if summary.key == path:
+                return summary.e_tag.strip('"')
+        raise ValueError("{} is not in the data store".format(path))
+
+    def _download(self, path, target):
+        if isinstance(self.data_store, LocalDataStore):
+            shutil.copyfile(os.path.join(self.data_store.src_dir, path), target)
+        else:
+            self.data_store.download_file(path, target)
+
+    @contextmanager
+    def _blob_lock(self, blob_path):
+        """Hold the lock of a blob, taking it again if the blob was pruned meanwhile."""
+        lock_path = blob_path + '.lock'
+        while True:
+            with open(lock_path, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    current = os.path.samestat(os.fstat(lock.fileno()), os.stat(lock_path))
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    yield
+                    return
+
+    def _fetch_blob(self, path, blob_path, local_path):
+        """Download a version of an object unless it is already, or being, downloaded.
+
+        The blob is linked to the key of the object holding its lock, so it
+        is not pruned in between.
+
+        :returns: True if the object had to be downloaded.
+        """
+        # Other processes fetching the same version wait here until it is downloaded.
+        with self._blob_lock(blob_path):
+            downloaded = not os.path.exists(blob_path)
+            if downloaded:
+                part_path = '{}.{}.{}.part'.format(blob_path, os.getpid(), threading.get_ident())
+                self._download(path, part_path)
+                os.replace(part_path, blob_path)
+            # Unique temporary names let several workers link the same key at the same time.
+            link_path = '{}.{}.{}.part'.format(local_path, os.getpid(), threading.get_ident())
+            os.link(blob_path, link_path)
+            os.replace(link_path, local_path)
+            # Renaming a link onto another link to the same inode leaves both in place.
+            if os.path.lexists(link_path):
+                os.unlink(link_path)
+            return downloaded
+
+    def fetch(self, path):
+        """Make sure the cached copy of an object is up to date.
+
+        :path: The data store path of the object.
+        :returns: True if the object had to be downloaded.
+        """
+        version = self._source_version(path)
+        blob_path = os.path.join(self.blob_dir,
+                                 hashlib.sha256(version.encode('utf-8')).hexdigest())
+        self._blobs[path] = blob_path
+        local_path = os.path.join(self.store_dir, path)
+        if os.path.exists(local_path) and os.path.exists(blob_path) and \
+                os.path.samefile(local_path, blob_path):
+            return False
+        check_path(self.blob_dir)
+        check_path(os.path.dirname(local_path))
+        downloaded = self._fetch_blob(path, blob_path, local_path)
+        if downloaded:
+            _logger.info("Downloaded {} at version {}".format(path, version))
+        return downloaded
+
+    def derived_path(self, path, name):
+        """Get the local path of a file derived from the cached copy of an object.
+
+        The file is kept next to the blob of the version fetched, so every
+        worker of the node finds it and it goes along with the blob.
+
+        :path: The data store path of an object fetched before.
+        :name: The name of the derived file.
+        """
+        return '{}.{}'.format(self._blobs[path], name)
+
+    def blob_paths(self, paths):
+        """Get the blobs of the versions of objects fetched last.
+
+        :paths: The data store paths of objects fetched before.
+        :returns: A dict mapping every path to the local path of its blob.
+        """
+        return {path: self._blobs[path] for path in paths}
+
+    def prune(self, blob_paths):
+        """Remove the keys of superseded objects, and the blobs no key links to anymore.
+
+        A key is only removed while it still links to the blob given, so
+        that the newer versions other workers fetched are kept, and a blob is
+        only removed, along with the files derived from it, holding its lock
+        once no key links to it. The processes that mapped the files keep
+        them until they unmap them.
+
+        :blob_paths: A dict mapping the data store paths of the objects to
+                     the blobs of their superseded versions, see `blob_paths`.
+        :returns: The number of blobs removed.
+        """
+        removed = 0
+        for path, blob_path in blob_paths.items():
+            local_path = os.path.join(self.store_dir, path)
+            with self._blob_lock(blob_path):
+                if not os.path.exists(blob_path):
+                    os.unlink(blob_path + '.lock')
+                    continue
+                if os.path.exists(local_path) and os.path.samefile(local_path, blob_path):
+                    os.unlink(local_path)
+                if os.stat(blob_path).st_nlink > 1:
+                    continue
+                blob_name = os.path.basename(blob_path)
+                for name in os.listdir(self.blob_dir):
+                    if name.startswith(blob_name + '.') and name != blob_name + '.lock':
+                        os.unlink(os.path.join(self.blob_dir, name))
+                os.unlink(blob_path)
+                # The lock goes last, processes waiting for it take the new one.
+                os.unlink(blob_path + '.lock')
+                removed += 1
+        if removed:
+            _logger.warning("Artifact cache: removed {} superseded objects".format(removed))
+        return removed
+
+    def fetch_all(self, paths):
+        """Fetch several objects concurrently.
+
+        :paths: The data store paths of the objects.
+        :returns: A LocalDataStore serving the cached copies under the same paths.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            downloaded = list(executor.map(self.fetch, paths))
+        _logger.warning("Artifact cache: {} of {} objects downloaded, the others were "
+                        "up to date".format(sum(downloaded), len(paths)))
+        return self.local_store
@@ -19,16 +19,30 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from recommendation_engine.data_store import data_store_wrapper
 """
+import json
 import os
+from contextlib import closing
+from rudra.data_store.local_data_store import LocalDataStore
+
+from recommendation_engine.utils.rating_matrix import RatingMatrix, RATING_MATRIX_SUFFIX, \
+    binary_rating_path, parse_rating_text
 
 
 def load_rating(path, data_store):
     """Load the rating matrix and return it as a list-of-lists.
 
+    A binary rating file, see `rating_path`, is read into a RatingMatrix
+    instead, which is memory-mapped from a local data store.
+
     :path: The local pathname for the rating matrix.
     :returns: The rating matrix in a list-of-lists format where the
               list at index i represents the itemeset of the ith user.
     """
+    if path.endswith(RATING_MATRIX_SUFFIX):
+        if isinstance(data_store, LocalDataStore):
+            return RatingMatrix.load(os.path.join(data_store.src_dir, path))
+        return RatingMatrix.from_buffer(data_store.read_generic_file(path))
+
     rating_file_contents = data_store.read_generic_file(path)
 
     if isinstance(rating_file_contents, (bytes, bytearray)):
@@ -47,6 +61,43 @@ def load_rating(path, data_store):
     return rating_matrix
 
 
+def load_rating_matrix(path, data_store):
+    """Load a binary or a text rating file as a RatingMatrix.
+
+    A text file is streamed from the data store and parsed chunk by chunk,
+    without decoding it into one string.
+
+    :path: The data store path of the rating file.
+    :returns: A RatingMatrix where row i holds the itemset of the ith user.
+    """
+    if path.endswith(RATING_MATRIX_SUFFIX):
+        return load_rating(path, data_store)
+    with closing(open_data_stream(path, data_store)) as stream:
+        return parse_rating_text(stream)
+
+
+def open_data_stream(path, data_store):
+    """Open a data store object as a binary file object.
+
+    :path: The data store path of the object.
+    :data_store: A LocalDataStore or a StreamingAmazonS3.
+    :returns: An object with read and close methods.
+    """
+    if isinstance(data_store, LocalDataStore):
+        return open(os.path.join(data_store.src_dir, path), 'rb')
+    return data_store.open_object(path)
+
+
+def rating_path(path, data_store):
+    """Get the path of the binary copy of a text rating file if the data store has one.
+
+    :path: The data store path of the text rating file.
+    :returns: The path to pass to `load_rating`.
+    """
+    binary_path = binary_rating_path(path)
+    return binary_path if object_exists(binary_path, data_store) else path
+
+
 def save_temporary_local_file(buf, local_filename):
     """Save contents of a buffer to local /tmp dir.
 
@@ -65,6 +116,68 @@ def check_path(path):
     is not exist.
     :returns: path in str format.
     """
-    if not os.path.exists(path):
-        os.makedirs(path)
+    os.makedirs(path, exist_ok=True)
     return path
+
+
+def object_exists(path, data_store):
+    """Check whether an object is present in the data store.
+
+    :path: The data store path of the object.
+    :returns: True if the object exists.
+    """
+    if isinstance(data_store, LocalDataStore):
+        return os.path.exists(os.path.join(data_store.src_dir, path))
+    return data_store.object_exists(path)
+
+
+def object_size(path, data_store):
+    """Get the size of an object in the data store from its metadata, without reading it.
+
+    :path: The data store path of the object.
+    :returns: The size in bytes, 0 if the object does not exist.
+    """
+    if isinstance(data_store, LocalDataStore):
+        local_path = os.path.join(data_store.src_dir, path)
+        return os.path.getsize(local_path) if os.path.exists(local_path) else 0
+    for summary in data_store.list_bucket_objects(prefix=path):
+        if summary.key == path:
+            return summary.size
+    return 0
+
+
+def write_json(path, contents, data_store):
+    """Write an object to the data store as JSON, replacing the previous one at once.
+
+    :path: The data store path of the object.
+    :contents: The object to write.
+    """
+    if isinstance(data_store, LocalDataStore):
+        local_path = os.path.join(data_store.src_dir, path)
+        with open(local_path + '.part', 'w') as local_file:
+            json.dump(contents, local_file)
+        os.replace(local_path + '.part', local_path)
+        return
+    data_store.write_json_file(path, contents)
+
+
+def get_local_copy(path, data_store, local_dir):
+    """Get a local filesystem path holding the contents of a data store object.
+
+    Objects of a local data store are used in place, other objects are
+    downloaded once under local_dir and reused by every process afterwards.
+
+    :path: The data store path of the object.
+    :local_dir: The directory to download the object to.
+    :returns: The local path of the object.
+    """
+    if isinstance(data_store, LocalDataStore):
+        return os.path.join(data_store.src_dir, path)
+    local_path = os.path.join(local_dir, path)
+    if not os.path.exists(local_path):
+        check_path(os.path.dirname(local_path))
+        temporary_path = '{}.{}.part'.format(local_path, os.getpid())
+        with open(temporary_path, 'wb') as local_fileobj:
+            local_fileobj.write(data_store.read_generic_file(path))
+        os.replace(temporary_path, local_path)
+    return local_path
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains a bounded least recently used cache with expiry.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread safe cache holding at most maxsize entries for at most ttl seconds.
+
+    The least recently used entry is evicted when the cache is full, and
+    expired entries are evicted when they are looked up.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        """Create a new cache.
+
+        :maxsize: The maximum number of entries, 0 disables the cache.
+        :ttl: The number of seconds an entry stays valid, None for no expiry.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Get the value cached for key, or default if there is none."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Cache value for key, evicting the least recently used entries if needed."""
+        if self.maxsize <= 0:
+            return
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expiry, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every cached entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        """Get the number of cached entries."""
+        return len(self._entries)
+
+    def stats(self):
+        """Get the hit, miss and eviction counters and the size of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries)
+            }
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains in-process metrics published in the Prometheus text format.
+
+Every gunicorn worker keeps its own metrics; once the registry is shared
+through a directory, a scrape renders the metrics of all the workers.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                                           .replace('"', '\\"').replace('\n', '\\n'))
+                          for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Metric(ABC):
+    """Base class of the metrics, holding one series per combination of label values."""
+
+    metric_type = None
+    # Whether the series of every worker are published apart, labelled with its pid,
+    # instead of added up; they are dropped once the worker is gone.
+    per_worker = False
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def snapshot(self):
+        """Get the series of the metric, a dict of label values tuples to values."""
+        with self._lock:
+            return dict(self._series)
+
+    @staticmethod
+    def _add(total, value):
+        return value if total is None else total + value
+
+    def merge(self, snapshots):
+        """Merge the snapshots of several workers.
+
+        :snapshots: A list of (pid, series) pairs, series as returned by snapshot.
+        :returns: The label names and the series of the merged metric.
+        """
+        if self.per_worker:
+            return self.label_names + ('worker',), {
+                key + (pid,): value for pid, series in snapshots for key, value in series.items()}
+        merged = {}
+        for _, series in snapshots:
+            for key, value in series.items():
+                merged[key] = self._add(merged.get(key), value)
+        return self.label_names, merged
+
+    @abstractmethod
+    def _samples(self, series):
+        """Get the (suffix, label values, extra labels, value) samples of the given series."""
+
+    def render(self, snapshots=None):
+        """Render the metric in the Prometheus text format.
+
+        :snapshots: The snapshots of the workers to merge, see merge; the series of this
+                    process by default.
+        """
+        if snapshots is None:
+            label_names, series = self.label_names, self.snapshot()
+        else:
+            label_names, series = self.merge(snapshots)
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.metric_type)]
+        for suffix, label_values, extra, value in self._samples(series):
+            lines.append('{}{}{} {}'.format(self.name, suffix,
+                                            _format_labels(label_names, label_values, extra),
+                                            _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increment the counter of the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _samples(self, series):
+        return [('', key, (), value) for key, value in sorted(series.items())]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, either set directly or read from a callback."""
+
+    metric_type = 'gauge'
+    per_worker = True
+
+    def __init__(self, name, documentation, label_names=(), callback=None):
+        """Create a gauge, callback returns a dict of label values tuples to values."""
+        _Metric.__init__(self, name, documentation, label_names)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        """Set the value of the given labels."""
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        """Add amount to the value of the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """Subtract amount from the value of the given labels."""
+        self.inc(-amount, **labels)
+
+    def snapshot(self):
+        """Get the series of the gauge, read from the callback if it has one."""
+        if self.callback is not None:
+            return dict(self.callback())
+        return _Metric.snapshot(self)
+
+    def _samples(self, series):
+        return [('', key, (), value) for key, value in sorted(series.items())]
+
+
+class Histogram(_Metric):
+    """Counts of observed values in cumulative buckets, with their sum."""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        """Create a histogram with the given bucket upper bounds."""
+        _Metric.__init__(self, name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Record a value for the given labels."""
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bucket] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the number of seconds spent in the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Get the series of the histogram, each a [bucket counts, sum] pair."""
+        with self._lock:
+            return {key: [list(counts), total] for key, (counts, total) in self._series.items()}
+
+    @staticmethod
+    def _add(total, value):
+        if total is None:
+            return [list(value[0]), value[1]]
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1]]
+
+    def _samples(self, series):
+        samples = []
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """The collection of metrics published by the service.
+
+    Every gunicorn worker keeps its own metrics. Once shared, each worker
+    writes its series to a directory the workers share every few seconds and
+    a scrape served by any of them renders the series of all of them: the
+    counters and histograms added up, those of the workers gone included so
+    that they never go down, and the gauges apart with a worker label.
+    """
+
+    def __init__(self):
+        """Create an empty registry, publishing the series of this process only."""
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.directory = None
+        self._pid = None
+        self._path = None
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, label_names=()):
+        """Get the counter of this name, creating it if needed."""
+        return self._register(Counter, name, documentation, label_names)
+
+    def gauge(self, name, documentation, label_names=(), callback=None):
+        """Get the gauge of this name, creating it if needed."""
+        return self._register(Gauge, name, documentation, label_names, callback=callback)
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        """Get the histogram of this name, creating it if needed."""
+        return self._register(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def share(self, directory, flush_seconds=5):
+        """Publish the series of every process sharing the directory.
+
+        The directory has to be emptied when the service starts, the series of
+        the workers gone are published until then.
+
+        :directory: The directory the processes write their series to.
+        :flush_seconds: The number of seconds between two writes of a process.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._pid = os.getpid()
+        # A worker started again with the pid of one gone does not overwrite its series.
+        self._path = os.path.join(directory, '{}-{}.json'.format(self._pid, uuid.uuid4().hex))
+        self.flush()
+        flusher = threading.Thread(target=self._flush_every, args=(flush_seconds,),
+                                   name='metrics-flusher', daemon=True)
+        flusher.start()
+
+    def _flush_every(self, flush_seconds):
+        while True:
+            time.sleep(flush_seconds)
+            self.flush()
+
+    def flush(self):
+        """Write the series of this process to the shared directory."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        contents = {'pid': self._pid,
+                    'metrics': {metric.name: [[list(key), value]
+                                              for key, value in metric.snapshot().items()]
+                                for metric in metrics}}
+        part_path = self._path + '.part'
+        with open(part_path, 'w') as part_file:
+            json.dump(contents, part_file)
+        os.replace(part_path, self._path)
+
+    def _snapshots(self):
+        self.flush()
+        snapshots = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as json_file:
+                    contents = json.load(json_file)
+            except (OSError, ValueError):
+                continue
+            pid = contents['pid']
+            alive = _alive(pid)
+            for name, series in contents['metrics'].items():
+                snapshots.setdefault(name, []).append(
+                    (pid, alive, {tuple(key): value for key, value in series}))
+        return snapshots
+
+    def render(self):
+        """Render every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        if self.directory is None:
+            return '\n'.join(metric.render() for metric in metrics) + '\n'
+        snapshots = self._snapshots()
+        return '\n'.join(metric.render([(pid, series)
+                                        for pid, alive, series in snapshots.get(metric.name, [])
+                                        if alive or not metric.per_worker])
+                         for metric in metrics) + '\n'
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains a scheduler running the work of concurrent callers in batches.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import daiquiri
+
+daiquiri.setup(level=logging.WARNING)
+_logger = daiquiri.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collect the items submitted by concurrent callers and handle them together.
+
+    A background thread takes the first item waiting, then keeps collecting
+    items until the window has passed since it took the first one or the
+    batch has reached its maximum size, and hands the whole batch to the
+    handler. Every caller blocks until the result of its own item is ready.
+    """
+
+    def __init__(self, handler, window_seconds, max_batch_size):
+        """Start the batching thread.
+
+        :handler: A callable taking a list of items and returning the list
+                  of their results, in the same order. A result that is an
+                  exception is raised to the caller of its item only.
+        :window_seconds: The longest time an item waits for others to join it.
+        :max_batch_size: The batch size that makes a batch run right away,
+                         sizes being the ones given to `submit`.
+        """
+        self._handler = handler
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item, size=1):
+        """Have an item handled with the ones of the other callers.
+
+        :item: The item to pass to the handler.
+        :size: The size of the item counted against the maximum batch size.
+        :returns: The result of the item.
+        :raises: The exception of the handler, if it failed on the batch.
+        """
+        future = Future()
+        self._queue.put((item, size, future))
+        return future.result()
+
+    def close(self):
+        """Stop the batching thread once the items already submitted are handled."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        """Collect a batch starting with the first item waiting."""
+        batch = [first]
+        batch_size = first[1]
+        deadline = time.monotonic() + self.window_seconds
+        while batch_size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if pending is None:
+                # Put the stop marker back so the loop ends after this batch.
+                self._queue.put(None)
+                break
+            batch.append(pending)
+            batch_size += pending[1]
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            try:
+                results = self._handler([item for item, _, _ in batch])
+            except Exception as e:
+                _logger.exception("Micro-batch of {} items failed".format(len(batch)))
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains the compressed sparse row form of the rating and manifest files.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+
+import numpy as np
+
+from recommendation_engine.utils.array_bundle import write_array_bundle, read_array_bundle, \
+    read_array_bundle_from_buffer
+
+RATING_MATRIX_SUFFIX = '.csr'
+RATING_PARSE_CHUNK_SIZE = 1 << 20
+
+_DIGIT = np.zeros(256, dtype=bool)
+_DIGIT[ord('0'):ord('9') + 1] = True
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[[ord(character) for character in ' \t\n\r\v\f']] = True
+# Ids of up to 18 digits fit in an int64 whatever their digits are.
+_POWERS_OF_TEN = 10 ** np.arange(18, dtype=np.int64)
+
+
+def binary_rating_path(path):
+    """Get the path of the binary copy of a text rating file."""
+    return os.path.splitext(path)[0] + RATING_MATRIX_SUFFIX
+
+
+def _parse_lines(buffer):
+    """Parse complete lines of the text rating format.
+
+    Every digit run is a token, the first token of a line is the rating count
+    and the others are the ids of the row, dropped when the count is 0. Lines
+    without any token are skipped like the blank lines around the text.
+
+    :buffer: Bytes holding whole lines.
+    :returns: The number of distinct ids of every row and the sorted ids of
+              all the rows, one row after the other.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    digits = _DIGIT[data]
+    if not np.all(digits | _WHITESPACE[data]):
+        raise ValueError("The rating file holds a token that is not a number")
+    previous_digits = np.concatenate(([False], digits[:-1]))
+    next_digits = np.concatenate((digits[1:], [False]))
+    starts = np.flatnonzero(digits & ~previous_digits)
+    ends = np.flatnonzero(digits & ~next_digits) + 1
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+    token_lengths = ends - starts
+    if token_lengths.max() > len(_POWERS_OF_TEN):
+        raise ValueError("The rating file holds a number that is too large")
+    # Every digit is weighted by its power of ten and the weighted digits of a token summed.
+    digit_positions = np.flatnonzero(digits)
+    digit_tokens = np.repeat(np.arange(len(starts)), token_lengths)
+    weighted_digits = (data[digit_positions] - ord('0')).astype(np.int64) * \
+        _POWERS_OF_TEN[ends[digit_tokens] - 1 - digit_positions]
+    values = np.add.reduceat(weighted_digits, np.cumsum(token_lengths) - token_lengths)
+    token_lines = np.searchsorted(np.flatnonzero(data == ord('\n')), starts)
+    first_tokens = np.concatenate(([True], token_lines[1:] != token_lines[:-1]))
+    token_rows = np.cumsum(first_tokens) - 1
+    counts = values[first_tokens]
+    rated = ~first_tokens & (counts[token_rows] != 0)
+    rows, ids = token_rows[rated], values[rated]
+    if len(ids) and ids.max() > np.iinfo(np.int32).max:
+        raise ValueError("The rating file holds an id that is too large")
+    # Sorting a single key made of the row and the id orders the ids within every row.
+    keys = np.sort((rows << 31) | ids)
+    distinct = np.ones(len(keys), dtype=bool)
+    distinct[1:] = keys[1:] != keys[:-1]
+    keys = keys[distinct]
+    return np.bincount(keys >> 31, minlength=len(counts)), \
+        (keys & np.iinfo(np.int32).max).astype(np.int32)
+
+
+def parse_rating_text(stream, chunk_size=RATING_PARSE_CHUNK_SIZE):
+    """Parse the text rating format into a RatingMatrix, chunk by chunk.
+
+    The rows are the same as the ones `fileutils.load_rating` parses, sorted
+    and without duplicates. Only the CSR arrays grow with the file, the
+    memory used while tokenizing is bounded by the chunk size and the length
+    of the longest line.
+
+    :stream: A binary file object with the text rating file.
+    :chunk_size: The number of bytes read at once.
+    :returns: A RatingMatrix with a row per line.
+    """
+    row_lengths = []
+    indices = []
+    remainder = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer = remainder + chunk
+        # The last line of a chunk is usually cut, it is parsed with the next chunk.
+        end = len(buffer) if not chunk else buffer.rfind(b'\n') + 1
+        remainder = buffer[end:]
+        if end > 0:
+            lengths, ids = _parse_lines(buffer[:end])
+            row_lengths.append(lengths)
+            indices.append(ids)
+        if not chunk:
+            break
+    indptr = np.zeros(sum(len(lengths) for lengths in row_lengths) + 1, dtype=np.int64)
+    if row_lengths:
+        np.cumsum(np.concatenate(row_lengths), out=indptr[1:])
+    return RatingMatrix(indptr, np.concatenate(indices) if indices
+                        else np.empty(0, dtype=np.int32))
+
+
+class RatingMatrix:
+    """Rows of ids in the compressed sparse row layout.
+
+    Row i holds indices[indptr[i]:indptr[i + 1]], sorted and without
+    duplicates like the sets the text format is parsed into. A row is a view
+    into indices, so a matrix read from a memory-mapped array bundle is never
+    copied.
+    """
+
+    def __init__(self, indptr, indices):
+        """Create a matrix out of its row offsets and its concatenated rows.
+
+        :indptr: The offset of every row in indices, followed by len(indices).
+        :indices: The ids of all the rows, one row after the other.
+        """
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a matrix out of a sequence of rows of ids."""
+        rows = [np.unique(np.asarray(row, dtype=np.int32)) for row in rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in rows], out=indptr[1:])
+        indices = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+        return cls(indptr, indices.astype(np.int32))
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a matrix saved to a local file."""
+        arrays = read_array_bundle(path)
+        return cls(arrays["indptr"], arrays["indices"])
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """Get a matrix out of the contents of a saved file without copying them."""
+        arrays = read_array_bundle_from_buffer(buffer)
+        return cls(arrays["indptr"], arrays["indices"])
+
+    def save(self, path):
+        """Save the matrix to a local file."""
+        write_array_bundle(path, {"indptr": self.indptr, "indices": self.indices})
+
+    @property
+    def lengths(self):
+        """Get the number of ids of every row."""
+        return np.diff(self.indptr)
+
+    def __len__(self):
+        """Get the number of rows."""
+        return len(self.indptr) - 1
+
+    def __getitem__(self, row):
+        """Get the ids of a row."""
+        if row < 0:
+            row += len(self)
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def __iter__(self):
+        """Iterate over the rows."""
+        for row in range(len(self)):
+            yield self.indices[self.indptr[row]:self.indptr[row + 1]]
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains the S3 data store the scoring service reads its artifacts from.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from rudra.data_store.aws import AmazonS3
+
+
+class StreamingAmazonS3(AmazonS3):
+    """An S3 data store that can also stream an object instead of reading it at once."""
+
+    def open_object(self, path):
+        """Open an object of the bucket as a binary file object.
+
+        The body is read from S3 as it is consumed, so large objects are
+        never held in memory as a whole.
+
+        :path: The data store path of the object.
+        :returns: An object with read and close methods.
+        """
+        return self._s3.Object(self.bucket_name, path).get()['Body']
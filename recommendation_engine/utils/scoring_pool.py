@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains the pool of threads scoring runs on under cooperative workers.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+
+import daiquiri
+
+daiquiri.setup(level=logging.WARNING)
+_logger = daiquiri.getLogger(__name__)
+
+
+def gevent_patched():
+    """Check whether gevent has monkey-patched threading, as gunicorn gevent workers do."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+class ScoringPool:
+    """Run CPU bound calls without holding up the requests of a cooperative worker.
+
+    Under gevent, threads are greenlets sharing a single OS thread, so a
+    call scoring stacks would stop every other request of the worker until
+    it returns. The calls then run on a bounded pool of OS threads instead,
+    numpy and BLAS releasing the GIL while the event loop keeps parsing
+    requests and writing responses. Outside of gevent every request already
+    has a thread of its own and the calls run in place.
+    """
+
+    def __init__(self, size):
+        """Create the pool.
+
+        :size: The number of OS threads calls run on under gevent.
+        """
+        self.size = size
+        self._pool = None
+        if gevent_patched():
+            from gevent.threadpool import ThreadPool
+            self._pool = ThreadPool(size)
+            _logger.warning("Scoring on a pool of {} threads".format(size))
+
+    def run(self, func, *args, **kwargs):
+        """Call func with the arguments on the pool and wait for its result."""
+        if self._pool is None:
+            return func(*args, **kwargs)
+        return self._pool.apply(func, args, kwargs)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file contains compact, memory-mappable tables of strings.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+_PREFIX_SIZE = 8
+
+
+class StringTable:
+    """An immutable list of strings packed into a utf-8 blob and an offsets array.
+
+    String i is blob[offsets[i]:offsets[i + 1]], decoded when it is looked
+    up, so the table holds two arrays rather than a Python object per
+    string and can be memory-mapped out of an array bundle.
+    """
+
+    def __init__(self, blob, offsets):
+        """Create a table out of its arrays.
+
+        :blob: The uint8 array of the concatenated utf-8 strings.
+        :offsets: The int64 offset of every string in blob, followed by len(blob).
+        """
+        self.blob = blob
+        self.offsets = offsets
+        # Memory views index and slice the arrays into Python ints and bytes much faster.
+        self._blob_view = memoryview(np.ascontiguousarray(blob))
+        self._offsets_view = memoryview(np.ascontiguousarray(offsets, dtype=np.int64))
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Pack a sequence of strings into a table."""
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        """Get the table stored under name by `to_arrays` out of a dict of arrays."""
+        return cls(arrays[name + "_blob"], arrays[name + "_offsets"])
+
+    def to_arrays(self, name):
+        """Get the arrays of the table as a dict, to store them under name."""
+        return {name + "_blob": self.blob, name + "_offsets": self.offsets}
+
+    def encoded(self, idx):
+        """Get the utf-8 bytes of string idx."""
+        return bytes(self._blob_view[self._offsets_view[idx]:self._offsets_view[idx + 1]])
+
+    def __len__(self):
+        """Get the number of strings."""
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        """Get string idx."""
+        if not 0 <= idx < len(self):
+            raise IndexError("String table index out of range")
+        return self.encoded(idx).decode('utf-8')
+
+    def __iter__(self):
+        """Iterate over the strings."""
+        for idx in range(len(self)):
+            yield self.encoded(idx).decode('utf-8')
+
+
+class PackageNameIndex(StringTable):
+    """The package names of a model, looked up by id and by name.
+
+    Besides the names in id order, the index holds the ids sorted by the
+    utf-8 bytes of their name. The first bytes of the sorted names narrow a
+    lookup down with a vectorized search and a binary search over the full
+    names of the few candidates left finishes it.
+    """
+
+    def __init__(self, blob, offsets, order):
+        """Create an index out of its arrays.
+
+        :blob: The uint8 array of the concatenated utf-8 names, in id order.
+        :offsets: The int64 offset of every name in blob, followed by len(blob).
+        :order: The ids sorted by the utf-8 bytes of their name.
+        """
+        StringTable.__init__(self, blob, offsets)
+        self.order = order
+        self._order_view = memoryview(np.ascontiguousarray(order, dtype=np.int64))
+        self._prefixes = self._name_prefixes(order)
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Build an index of the names of ids 0 to len(strings) - 1."""
+        table = StringTable.from_strings(strings)
+        order = np.array(sorted(range(len(table)), key=table.encoded), dtype=np.int64)
+        return cls(table.blob, table.offsets, order)
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        """Get the index stored under name by `to_arrays` out of a dict of arrays."""
+        return cls(arrays[name + "_blob"], arrays[name + "_offsets"], arrays[name + "_order"])
+
+    def to_arrays(self, name):
+        """Get the arrays of the index as a dict, to store them under name."""
+        arrays = StringTable.to_arrays(self, name)
+        arrays[name + "_order"] = self.order
+        return arrays
+
+    def _name_prefixes(self, ids):
+        """Get the first bytes of the names of ids as integers ordered like the names."""
+        starts = self.offsets[ids]
+        lengths = self.offsets[np.asarray(ids) + 1] - starts
+        prefixes = np.zeros((len(starts), _PREFIX_SIZE), dtype=np.uint8)
+        for position in range(_PREFIX_SIZE):
+            longer = lengths > position
+            prefixes[longer, position] = self.blob[starts[longer] + position]
+        return prefixes.view('>u8').ravel().astype(np.uint64)
+
+    @staticmethod
+    def _prefix(encoded_name):
+        return int.from_bytes(encoded_name[:_PREFIX_SIZE].ljust(_PREFIX_SIZE, b'\0'), 'big')
+
+    def lookup(self, names):
+        """Get the ids of several names.
+
+        :names: A list of package names.
+        :returns: An int64 array with the id of every name, -1 for unknown names.
+        """
+        encoded_names = [name.encode('utf-8') if isinstance(name, str) else None
+                         for name in names]
+        prefixes = np.array([self._prefix(name) if name is not None else 0
+                             for name in encoded_names], dtype=np.uint64)
+        lows = np.searchsorted(self._prefixes, prefixes, side='left').tolist()
+        highs = np.searchsorted(self._prefixes, prefixes, side='right').tolist()
+        ids = np.full(len(names), -1, dtype=np.int64)
+        for position, (name, low, high) in enumerate(zip(encoded_names, lows, highs)):
+            if name is None:
+                continue
+            while low + 1 < high:
+                middle = (low + high) // 2
+                if self.encoded(self._order_view[middle]) <= name:
+                    low = middle
+                else:
+                    high = middle
+            if low < high and self.encoded(self._order_view[low]) == name:
+                ids[position] = self._order_view[low]
+        return ids
+
+    def get(self, name, default=-1):
+        """Get the id of a name, or default if the name is unknown."""
+        package_id = int(self.lookup([name])[0])
+        return default if package_id == -1 else package_id
+
+    def __contains__(self, name):
+        """Check whether a name is in the index."""
+        return self.get(name) != -1
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test fixtures shared by the tests of the model artifacts.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+import tempfile
+from rudra.data_store.local_data_store import LocalDataStore
+from recommendation_engine.predictor.online_recommendation import PMFRecommendation
+
+TEST_DATA_DIR = 'tests/test_data'
+
+
+def temporary_directory(test_case):
+    """Create a temporary directory removed once the test is done."""
+    tmp_dir = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, tmp_dir)
+    return tmp_dir
+
+
+def copy_test_data(test_case):
+    """Copy the test data into a temporary directory removed once the test is done.
+
+    The tests export artifacts into the copy, the test data itself is left
+    alone.
+
+    :returns: A (temporary directory, copy of the test data) tuple.
+    """
+    tmp_dir = temporary_directory(test_case)
+    data_dir = os.path.join(tmp_dir, 'test_data')
+    shutil.copytree(TEST_DATA_DIR, data_dir)
+    return tmp_dir, data_dir
+
+
+def pmf_recommendation(data_dir=TEST_DATA_DIR, **kwargs):
+    """Create the recommender of the test data, or of a copy of it, the way the tests compare."""
+    return PMFRecommendation(2, data_store=LocalDataStore(data_dir), num_latent=50, **kwargs)
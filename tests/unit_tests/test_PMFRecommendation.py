@@ -18,8 +18,12 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-from unittest import TestCase
+import json
+import time
+from unittest import TestCase, mock
+import numpy as np
 from rudra.data_store.local_data_store import LocalDataStore
+from recommendation_engine.config.params_scoring import ScoringParams
 from recommendation_engine.predictor.online_recommendation import PMFRecommendation
 
 
@@ -30,7 +34,9 @@ class TestPMFRecommendation(TestCase):
         """Instantiate the resources required for the tests."""
         self.fs = LocalDataStore('tests/test_data')
         self.assertTrue(self.fs.get_name().endswith('tests/test_data'))
-        self.pmf_rec = PMFRecommendation(2, data_store=self.fs, num_latent=50)
+        # The result cache is opt-in, the tests cover the cached scoring path as well.
+        with mock.patch.object(ScoringParams, 'result_cache_size', 10000):
+            self.pmf_rec = PMFRecommendation(2, data_store=self.fs, num_latent=50)
 
     def test__find_closest_user_in_training_set(self):
         """Test if we are getting correct "closest user" from the training set."""
@@ -44,6 +50,31 @@ class TestPMFRecommendation(TestCase):
         closest = self.pmf_rec._find_closest_user_in_training_set([3, 4])
         self.assertIsNotNone(closest)
 
+    def test__find_closest_user_matches_linear_scan(self):
+        """Test that the posting-list lookup agrees with a scan over all stacks."""
+        def linear_scan(new_user_stack):
+            new_user_stack = set(new_user_stack)
+            min_diff, closest = None, None
+            for idx, stack in enumerate(self.pmf_rec.user_stacks):
+                diff = len(set(stack) - new_user_stack)
+                if new_user_stack.issubset(stack) and (min_diff is None or diff < min_diff):
+                    min_diff, closest = diff, idx
+            return closest
+
+        queries = [[], [22], [34, 22], [111, 51, 34, 22], [111, 1], [4, 5, 7], [134, 999]]
+        queries += [stack[:3] for stack in self.pmf_rec.user_stacks]
+        for query in queries:
+            self.assertEqual(self.pmf_rec._find_closest_user_in_training_set(query),
+                             linear_scan(query))
+
+    def test__top_k(self):
+        """Test that top-k selection skips the input packages and sorts by score."""
+        scores = np.array([[0.5, 0.9, 0.1, 0.7, 0.3],
+                           [0.5, 0.9, 0.1, 0.7, 0.3]])
+        top = PMFRecommendation._top_k(scores, [[1], [0, 1, 2, 3]], [2, 3])
+        self.assertListEqual(top[0].tolist(), [3, 0])
+        self.assertListEqual(top[1].tolist(), [4])
+
     def test__sigmoid(self):
         """Test if the sigmoid function is behaving correctly."""
         self.assertEqual(self.pmf_rec._sigmoid(0), 0.5)
@@ -68,3 +99,161 @@ class TestPMFRecommendation(TestCase):
         # Test for precomputed stack.
         _, recommendation, _ = self.pmf_rec.predict(["statuses", "debuglog", "unpipe"])
         self.assertTrue(recommendation)
+
+    def test_predict_batch(self):
+        """Test that scoring stacks together gives the same result as one at a time."""
+        stacks = [["nopt"], ["iferr", "missing"], ["missing"], ["statuses", "debuglog", "unpipe"]]
+        thresholds = [None, 1, 2, 3]
+        results = self.pmf_rec.predict_batch(stacks, thresholds)
+        self.assertEqual(len(results), len(stacks))
+        for stack, threshold, result in zip(stacks, thresholds, results):
+            missing, recommendations, package_topic_dict = self.pmf_rec.predict(stack, threshold)
+            self.assertEqual(result[0], missing)
+            self.assertEqual(result[2], package_topic_dict)
+            self.assertEqual([r["package_name"] for r in result[1]],
+                             [r["package_name"] for r in recommendations])
+            for batched, single in zip(result[1], recommendations):
+                self.assertAlmostEqual(batched["cooccurrence_probability"],
+                                       single["cooccurrence_probability"], places=4)
+        self.assertEqual(self.pmf_rec.predict_batch([]), [])
+
+    def test_predict_batch_json(self):
+        """Test that the response assembled from fragments is the encoded response."""
+        stacks = [["nopt", "iferr", "nopt"], ["missing"], ["statuses", "debuglog", "unpipe"]]
+        thresholds = [3, 2, 2]
+        expected = [{
+            "missing_packages": missing,
+            "companion_packages": recommendations,
+            "ecosystem": "npm",
+            "package_to_topic_dict": package_topic_dict,
+            "scoring_path": scoring_path
+        } for (missing, recommendations, package_topic_dict), scoring_path in zip(
+            self.pmf_rec.predict_batch(stacks, thresholds), ["cache", "skipped", "cache"])]
+        self.assertEqual(self.pmf_rec.predict_batch_json(stacks, thresholds, ecosystem="npm"),
+                         json.dumps(expected, sort_keys=True))
+        self.assertEqual(json.loads(self.pmf_rec.predict_batch_json([])), [])
+
+    def test_package_topics(self):
+        """Test that topic lists are decoded once and then served from the cache."""
+        package_id = self.pmf_rec.package_index.lookup(["nopt"])[0]
+        with mock.patch('recommendation_engine.predictor.online_recommendation.json.loads',
+                        wraps=json.loads) as loads:
+            topics = self.pmf_rec._package_topics(package_id)
+            self.assertIs(self.pmf_rec._package_topics(package_id), topics)
+        self.assertEqual(loads.call_count, 1)
+        self.assertEqual(json.dumps(topics), self.pmf_rec._topic_fragments[package_id])
+
+    def test_predict_requests_json(self):
+        """Test that requests scored together get the responses they get on their own."""
+        requests = [([["nopt"], ["missing"]], [2, 2], None), ([], [], None),
+                    ([["statuses", "debuglog", "unpipe"]], None, None)]
+        responses = self.pmf_rec.predict_requests_json(requests, ecosystem="npm")
+        self.assertEqual(len(responses), len(requests))
+        for (stacks, thresholds, _), response in zip(requests, responses):
+            expected = json.loads(self.pmf_rec.predict_batch_json(stacks, thresholds,
+                                                                  ecosystem="npm"))
+            response = json.loads(response)
+            self.assertEqual(len(response), len(expected))
+            for batched, single in zip(response, expected):
+                self.assertEqual(batched["package_to_topic_dict"], single["package_to_topic_dict"])
+                self.assertEqual([r["package_name"] for r in batched["companion_packages"]],
+                                 [r["package_name"] for r in single["companion_packages"]])
+
+    def test_deadline(self):
+        """Test that cheaper scoring paths take over as the deadline gets close."""
+        def scoring_path(stack, deadline):
+            return json.loads(self.pmf_rec.predict_batch_json([stack], [2],
+                                                              deadline=deadline))[0]["scoring_path"]
+        self.assertEqual(scoring_path(["nopt"], time.monotonic() + 60), "precomputed")
+        self.assertEqual(scoring_path(["nopt"], time.monotonic() - 1), "cache")
+        self.assertEqual(scoring_path(["send", "nopt"], None), "fold_in")
+        self.pmf_rec.result_cache.clear()
+        self.pmf_rec._stage_costs['fold_in'] = 60
+        self.assertEqual(scoring_path(["send", "nopt"], time.monotonic() + 30), "nearest_user")
+        self.assertEqual(self.pmf_rec.result_cache.stats()["size"], 0)
+        _, recommendations, _ = self.pmf_rec.predict(["once", "qs"], 3,
+                                                     deadline=time.monotonic() - 1)
+        self.assertEqual([r["package_name"] for r in recommendations],
+                         ["read-package-json", "which", "cli-table2"])
+        self.assertEqual(scoring_path(["once", "qs"], time.monotonic() - 1), "popular")
+
+    def test_batch_deadline(self):
+        """Test that the deadline of a batch leaves time to score all of its stacks."""
+        self.pmf_rec.result_cache.clear()
+        self.pmf_rec._stage_costs['score'] = 0.1
+        paths = [stack["scoring_path"] for stack in json.loads(self.pmf_rec.predict_batch_json(
+            [["nopt"]] * 5, [2] * 5, deadline=time.monotonic() + 0.3))]
+        # Only the last two stacks fit in the scoring pass along with the ones after them.
+        self.assertEqual(paths, ["popular"] * 3 + ["precomputed"] * 2)
+        self.pmf_rec.result_cache.clear()
+        self.assertEqual(json.loads(self.pmf_rec.predict_batch_json(
+            [["nopt"]], [2], deadline=time.monotonic() + 0.3))[0]["scoring_path"], "precomputed")
+
+    def test_score_cost(self):
+        """Test that the scoring cost the deadlines go by is the one of a single stack."""
+        score_stacks = self.pmf_rec._score_stacks
+        scored = []
+
+        def slow_score_stacks(user_matrix, *args):
+            time.sleep(0.3)
+            scored.append(len(user_matrix))
+            return score_stacks(user_matrix, *args)
+        self.pmf_rec.result_cache.clear()
+        self.pmf_rec._stage_costs['score'] = 0.0
+        with mock.patch.object(self.pmf_rec, '_score_stacks', slow_score_stacks):
+            self.pmf_rec.predict_batch_json([["nopt"], ["send", "nopt"], ["iferr", "missing"],
+                                             ["statuses", "debuglog", "unpipe"]])
+        self.assertEqual(len(scored), 1)
+        self.assertGreater(scored[0], 1)
+        self.assertGreaterEqual(self.pmf_rec._stage_costs['score'], 0.3 / scored[0])
+        self.assertLess(self.pmf_rec._stage_costs['score'], 0.3)
+
+    def test_similar_user(self):
+        """Test that an unseen stack close to a training stack is served as that stack."""
+        with mock.patch.object(ScoringParams, 'minhash_num_perm', 32):
+            recommender = PMFRecommendation(2, data_store=self.fs, num_latent=50)
+        stack = ["parseurl", "send", "encodeurl", "escape-html", "nopt"]
+        self.assertEqual(json.loads(recommender.predict_batch_json([stack]))[0]["scoring_path"],
+                         "similar_user")
+        self.assertEqual(json.loads(self.pmf_rec.predict_batch_json([stack]))[0]["scoring_path"],
+                         "fold_in")
+        stack.append("qs")
+        self.assertEqual(json.loads(recommender.predict_batch_json([stack]))[0]["scoring_path"],
+                         "fold_in")
+
+    def test_validate(self):
+        """Test the consistency checks of a loaded model."""
+        self.pmf_rec.validate()
+        self.assertEqual(len(self.pmf_rec.sample_stacks(2)), 2)
+        self.pmf_rec.num_latent = 5
+        self.assertRaises(ValueError, self.pmf_rec.validate)
+
+    def test_result_cache(self):
+        """Test that repeated stacks are served from the cache."""
+        first = self.pmf_rec.predict(["nopt"], 2)
+        self.pmf_rec._user_latent_vector = None
+        self.assertEqual(self.pmf_rec.predict(["nopt"], 2), first)
+        self.assertEqual(self.pmf_rec.result_cache.stats()["hits"], 1)
+        # Recommendations cached for another model version are never served.
+        self.pmf_rec.model_version = 'other'
+        self.assertRaises(TypeError, self.pmf_rec.predict, ["nopt"], 2)
+
+    def test_warm_up(self):
+        """Test that warming up leaves the predictions and an empty result cache."""
+        expected = self.pmf_rec.predict(["nopt"], 2)
+        self.pmf_rec.warm_up()
+        self.assertEqual(self.pmf_rec.result_cache.stats(),
+                         {"hits": 0, "misses": 0, "evictions": 0, "size": 0})
+        self.assertEqual(self.pmf_rec.predict(["nopt"], 2), expected)
+
+    def test_predict_with_mips_index(self):
+        """Test that probing every list of the item index gives the exact recommendations."""
+        exact = self.pmf_rec.predict(["nopt"], 3)
+        nlist, ScoringParams.mips_nlist = ScoringParams.mips_nlist, 4
+        try:
+            approximate_rec = PMFRecommendation(2, data_store=self.fs, num_latent=50)
+        finally:
+            ScoringParams.mips_nlist = nlist
+        self.assertEqual(approximate_rec.predict(["nopt"], 3, nprobe=4), exact)
+        _, recommendations, _ = approximate_rec.predict(["nopt"], 3, nprobe=1)
+        self.assertLessEqual(len(recommendations), 3)
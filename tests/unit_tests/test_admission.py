@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the admission control.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from unittest import TestCase
+from recommendation_engine.utils.admission import AdmissionControl
+
+
+class TestAdmissionControl(TestCase):
+    """Test bounding the number of requests in flight."""
+
+    def test_limit(self):
+        """Test that requests over the limit are turned away until a place is released."""
+        admission = AdmissionControl(2)
+        with admission.admit() as first, admission.admit() as second:
+            self.assertTrue(first and second)
+            with admission.admit() as third:
+                self.assertFalse(third)
+            self.assertEqual(admission.in_flight, 2)
+        self.assertEqual(admission.in_flight, 0)
+        with admission.admit() as admitted:
+            self.assertTrue(admitted)
+
+    def test_release_on_error(self):
+        """Test that a failed request releases its place."""
+        admission = AdmissionControl(1)
+        with self.assertRaises(ValueError):
+            with admission.admit():
+                raise ValueError()
+        self.assertEqual(admission.in_flight, 0)
+
+    def test_no_limit(self):
+        """Test that a limit of 0 admits every request."""
+        admission = AdmissionControl(0)
+        self.assertTrue(all(admission.try_enter() for _ in range(100)))
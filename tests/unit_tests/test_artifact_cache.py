@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the local artifact cache.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+import threading
+from unittest import TestCase, mock
+from rudra.data_store.local_data_store import LocalDataStore
+from recommendation_engine.config.path_constants import PACKAGE_TAG_MAP, ITEM_USER_FILEPATH
+from recommendation_engine.utils.artifact_cache import ArtifactCache
+from data_fixtures import copy_test_data, pmf_recommendation
+
+
+class TestArtifactCache(TestCase):
+    """Test fetching and revalidating cached artifacts."""
+
+    def setUp(self):
+        """Use a copy of the test data as the source data store."""
+        self.tmp_dir, self.source_dir = copy_test_data(self)
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.cache = ArtifactCache(LocalDataStore(self.source_dir), self.cache_dir)
+
+    def test_fetch(self):
+        """Test that objects are only downloaded again once they changed."""
+        self.assertTrue(self.cache.fetch(PACKAGE_TAG_MAP))
+        self.assertFalse(self.cache.fetch(PACKAGE_TAG_MAP))
+        with open(os.path.join(self.source_dir, PACKAGE_TAG_MAP), 'w') as tag_map:
+            tag_map.write('{"express": ["web", "framework"]}')
+        self.assertTrue(self.cache.fetch(PACKAGE_TAG_MAP))
+        self.assertDictEqual(self.cache.local_store.read_json_file(PACKAGE_TAG_MAP),
+                             {"express": ["web", "framework"]})
+
+    def test_shared_copies(self):
+        """Test that workers fetching an object together download it once into one inode."""
+        downloads = []
+        download = ArtifactCache._download
+
+        def counted_download(cache, path, target):
+            downloads.append(path)
+            download(cache, path, target)
+        caches = [ArtifactCache(LocalDataStore(self.source_dir), self.cache_dir)
+                  for _ in range(4)]
+        with mock.patch.object(ArtifactCache, '_download', counted_download):
+            threads = [threading.Thread(target=cache.fetch, args=(ITEM_USER_FILEPATH,))
+                       for cache in caches]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(downloads, [ITEM_USER_FILEPATH])
+        local_path = os.path.join(self.cache.store_dir, ITEM_USER_FILEPATH)
+        inode = os.stat(local_path).st_ino
+        self.assertFalse(self.cache.fetch(ITEM_USER_FILEPATH))
+        self.assertEqual(os.stat(local_path).st_ino, inode)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(local_path))
+                          if name.endswith('.part')], [])
+
+    def test_remote_store(self):
+        """Test that remote objects are versioned by their ETag and fetched by key."""
+        store = mock.Mock(spec=['get_name', 'list_bucket_objects', 'download_file'])
+        store.get_name.return_value = 'bucket'
+        store.list_bucket_objects.return_value = [
+            mock.Mock(key=PACKAGE_TAG_MAP + '.old', e_tag='"other"'),
+            mock.Mock(key=PACKAGE_TAG_MAP, e_tag='"abc"')]
+        store.download_file.side_effect = lambda path, target: shutil.copyfile(
+            os.path.join(self.source_dir, path), target)
+        cache = ArtifactCache(store, self.cache_dir)
+        self.assertTrue(cache.fetch(PACKAGE_TAG_MAP))
+        self.assertFalse(cache.fetch(PACKAGE_TAG_MAP))
+        store.list_bucket_objects.assert_called_with(prefix=PACKAGE_TAG_MAP)
+        self.assertEqual(store.download_file.call_count, 1)
+        store.list_bucket_objects.return_value = []
+        self.assertRaises(ValueError, cache.fetch, PACKAGE_TAG_MAP)
+
+    def test_prune(self):
+        """Test that superseded blobs go along with their derived files, newer ones stay."""
+        self.cache.fetch(PACKAGE_TAG_MAP)
+        old_blobs = self.cache.blob_paths([PACKAGE_TAG_MAP])
+        derived_path = self.cache.derived_path(PACKAGE_TAG_MAP, 'scoring-test.bin')
+        with open(derived_path, 'w') as derived:
+            derived.write('derived')
+        with open(os.path.join(self.source_dir, PACKAGE_TAG_MAP), 'w') as tag_map:
+            tag_map.write('{"express": ["web", "framework"]}')
+        self.cache.fetch(PACKAGE_TAG_MAP)
+        new_blobs = self.cache.blob_paths([PACKAGE_TAG_MAP])
+        self.assertEqual(self.cache.prune(old_blobs), 1)
+        self.assertEqual(self.cache.prune(old_blobs), 0)
+        self.assertEqual(sorted(os.listdir(self.cache.blob_dir)),
+                         sorted(os.path.basename(new_blobs[PACKAGE_TAG_MAP]) + suffix
+                                for suffix in ('', '.lock')))
+        self.assertDictEqual(self.cache.local_store.read_json_file(PACKAGE_TAG_MAP),
+                             {"express": ["web", "framework"]})
+        self.assertEqual(self.cache.prune(new_blobs), 1)
+        self.assertEqual(os.listdir(self.cache.blob_dir), [])
+        self.assertFalse(os.path.exists(os.path.join(self.cache.store_dir, PACKAGE_TAG_MAP)))
+        self.assertTrue(self.cache.fetch(PACKAGE_TAG_MAP))
+
+    def test_fetch_all(self):
+        """Test that a model loads from the cache the same as from its data store."""
+        store = self.cache.fetch_all([PACKAGE_TAG_MAP, ITEM_USER_FILEPATH])
+        self.assertTrue(os.path.exists(os.path.join(store.src_dir, ITEM_USER_FILEPATH)))
+        cached = pmf_recommendation(self.source_dir, artifact_cache=self.cache)
+        self.assertEqual(cached.s3_client.src_dir, self.cache.store_dir)
+        direct = pmf_recommendation(self.source_dir)
+        self.assertEqual([r["package_name"] for r in cached.predict(["nopt"])[1]],
+                         [r["package_name"] for r in direct.predict(["nopt"])[1]])
+        reloaded = pmf_recommendation(self.source_dir, artifact_cache=self.cache)
+        blobs = sorted(os.listdir(self.cache.blob_dir))
+        reloaded.prune_superseded(cached)
+        self.assertEqual(sorted(os.listdir(self.cache.blob_dir)), blobs)
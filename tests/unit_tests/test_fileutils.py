@@ -1,8 +1,13 @@
 """Tests for fileutils."""
+import io
 import os
-from unittest import TestCase
+import shutil
+import tempfile
+from unittest import TestCase, mock
 from rudra.data_store.local_data_store import LocalDataStore
-from recommendation_engine.utils.fileutils import save_temporary_local_file, load_rating
+from recommendation_engine.utils.fileutils import save_temporary_local_file, load_rating, \
+    load_rating_matrix, write_json
+from recommendation_engine.utils.s3_data_store import StreamingAmazonS3
 
 
 class TestFileUtils(TestCase):
@@ -21,3 +26,29 @@ class TestFileUtils(TestCase):
         test_datastore = LocalDataStore('tests/test_data')
         r = load_rating(path, test_datastore)
         self.assertListEqual(r, [[5409, 2309, 54909, 2054], list()])
+
+    def test_load_rating_matrix_from_s3(self):
+        """Test that a text rating file in S3 is parsed from the streamed body."""
+        with open('tests/test_data/test_load_rating.txt', 'rb') as rating_file:
+            body = io.BytesIO(rating_file.read())
+        data_store = StreamingAmazonS3.__new__(StreamingAmazonS3)
+        data_store.bucket_name = 'bucket'
+        data_store._s3 = mock.Mock()
+        data_store._s3.Object.return_value.get.return_value = {'Body': body}
+        rating_matrix = load_rating_matrix('test_load_rating.txt', data_store)
+        self.assertListEqual([sorted(row) for row in rating_matrix],
+                             [[2054, 2309, 5409, 54909], []])
+        data_store._s3.Object.assert_called_once_with('bucket', 'test_load_rating.txt')
+        self.assertTrue(body.closed)
+
+    def test_write_json(self):
+        """Test that a JSON object written to a local data store reads back."""
+        data_dir = tempfile.mkdtemp()
+        try:
+            data_store = LocalDataStore(data_dir)
+            write_json('marker.json', {"model_version": "v1"}, data_store)
+            write_json('marker.json', {"model_version": "v2"}, data_store)
+            self.assertEqual(data_store.read_json_file('marker.json'), {"model_version": "v2"})
+            self.assertEqual(os.listdir(data_dir), ['marker.json'])
+        finally:
+            shutil.rmtree(data_dir)
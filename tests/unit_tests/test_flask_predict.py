@@ -1,14 +1,28 @@
 """Test the rest API."""
 import unittest
 import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 import recommendation_engine.config.cloud_constants as cloud_constants
 cloud_constants.USE_CLOUD_SERVICES = False
 import recommendation_engine.flask_predict as rest_api
+from recommendation_engine.config.params_scoring import ScoringParams
+from recommendation_engine.predictor.model_manager import ModelManager
+from recommendation_engine.utils.admission import AdmissionControl
+from recommendation_engine.utils.lru_cache import LRUCache
+from recommendation_engine.utils.micro_batcher import MicroBatcher
 
 
 class FlaskPredictTestCase(unittest.TestCase):
     """Tests for the API endpoints of the recommender."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Wait for the model that is loaded in the background."""
+        assert rest_api.model_manager.wait_until_ready(120)
+
     def setUp(self):
         """Set up fixtures."""
         rest_api.app.testing = True
@@ -20,6 +34,21 @@ class FlaskPredictTestCase(unittest.TestCase):
         self.assertEqual(self.client.get('/api/v1/liveness').status, '200 OK')
         self.assertEqual(self.client.get('/api/v1/readiness').status, '200 OK')
 
+    def test_not_ready(self):
+        """Test that the probes and the API answer while the model is being loaded."""
+        with mock.patch.object(rest_api, 'model_manager', ModelManager(None)):
+            self.assertEqual(self.client.get('/api/v1/liveness').status_code, 200)
+            response = self.client.get('/api/v1/readiness')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json["status"], "loading")
+            response = self.client.post('/api/v1/companion_recommendation',
+                                        data=json.dumps([{"package_list": ["nopt"],
+                                                          "comp_package_count_threshold": 2}]),
+                                        headers={'content-type': 'application/json'})
+            self.assertEqual(response.status_code, 503)
+            self.assertFalse(self.client.get('/api/v1/model').json["ready"])
+            self.assertEqual(self.client.get('/api/v1/metrics').status_code, 200)
+
     def test_recommendation(self):
         """Test the recommendation endpoint."""
         data = [
@@ -33,6 +62,234 @@ class FlaskPredictTestCase(unittest.TestCase):
         self.recommendation = self.client.post('/api/v1/companion_recommendation',
                                                data=json.dumps(data),
                                                headers={'content-type': 'application/json'})
+        self.assertEqual(self.recommendation.status_code, 200)
+
+    def test_recommendation_multiple_stacks(self):
+        """Test that every stack of a request gets its own response entry."""
+        data = [
+            {"package_list": ["nopt"], "comp_package_count_threshold": 2},
+            {"package_list": ["missing"], "comp_package_count_threshold": 2},
+            {"package_list": ["statuses", "debuglog", "unpipe"], "comp_package_count_threshold": 1}
+        ]
+        response = self.client.post('/api/v1/companion_recommendation',
+                                    data=json.dumps(data),
+                                    headers={'content-type': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json), len(data))
+        self.assertEqual(response.json[1]["missing_packages"], ["missing"])
+        self.assertEqual(response.json[1]["companion_packages"], [])
+
+    def test_micro_batching(self):
+        """Test that a micro-batched request gets the response of an unbatched one."""
+        data = json.dumps([{"package_list": ["nopt"], "comp_package_count_threshold": 2},
+                           {"package_list": ["missing"], "comp_package_count_threshold": 2}])
+        headers = {'content-type': 'application/json'}
+        micro_batcher = MicroBatcher(rest_api._score_requests, 0.001, 8)
+        try:
+            # The result cache is opt-in, the second request is served out of it.
+            with mock.patch.object(rest_api.model_manager.recommender, 'result_cache',
+                                   LRUCache(100)):
+                expected = self.client.post('/api/v1/companion_recommendation', data=data,
+                                            headers=headers).json
+                with mock.patch.object(rest_api, 'micro_batcher', micro_batcher):
+                    response = self.client.post('/api/v1/companion_recommendation',
+                                                data=data, headers=headers)
+        finally:
+            micro_batcher.close()
+        self.assertEqual(response.status_code, 200)
+        batched = response.json
+        self.assertEqual(batched[0].pop("scoring_path"), "cache")
+        self.assertNotEqual(expected[0].pop("scoring_path"), "cache")
+        self.assertEqual(batched, expected)
+
+    def test_invalid_stacks(self):
+        """Test that stacks that cannot be scored are turned away before scoring."""
+        headers = {'content-type': 'application/json'}
+        for data in ({"package_list": ["nopt"]}, [{"package_list": "nopt"}],
+                     [{"package_list": ["nopt", 1]}], [{"package_list": ["nopt"],
+                                                        "comp_package_count_threshold": "2"}],
+                     [{"comp_package_count_threshold": 2}]):
+            response = self.client.post('/api/v1/companion_recommendation',
+                                        data=json.dumps(data), headers=headers)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/v1/companion_recommendation',
+                                    data=json.dumps([{"package_list": ["nopt"]}]),
+                                    headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_micro_batch_failure(self):
+        """Test that a request failing in a micro-batch does not fail the others."""
+        recommender = rest_api.model_manager.recommender
+        predict_requests_json = recommender.predict_requests_json
+
+        def failing_predict(requests, **kwargs):
+            if any(stacks == [["fail"]] for stacks, _, _ in requests):
+                raise ValueError("failed stack")
+            return predict_requests_json(requests, **kwargs)
+        batch = [(recommender, None, [["nopt"]], [2], None),
+                 (recommender, None, [["fail"]], [2], None)]
+        with mock.patch.object(recommender, 'predict_requests_json', failing_predict):
+            responses = rest_api._score_requests(batch)
+        self.assertEqual(json.loads(responses[0])[0]["ecosystem"], None)
+        self.assertIsInstance(responses[1], ValueError)
+
+    def test_time_budget(self):
+        """Test that the time budget of a request is taken from the header and the stacks."""
+        data = [{"package_list": ["once", "qs"], "comp_package_count_threshold": 9}]
+        headers = {'content-type': 'application/json'}
+        response = self.client.post('/api/v1/companion_recommendation', data=json.dumps(data),
+                                    headers=dict(headers, **{'X-Time-Budget-Ms': '0.000001'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json[0]["scoring_path"], "popular")
+        data[0]["time_budget_ms"] = 60000
+        response = self.client.post('/api/v1/companion_recommendation', data=json.dumps(data),
+                                    headers=headers)
+        self.assertEqual(response.json[0]["scoring_path"], "fold_in")
+        for budget in ("0", "soon"):
+            response = self.client.post('/api/v1/companion_recommendation',
+                                        data=json.dumps(data),
+                                        headers=dict(headers, **{'X-Time-Budget-Ms': budget}))
+            self.assertEqual(response.status_code, 400)
+        self.assertIn('recommendation_scoring_path_total{path="popular"}',
+                      self.client.get('/api/v1/metrics').get_data(as_text=True))
+
+    def test_admission_control(self):
+        """Test that requests over capacity are turned away right away."""
+        data = json.dumps([{"package_list": ["nopt"], "comp_package_count_threshold": 2}] * 2)
+        headers = {'content-type': 'application/json'}
+        admission_control = AdmissionControl(1)
+        with mock.patch.object(rest_api, 'admission_control', admission_control):
+            self.assertTrue(admission_control.try_enter())
+            response = self.client.post('/api/v1/companion_recommendation', data=data,
+                                        headers=headers)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'],
+                             str(ScoringParams.retry_after_seconds))
+            metrics = self.client.get('/api/v1/metrics').get_data(as_text=True)
+            self.assertIn('recommendation_requests_in_flight 1', metrics)
+            admission_control.exit()
+            with mock.patch.object(ScoringParams, 'max_stacks_per_request', 1):
+                response = self.client.post('/api/v1/companion_recommendation', data=data,
+                                            headers=headers)
+                self.assertEqual(response.status_code, 413)
+            response = self.client.post('/api/v1/companion_recommendation', data=data,
+                                        headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(admission_control.in_flight, 0)
+        metrics = self.client.get('/api/v1/metrics').get_data(as_text=True)
+        for reason in ('overloaded', 'too_many_stacks'):
+            self.assertIn('recommendation_rejected_requests_total{{reason="{}"}} 1'.format(reason),
+                          metrics)
+
+    def test_metrics(self):
+        """Test that the stage timings are published."""
+        self.client.post('/api/v1/companion_recommendation',
+                         data=json.dumps([{"package_list": ["nopt"],
+                                           "comp_package_count_threshold": 2}]),
+                         headers={'content-type': 'application/json'})
+        response = self.client.get('/api/v1/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        metrics = response.get_data(as_text=True)
+        for stage in ('resolve', 'top_k', 'format', 'json'):
+            self.assertIn('recommendation_stage_seconds_count{{stage="{}"}}'.format(stage),
+                          metrics)
+        self.assertIn('recommendation_batch_size_bucket{le="1.0"}', metrics)
+        self.assertIn('recommendation_model_load_seconds{model_version="2019-01-03"}', metrics)
+
+    def test_model_reload(self):
+        """Test the model status and reload endpoints."""
+        status = self.client.get('/api/v1/model').json
+        self.assertEqual(status["model_version"], '2019-01-03')
+        self.assertIn("hits", status["result_cache"])
+        marker_dir = tempfile.mkdtemp()
+        marker_path = os.path.join(marker_dir, 'serving-model-version.json')
+        headers = {'content-type': 'application/json', 'Authorization': 'Bearer secret'}
+        try:
+            with mock.patch.object(rest_api, 'MODEL_RELOAD_TOKEN', 'secret'), \
+                    mock.patch.object(rest_api, 'MODEL_VERSION_MARKER_PATH', marker_path):
+                self.assertIsNone(rest_api._marked_model_version())
+                for wrong_headers in ({'content-type': 'application/json'},
+                                      dict(headers, Authorization='Bearer guess')):
+                    response = self.client.post(
+                        '/api/v1/model/reload', data=json.dumps({"model_version": "2019-01-03"}),
+                        headers=wrong_headers)
+                    self.assertEqual(response.status_code, 403)
+                response = self.client.post('/api/v1/model/reload', data=json.dumps({}),
+                                            headers=headers)
+                self.assertEqual(response.status_code, 400)
+                response = self.client.post('/api/v1/model/reload',
+                                            data=json.dumps({"model_version": "2000-01-01"}),
+                                            headers=headers)
+                self.assertEqual(response.status_code, 404)
+                self.assertFalse(os.path.exists(marker_path))
+                response = self.client.post('/api/v1/model/reload',
+                                            data=json.dumps({"model_version": "2019-01-03"}),
+                                            headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json["reload"], "already_served")
+                # The other workers read the model version to serve from the marker.
+                self.assertEqual(rest_api._marked_model_version(), '2019-01-03')
+                # A model version that failed to load is loaded again when asked for.
+                loads = []
+                recommender = rest_api.model_manager.recommender
+
+                def flaky_loader(model_version):
+                    loads.append(model_version)
+                    if len(loads) == 1:
+                        raise IOError("connection reset")
+                    return recommender
+                manager = ModelManager(flaky_loader, retry_seconds=3600)
+                manager.reload_async('2019-01-03')
+                with mock.patch.object(rest_api, 'model_manager', manager):
+                    with manager._reload_lock:
+                        response = self.client.post(
+                            '/api/v1/model/reload',
+                            data=json.dumps({"model_version": "2019-01-03"}), headers=headers)
+                        self.assertEqual(response.status_code, 409)
+                    self.assertFalse(manager.check_version(lambda: '2019-01-03'))
+                    response = self.client.post('/api/v1/model/reload',
+                                                data=json.dumps({"model_version": "2019-01-03"}),
+                                                headers=headers)
+                    self.assertEqual(response.status_code, 202)
+                    self.assertEqual(response.json["reload"], "started")
+                    with manager._reload_lock:
+                        pass
+                self.assertEqual(loads, ['2019-01-03', '2019-01-03'])
+                self.assertEqual(manager.model_version, '2019-01-03')
+                self.assertIsNone(manager.last_reload_error)
+        finally:
+            shutil.rmtree(marker_dir)
+
+    def test_ecosystem_selection(self):
+        """Test that a request selects the model of an ecosystem, loaded when first asked for."""
+        data = json.dumps([{"package_list": ["nopt"], "comp_package_count_threshold": 2}])
+        headers = {'content-type': 'application/json'}
+        url = '/api/v1/companion_recommendation?ecosystem={}'
+        self.assertEqual(self.client.post(url.format('maven'), data=data,
+                                          headers=headers).status_code, 404)
+        self.assertEqual(self.client.post('/api/v1/companion_recommendation?model_version=../x',
+                                          data=data, headers=headers).status_code, 400)
+        data_stores = dict(rest_api.data_stores, pypi=rest_api.data_stores[None])
+        with mock.patch.object(rest_api, 'data_stores', data_stores):
+            response = self.client.post(url.format('pypi') + '&model_version=2000-01-01',
+                                        data=data, headers=headers)
+            self.assertEqual(response.status_code, 404)
+            response = self.client.post(url.format('pypi'), data=data, headers=headers)
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+            manager = rest_api.model_registry.get('pypi', '2019-01-03')
+            self.assertTrue(manager.wait_until_ready(120))
+            response = self.client.post(url.format('pypi'), data=data, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json[0]["ecosystem"], "pypi")
+        models = self.client.get('/api/v1/model').json["models"]
+        self.assertIn(('pypi', '2019-01-03', False),
+                      [(model["ecosystem"], model["model_version"], model["pinned"])
+                       for model in models])
+        metrics = self.client.get('/api/v1/metrics').get_data(as_text=True)
+        self.assertIn('recommendation_model_bytes{ecosystem="pypi",model_version="2019-01-03"}',
+                      metrics)
 
 
 if __name__ == '__main__':
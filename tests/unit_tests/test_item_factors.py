@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the scoring precision of the latent item matrix.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from unittest import TestCase
+import numpy as np
+from recommendation_engine.model.item_factors import ItemFactorMatrix, top_k_overlap
+
+
+class TestItemFactorMatrix(TestCase):
+    """Test scoring with reduced precision item vectors."""
+
+    def setUp(self):
+        """Create random item and user vectors."""
+        rng = np.random.RandomState(0)
+        self.m_V = rng.normal(size=(500, 16))
+        self.users = rng.normal(size=(20, 16))
+
+    def test_score(self):
+        """Test that every precision approximates the exact scores."""
+        exact = self.users.dot(self.m_V.T)
+        for precision, rtol in (('float64', 1e-12), ('float32', 1e-5), ('int8', 5e-2)):
+            item_factors = ItemFactorMatrix(self.m_V, precision, block_size=64)
+            scores = item_factors.score(self.users)
+            self.assertEqual(scores.shape, exact.shape)
+            self.assertLess(np.abs(scores - exact).max(), rtol * np.abs(exact).max())
+        int8_factors = ItemFactorMatrix(self.m_V, 'int8')
+        self.assertEqual(int8_factors.matrix.dtype, np.int8)
+        self.assertLess(int8_factors.nbytes, self.m_V.nbytes / 4)
+        np.testing.assert_allclose(int8_factors[[3, 7], :], self.m_V[[3, 7], :], atol=0.05)
+
+    def test_arrays(self):
+        """Test that a matrix stored as arrays scores like the original one."""
+        for precision in ('float32', 'int8'):
+            item_factors = ItemFactorMatrix(self.m_V, precision)
+            arrays = item_factors.to_arrays("m_V")
+            stored = ItemFactorMatrix.from_arrays(arrays, "m_V")
+            self.assertEqual(stored.precision, precision)
+            self.assertIs(stored.matrix, arrays["m_V"])
+            np.testing.assert_array_equal(stored.score(self.users), item_factors.score(self.users))
+
+    def test_unknown_precision(self):
+        """Test that unsupported precisions are rejected."""
+        self.assertRaises(ValueError, ItemFactorMatrix, self.m_V, 'float16')
+
+    def test_top_k_overlap(self):
+        """Test the overlap of the reduced precision top-k with the exact one."""
+        self.assertTrue(np.all(top_k_overlap(self.m_V, self.users, 'float64', 10) == 1))
+        self.assertGreater(top_k_overlap(self.m_V, self.users, 'int8', 10).mean(), 0.8)
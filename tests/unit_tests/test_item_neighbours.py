@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the item neighbours scoring mode.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import os
+from unittest import TestCase, mock
+import numpy as np
+from rudra.data_store.local_data_store import LocalDataStore
+from recommendation_engine.config.params_scoring import ScoringParams
+from recommendation_engine.config.path_constants import PMF_MODEL_PATH, ITEM_NEIGHBOURS_PATH
+from recommendation_engine.model.item_neighbours import ItemNeighbours, export_item_neighbours
+from recommendation_engine.predictor.online_recommendation import PMFRecommendation
+from data_fixtures import TEST_DATA_DIR, copy_test_data, pmf_recommendation, \
+    temporary_directory
+
+
+class TestItemNeighbours(TestCase):
+    """Test computing the neighbour lists and scoring stacks with them."""
+
+    def setUp(self):
+        """Create random item vectors."""
+        self.m_V = np.random.RandomState(0).normal(size=(40, 6))
+        self.tmp_dir = temporary_directory(self)
+
+    def test_compute(self):
+        """Test that every list holds the most similar other items with a positive similarity."""
+        neighbours = ItemNeighbours.compute(self.m_V, 5, block_size=7)
+        unit = self.m_V / np.linalg.norm(self.m_V, axis=1)[:, None]
+        similarities = unit.dot(unit.T)
+        np.fill_diagonal(similarities, -np.inf)
+        for item in range(len(self.m_V)):
+            row = slice(neighbours.indptr[item], neighbours.indptr[item + 1])
+            expected = np.argsort(-similarities[item])[:5]
+            expected = expected[similarities[item, expected] > 0]
+            np.testing.assert_array_equal(neighbours.indices[row], expected)
+            np.testing.assert_allclose(neighbours.similarities[row],
+                                       similarities[item, expected], rtol=1e-5)
+        self.assertEqual(len(ItemNeighbours.compute(self.m_V, 100, 'inner_product')), 40)
+        self.assertRaises(ValueError, ItemNeighbours.compute, self.m_V, 5, 'euclidean')
+
+    def test_score(self):
+        """Test that a stack is scored with the sums of the lists of its items."""
+        neighbours = ItemNeighbours.compute(self.m_V, 5)
+        path = os.path.join(self.tmp_dir, 'neighbours.bin')
+        neighbours.save(path)
+        neighbours = ItemNeighbours.load(path)
+        stack = [3, 8, 8]
+        sums = {}
+        for item in (3, 8):
+            for position in range(neighbours.indptr[item], neighbours.indptr[item + 1]):
+                neighbour = int(neighbours.indices[position])
+                sums[neighbour] = sums.get(neighbour, 0) + neighbours.similarities[position]
+        expected = sorted((package for package in sums if package not in stack),
+                          key=lambda package: (-sums[package], package))
+        packages, scores = neighbours.score(stack, 4)
+        self.assertEqual(packages.tolist(), expected[:4])
+        np.testing.assert_allclose(scores, [sums[package] for package in expected[:4]],
+                                   rtol=1e-6)
+
+    def test_scoring_mode(self):
+        """Test that unseen stacks are scored with the neighbour lists of the model."""
+        _, data_dir = copy_test_data(self)
+        stack = ["send", "nopt"]
+        with mock.patch.object(ScoringParams, 'scoring_mode', 'item_neighbours'):
+            computed = pmf_recommendation()
+            export_item_neighbours(os.path.join(data_dir, PMF_MODEL_PATH),
+                                   os.path.join(data_dir, ITEM_NEIGHBOURS_PATH), 50)
+            loaded = pmf_recommendation(data_dir)
+        loaded.validate()
+        self.assertFalse(loaded.item_neighbours.indices.flags.writeable)
+        response = json.loads(loaded.predict_batch_json([stack, ["nopt"]], [3, 3]))
+        self.assertEqual([r["scoring_path"] for r in response], ["item_neighbours", "precomputed"])
+        # The test items share a few distinct vectors, so compare scores rather than names.
+        np.testing.assert_allclose(
+            [r["cooccurrence_probability"] for r in response[0]["companion_packages"]],
+            [r["cooccurrence_probability"] for r in computed.predict(stack, 3)[1]], rtol=1e-4)
+        with mock.patch.object(ScoringParams, 'scoring_mode', 'nearest'):
+            self.assertRaises(ValueError, PMFRecommendation, 2,
+                              data_store=LocalDataStore(TEST_DATA_DIR), num_latent=50)
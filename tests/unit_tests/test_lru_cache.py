@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the LRU cache.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+from unittest import TestCase
+from recommendation_engine.utils.lru_cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+    """Test eviction and expiry of cached entries."""
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first."""
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertDictEqual(cache.stats(), {"hits": 2, "misses": 1, "evictions": 1, "size": 2})
+
+    def test_expiry(self):
+        """Test that expired entries are not returned."""
+        cache = LRUCache(2, ttl=0.01)
+        cache.put('a', 1)
+        time.sleep(0.02)
+        self.assertEqual(cache.get('a', 'expired'), 'expired')
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        """Test that a cache of size 0 holds nothing."""
+        cache = LRUCache(0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the Prometheus metrics.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+from recommendation_engine.utils.metrics import MetricsRegistry
+
+
+class TestMetrics(TestCase):
+    """Test recording and rendering metrics."""
+
+    def setUp(self):
+        """Create an empty registry."""
+        self.registry = MetricsRegistry()
+
+    def test_histogram(self):
+        """Test that histogram buckets are cumulative and labelled."""
+        histogram = self.registry.histogram('latency_seconds', 'Latency.', ('stage',),
+                                            buckets=(0.1, 1))
+        histogram.observe(0.05, stage='a')
+        histogram.observe(0.5, stage='a')
+        histogram.observe(5, stage='a')
+        with histogram.time(stage='b'):
+            pass
+        rendered = self.registry.render()
+        self.assertIn('# TYPE latency_seconds histogram', rendered)
+        self.assertIn('latency_seconds_bucket{stage="a",le="0.1"} 1', rendered)
+        self.assertIn('latency_seconds_bucket{stage="a",le="1.0"} 2', rendered)
+        self.assertIn('latency_seconds_bucket{stage="a",le="+Inf"} 3', rendered)
+        self.assertIn('latency_seconds_sum{stage="a"} 5.55', rendered)
+        self.assertIn('latency_seconds_count{stage="b"} 1', rendered)
+
+    def test_counter_and_gauge(self):
+        """Test counters, set gauges and callback gauges."""
+        counter = self.registry.counter('requests_total', 'Requests.', ('code',))
+        counter.inc(code=200)
+        counter.inc(2, code=200)
+        gauge = self.registry.gauge('in_flight', 'In flight.')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.registry.gauge('cache', 'Cache.', ('event',), callback=lambda: {('hits',): 4})
+        rendered = self.registry.render()
+        self.assertIn('requests_total{code="200"} 3.0', rendered)
+        self.assertIn('in_flight 1.0', rendered)
+        self.assertIn('cache{event="hits"} 4.0', rendered)
+        self.assertIs(self.registry.counter('requests_total', 'Requests.', ('code',)), counter)
+
+    def test_shared(self):
+        """Test that the workers sharing a directory publish their metrics together."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        workers = [MetricsRegistry() for _ in range(2)]
+        pid = os.getpid()
+        for amount, registry in enumerate(workers, 1):
+            registry.counter('requests_total', 'Requests.', ('code',)).inc(amount, code=200)
+            registry.histogram('latency_seconds', 'Latency.', buckets=(1,)).observe(amount)
+            registry.gauge('in_flight', 'In flight.').set(amount)
+            # The second worker is told apart by the parent pid, a process that is alive.
+            with mock.patch('os.getpid', return_value=pid if amount == 1 else os.getppid()):
+                registry.share(directory, flush_seconds=3600)
+        self.assertEqual(len(os.listdir(directory)), 2)
+        rendered = workers[0].render()
+        self.assertIn('requests_total{code="200"} 3.0', rendered)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 1', rendered)
+        self.assertIn('latency_seconds_count 2', rendered)
+        self.assertIn('in_flight{{worker="{}"}} 1.0'.format(pid), rendered)
+        self.assertIn('in_flight{{worker="{}"}} 2.0'.format(os.getppid()), rendered)
+        # Counters of the workers gone are kept, their gauges are dropped.
+        with open(os.path.join(directory, 'gone.json'), 'w') as gone_file:
+            gone_file.write('{"pid": 999999999, "metrics": {"requests_total": [[[200], 4]], '
+                            '"in_flight": [[[], 7]]}}')
+        rendered = workers[1].render()
+        self.assertIn('requests_total{code="200"} 7.0', rendered)
+        self.assertNotIn('in_flight{worker="999999999"}', rendered)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the micro-batching scheduler.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+from unittest import TestCase
+from recommendation_engine.utils.micro_batcher import MicroBatcher
+
+
+class TestMicroBatcher(TestCase):
+    """Test collecting the items of concurrent callers into batches."""
+
+    def setUp(self):
+        """Create a batcher whose first batch blocks until released."""
+        self.batches = []
+        self.started, self.release = threading.Event(), threading.Event()
+
+        def handler(items):
+            self.batches.append(items)
+            if len(self.batches) == 1:
+                self.started.set()
+                self.release.wait()
+            if "fail" in items:
+                raise ValueError("failed batch")
+            return [KeyError(item) if item == "missing" else item * 2 for item in items]
+        self.batcher = MicroBatcher(handler, window_seconds=0.05, max_batch_size=3)
+
+    def tearDown(self):
+        """Stop the batching thread."""
+        self.release.set()
+        self.batcher.close()
+
+    def _submit_all(self, items):
+        results = {}
+
+        def submit(item):
+            try:
+                results[item] = self.batcher.submit(item)
+            except (KeyError, ValueError) as e:
+                results[item] = e
+        threads = [threading.Thread(target=submit, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_batches(self):
+        """Test that items waiting together are handled together, up to the maximum size."""
+        first_threads, results = self._submit_all(["a"])
+        self.started.wait()
+        threads, more_results = self._submit_all(["b", "c", "d", "e"])
+        while self.batcher._queue.qsize() < 4:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in first_threads + threads:
+            thread.join()
+        results.update(more_results)
+        self.assertEqual(results, {item: item * 2 for item in "abcde"})
+        self.assertEqual(self.batches[0], ["a"])
+        self.assertEqual([len(batch) for batch in self.batches[1:]], [3, 1])
+
+    def test_failed_batch(self):
+        """Test that every caller of a failed batch gets the exception."""
+        self.release.set()
+        self.assertEqual(self.batcher.submit("x"), "xx")
+        self.started.clear()
+        self.release.clear()
+        self.batches.clear()
+        first_threads, _ = self._submit_all(["a"])
+        self.started.wait()
+        threads, results = self._submit_all(["fail", "b"])
+        while self.batcher._queue.qsize() < 2:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in first_threads + threads:
+            thread.join()
+        self.assertIsInstance(results["fail"], ValueError)
+        self.assertIsInstance(results["b"], ValueError)
+
+    def test_failed_item(self):
+        """Test that an exception returned for an item only goes to its caller."""
+        self.release.set()
+        threads, results = self._submit_all(["missing", "y"])
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results["y"], "yy")
+        self.assertIsInstance(results["missing"], KeyError)
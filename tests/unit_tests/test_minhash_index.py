@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the MinHash index of the training stacks.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from unittest import TestCase
+import numpy as np
+from recommendation_engine.model.minhash_index import MinHashStackIndex
+from recommendation_engine.utils.rating_matrix import RatingMatrix
+
+
+class TestMinHashStackIndex(TestCase):
+    """Test finding the training stacks most similar to a stack."""
+
+    def setUp(self):
+        """Index random stacks, some of them empty."""
+        rng = np.random.RandomState(0)
+        self.stacks = [sorted(rng.choice(500, size=rng.randint(5, 30), replace=False).tolist())
+                       for _ in range(300)] + [[]]
+        self.index = MinHashStackIndex(RatingMatrix.from_rows(self.stacks), num_perm=64,
+                                       num_bands=16)
+        self.rng = rng
+
+    def _jaccard(self, stack, other):
+        return len(set(stack) & set(other)) / len(set(stack) | set(other))
+
+    def test_query(self):
+        """Test that near duplicates are found and unrelated stacks are not."""
+        found = 0
+        for idx in self.rng.choice(300, size=50, replace=False):
+            stack = self.stacks[idx] + [500 + int(idx)]
+            match = self.index.query(stack, 0.6)
+            if match is not None:
+                found += 1
+                self.assertGreaterEqual(self._jaccard(stack, self.stacks[match]), 0.6)
+                self.assertEqual(match, max(range(300), key=lambda other: (
+                    self._jaccard(stack, self.stacks[other]), -other)))
+        self.assertGreater(found, 45)
+        self.assertEqual(self.index.query(self.stacks[7], 1), 7)
+        self.assertIsNone(self.index.query([1000, 1001, 1002], 0.1))
+        self.assertIsNone(self.index.query([], 0))
+
+    def test_bands(self):
+        """Test that the permutations have to split into whole bands."""
+        self.assertRaises(ValueError, MinHashStackIndex, RatingMatrix.from_rows(self.stacks),
+                          num_perm=10, num_bands=4)
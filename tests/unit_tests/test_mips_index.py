@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the approximate maximum inner product index.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from unittest import TestCase
+import numpy as np
+from recommendation_engine.model.mips_index import IVFInnerProductIndex
+
+
+class TestIVFInnerProductIndex(TestCase):
+    """Test searching the inverted lists."""
+
+    def setUp(self):
+        """Index random item vectors of varying norms."""
+        rng = np.random.RandomState(0)
+        self.m_V = rng.normal(size=(2000, 8)) * rng.uniform(0.1, 2, size=(2000, 1))
+        self.users = rng.normal(size=(30, 8))
+        self.index = IVFInnerProductIndex(self.m_V, nlist=16)
+
+    def test_lists(self):
+        """Test that every item is in exactly one inverted list."""
+        self.assertEqual(self.index.list_offsets[-1], len(self.m_V))
+        self.assertListEqual(sorted(self.index.list_items.tolist()), list(range(len(self.m_V))))
+
+    def _recall(self, nprobe, k=10):
+        recalls = []
+        for user in self.users:
+            exact = np.argsort(-self.m_V.dot(user))[:k]
+            candidates, scores = self.index.search(user, nprobe)
+            approximate = candidates[np.argsort(-scores)[:k]]
+            recalls.append(len(np.intersect1d(exact, approximate)) / k)
+        return np.mean(recalls)
+
+    def test_search(self):
+        """Test that probing all lists is exact and a few lists keep most of the recall."""
+        candidates, scores = self.index.search(self.users[0], 2)
+        np.testing.assert_allclose(scores, self.m_V[candidates].dot(self.users[0]), rtol=1e-4)
+        self.assertEqual(self._recall(16), 1)
+        self.assertGreater(self._recall(4), 0.5)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the model manager.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+from unittest import TestCase, mock
+from gevent.threadpool import ThreadPool
+from recommendation_engine.predictor.model_manager import ModelManager
+from recommendation_engine.utils.scoring_pool import ScoringPool
+
+
+class FakeRecommender:
+    """A recommender that only records its model version."""
+
+    def __init__(self, model_version, started=None, release=None):
+        """Create a fake recommender, optionally blocking until released."""
+        if started is not None:
+            started.set()
+            release.wait()
+        self.model_version = model_version
+        self.warmed_up = False
+
+    def warm_up(self):
+        """Record the warm-up."""
+        self.warmed_up = True
+
+    def validate(self):
+        """Fail validation for broken model versions."""
+        if self.model_version == 'broken':
+            raise ValueError("broken model")
+
+
+class TestModelManager(TestCase):
+    """Test loading and swapping model versions."""
+
+    def test_load(self):
+        """Test that a loaded model is served."""
+        manager = ModelManager(FakeRecommender)
+        manager.load('v1')
+        self.assertEqual(manager.model_version, 'v1')
+        self.assertEqual(manager.recommender.model_version, 'v1')
+        self.assertTrue(manager.recommender.warmed_up)
+        self.assertTrue(manager.ready)
+
+    def test_on_swap(self):
+        """Test that the swap callback gets the superseded and the new model, errors aside."""
+        swaps = []
+
+        def on_swap(previous, recommender):
+            swaps.append((previous.model_version, recommender.model_version))
+            raise OSError("cannot clean up")
+        manager = ModelManager(FakeRecommender, on_swap=on_swap)
+        manager.load('v1')
+        manager.load('v2')
+        self.assertEqual(swaps, [('v1', 'v2')])
+        self.assertEqual(manager.model_version, 'v2')
+
+    def test_initial_load_async(self):
+        """Test that the manager is only ready once the first model is loaded."""
+        started, release = threading.Event(), threading.Event()
+        manager = ModelManager(lambda version: FakeRecommender(version, started, release))
+        self.assertTrue(manager.reload_async('v1'))
+        started.wait()
+        self.assertFalse(manager.ready)
+        self.assertIsNone(manager.recommender)
+        self.assertFalse(manager.wait_until_ready(0.01))
+        release.set()
+        self.assertTrue(manager.wait_until_ready(10))
+        self.assertEqual(manager.recommender.model_version, 'v1')
+        self.assertTrue(manager.status()["ready"])
+
+    def test_reload_async(self):
+        """Test that the old model serves until the new one is ready."""
+        started, release = threading.Event(), threading.Event()
+        manager = ModelManager(lambda version: FakeRecommender(version, started, release))
+        manager._served = ('v1', FakeRecommender('v1'))
+        self.assertTrue(manager.reload_async('v2'))
+        started.wait()
+        self.assertTrue(manager.reloading)
+        self.assertFalse(manager.reload_async('v3'))
+        self.assertEqual(manager.recommender.model_version, 'v1')
+        release.set()
+        with manager._reload_lock:
+            self.assertEqual(manager.recommender.model_version, 'v2')
+        self.assertIsNone(manager.status()["last_reload_error"])
+
+    def test_reload_invalid_model(self):
+        """Test that a model failing validation is not swapped in."""
+        manager = ModelManager(FakeRecommender)
+        manager.load('v1')
+        self.assertTrue(manager.reload_async('broken'))
+        with manager._reload_lock:
+            self.assertEqual(manager.model_version, 'v1')
+        self.assertIn('broken model', manager.status()["last_reload_error"])
+
+    def test_load_on_pool(self):
+        """Test that models are built, validated and warmed up by the run callable."""
+        pool = ScoringPool(1)
+        pool._pool = ThreadPool(1)
+        manager = ModelManager(FakeRecommender, run=pool.run)
+        try:
+            with mock.patch.object(FakeRecommender, 'warm_up',
+                                   lambda recommender: setattr(recommender, 'warmed_up',
+                                                               threading.get_ident())):
+                manager.load('v1')
+        finally:
+            pool._pool.kill()
+        self.assertNotEqual(manager.recommender.warmed_up, threading.get_ident())
+
+    def test_check_version(self):
+        """Test that the model version read is loaded unless served or backing off."""
+        manager = ModelManager(FakeRecommender)
+        manager.load('v1')
+        self.assertFalse(manager.check_version(lambda: 'v1'))
+        self.assertFalse(manager.check_version(lambda: None))
+        self.assertFalse(manager.check_version(lambda: 1 / 0))
+        self.assertTrue(manager.check_version(lambda: 'broken'))
+        with manager._reload_lock:
+            self.assertEqual(manager.model_version, 'v1')
+        self.assertFalse(manager.check_version(lambda: 'broken'))
+        self.assertTrue(manager.check_version(lambda: 'broken', force=True))
+        with manager._reload_lock:
+            self.assertEqual(manager.model_version, 'v1')
+        self.assertTrue(manager.check_version(lambda: 'v2'))
+        with manager._reload_lock:
+            self.assertEqual(manager.model_version, 'v2')
+
+    def test_retry_failed_version(self):
+        """Test that a model version failing to load is retried until failing too often."""
+        calls = []
+
+        def flaky_loader(model_version):
+            calls.append(model_version)
+            if len(calls) == 1 or model_version == 'broken':
+                raise IOError("connection reset")
+            return FakeRecommender(model_version)
+        manager = ModelManager(flaky_loader, retry_seconds=0, max_failures=2)
+        for model_version in ('v1', 'v1', 'v1', 'broken', 'broken', 'broken'):
+            manager.check_version(lambda: model_version)
+            with manager._reload_lock:
+                pass
+        self.assertEqual(calls, ['v1', 'v1', 'broken', 'broken'])
+        self.assertEqual(manager.model_version, 'v1')
+        self.assertTrue(manager.ready)
+
+    def test_watch(self):
+        """Test that a watched model version is loaded once it changes."""
+        manager = ModelManager(FakeRecommender)
+        manager.load('v1')
+        marker = ['v1']
+        manager.watch(lambda: marker[0], 0.001)
+        marker[0] = 'v2'
+        for _ in range(1000):
+            if manager.model_version == 'v2':
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(manager.model_version, 'v2')
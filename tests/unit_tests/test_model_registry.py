@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the registry of the models of several ecosystems and model versions.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+import time
+from unittest import TestCase
+from recommendation_engine.predictor.model_manager import ModelManager
+from recommendation_engine.predictor.model_registry import ModelRegistry, ModelLoadBackoff
+
+
+class FakeRecommender:
+    """A recommender holding a given amount of memory."""
+
+    def __init__(self, ecosystem, model_version):
+        """Create a fake recommender, failing for broken model versions."""
+        if model_version == 'broken':
+            raise ValueError("broken model")
+        self.ecosystem = ecosystem
+        self.model_version = model_version
+        self.nbytes = 100
+
+    def warm_up(self):
+        """Do nothing."""
+
+    def validate(self):
+        """Do nothing."""
+
+
+class TestModelRegistry(TestCase):
+    """Test loading models lazily and unloading the least recently used ones."""
+
+    def setUp(self):
+        """Create a registry with room for two models besides the pinned one."""
+        self.registry = ModelRegistry(FakeRecommender, total_budget_bytes=300)
+        self.default = ModelManager(lambda version: FakeRecommender('npm', version))
+        self.default.load('v1')
+        self.registry.pin('npm', None, self.default)
+
+    def _load(self, ecosystem, model_version):
+        manager = self.registry.get(ecosystem, model_version)
+        self.assertTrue(manager.wait_until_ready(10))
+        return manager
+
+    def test_lazy_loading(self):
+        """Test that a model is loaded the first time it is asked for and then reused."""
+        self.assertIs(self.registry.get('npm', None), self.default)
+        manager = self._load('pypi', 'v2')
+        self.assertEqual((manager.recommender.ecosystem, manager.recommender.model_version),
+                         ('pypi', 'v2'))
+        self.assertIs(self.registry.get('pypi', 'v2'), manager)
+        self.assertEqual(self.registry.nbytes, 200)
+        self.assertEqual([(model["ecosystem"], model["model_version"], model["pinned"])
+                          for model in self.registry.status()],
+                         [('npm', 'v1', True), ('pypi', 'v2', False)])
+
+    def test_unload_least_recently_used(self):
+        """Test that the least recently used models are unloaded past the budget."""
+        first = self._load('pypi', 'v1')
+        self._load('pypi', 'v2')
+        self.registry.get('pypi', 'v1')
+        self._load('maven', 'v1')
+        self.registry.get('npm', None)
+        self.assertEqual(self.registry.nbytes, 300)
+        self.assertEqual([(model["ecosystem"], model["model_version"])
+                          for model in self.registry.status()],
+                         [('pypi', 'v1'), ('maven', 'v1'), ('npm', 'v1')])
+        self.assertIs(self.registry.get('pypi', 'v1'), first)
+        self.registry.total_budget_bytes = 50
+        self.registry.get('pypi', 'v1')
+        self.assertEqual([model["ecosystem"] for model in self.registry.status()],
+                         ['npm', 'pypi'])
+
+    def test_reserve_estimate(self):
+        """Test that the estimated memory is reserved before concurrent loads finish."""
+        loading = threading.Event()
+
+        def loader(ecosystem, version):
+            loading.wait(10)
+            return FakeRecommender(ecosystem, version)
+        registry = ModelRegistry(loader, total_budget_bytes=300, retry_seconds=0.5,
+                                 estimate=lambda ecosystem, version: 100)
+        registry.pin('npm', None, self.default)
+        first = registry.get('pypi', 'v1')
+        second = registry.get('pypi', 'v2')
+        self.assertEqual(registry.nbytes, 300)
+        # The models being loaded are not unloaded, so there is no room left for a third one.
+        with self.assertRaises(ModelLoadBackoff) as context:
+            registry.get('maven', 'v1')
+        self.assertEqual(context.exception.retry_after, 0.5)
+        self.assertEqual(len(registry.status()), 3)
+        loading.set()
+        self.assertTrue(first.wait_until_ready(10))
+        self.assertTrue(second.wait_until_ready(10))
+        self.assertTrue(registry.get('maven', 'v1').wait_until_ready(10))
+        self.assertEqual([(model["ecosystem"], model["model_version"])
+                          for model in registry.status()],
+                         [('npm', 'v1'), ('pypi', 'v2'), ('maven', 'v1')])
+        self.assertEqual(registry.nbytes, 300)
+
+    def _wait_until_loaded(self, manager):
+        while manager.reloading:
+            manager.wait_until_ready(0.01)
+
+    def test_failed_load(self):
+        """Test that a failed model is dropped and only loaded again after a backoff."""
+        loads = []
+
+        def loader(ecosystem, version):
+            loads.append(version)
+            return FakeRecommender(ecosystem, version)
+        registry = ModelRegistry(loader, retry_seconds=0.05)
+        manager = registry.get('pypi', 'broken')
+        self._wait_until_loaded(manager)
+        self.assertIn("broken model", manager.last_reload_error)
+        for _ in range(10):
+            with self.assertRaises(ModelLoadBackoff) as context:
+                registry.get('pypi', 'broken')
+            self.assertGreater(context.exception.retry_after, 0)
+        self.assertEqual(loads, ['broken'])
+        self.assertEqual(registry.status(), [])
+        time.sleep(0.05)
+        manager = registry.get('pypi', 'broken')
+        self._wait_until_loaded(manager)
+        self.assertEqual(loads, ['broken'] * 2)
+        self.assertRaises(ModelLoadBackoff, registry.get, 'pypi', 'broken')
+        # The backoff doubles with every failure in a row.
+        time.sleep(0.05)
+        self.assertRaises(ModelLoadBackoff, registry.get, 'pypi', 'broken')
+
+    def test_missing_version(self):
+        """Test that only the model versions held by the data store are loaded."""
+        lookups = []
+
+        def exists(ecosystem, version):
+            lookups.append(version)
+            return not version.startswith('missing')
+        registry = ModelRegistry(FakeRecommender, exists=exists, max_failures=2)
+        for _ in range(10):
+            self.assertRaises(LookupError, registry.get, 'pypi', 'missing')
+        self.assertEqual(lookups, ['missing'])
+        self.assertEqual(registry.status(), [])
+        self.assertTrue(registry.get('pypi', 'v1').wait_until_ready(10))
+        self.assertEqual(len(registry.status()), 1)
+        for version in ('missing-1', 'missing-2'):
+            self.assertRaises(LookupError, registry.get, 'pypi', version)
+        self.assertEqual(list(registry._failures), [('pypi', 'missing-1'), ('pypi', 'missing-2')])
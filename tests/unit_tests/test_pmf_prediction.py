@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the PMF scoring module.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from unittest import TestCase
+import numpy as np
+from recommendation_engine.config.params_scoring import ScoringParams
+from recommendation_engine.model.pmf_prediction import PMFScoring
+
+
+class TestPMFScoring(TestCase):
+    """Test the user vector fold-in."""
+
+    def setUp(self):
+        """Create a small random model."""
+        rng = np.random.RandomState(0)
+        self.m_V = rng.normal(size=(30, 6)).astype(np.float32)
+        self.items = [[1, 2] if idx % 3 else [] for idx in range(30)]
+        self.scoring = PMFScoring({"m_V": self.m_V, "m_U": None}, self.items)
+
+    def _solve_directly(self, stack):
+        params = ScoringParams
+        m_V = self.m_V.astype(np.float64)
+        rated = m_V[[idx for idx, users in enumerate(self.items) if users]]
+        stack_vectors = m_V[sorted(set(stack))]
+        system = params.b * rated.T.dot(rated) + params.lambda_u * np.eye(6) + \
+            (params.a - params.b) * stack_vectors.T.dot(stack_vectors)
+        return np.linalg.solve(system, params.a * stack_vectors.sum(axis=0))
+
+    def test_predict_transform(self):
+        """Test the low-rank update and the full solve against the training system."""
+        for stack in ([4], [4, 7, 7], [0, 1, 2, 3, 5, 8, 13, 21, 29]):
+            user_vector = self.scoring.predict_transform(stack, 6)
+            self.assertEqual(user_vector.shape, (1, 6))
+            np.testing.assert_allclose(user_vector[0], self._solve_directly(stack), rtol=1e-6)
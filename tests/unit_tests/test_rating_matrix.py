@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the binary rating files.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import io
+import os
+from unittest import TestCase
+import numpy as np
+from rudra.data_store.local_data_store import LocalDataStore
+from recommendation_engine.config.path_constants import ITEM_USER_FILEPATH, \
+    PRECOMPUTED_MANIFEST_PATH
+from recommendation_engine.utils.fileutils import load_rating, load_rating_matrix, rating_path
+from recommendation_engine.utils.rating_matrix import RatingMatrix, binary_rating_path, \
+    parse_rating_text
+from data_fixtures import copy_test_data, pmf_recommendation
+
+
+class TestRatingMatrix(TestCase):
+    """Test writing and reading rating files in the compressed sparse row layout."""
+
+    def setUp(self):
+        """Copy the test data next to binary copies of its rating files."""
+        self.tmp_dir, self.data_dir = copy_test_data(self)
+        self.data_store = LocalDataStore(self.data_dir)
+        for path in (ITEM_USER_FILEPATH, PRECOMPUTED_MANIFEST_PATH):
+            RatingMatrix.from_rows(load_rating(path, self.data_store)).save(
+                os.path.join(self.data_dir, binary_rating_path(path)))
+
+    def test_from_rows(self):
+        """Test that rows are deduplicated and sorted like the parsed text format."""
+        matrix = RatingMatrix.from_rows([[5409, 2309, 54909, 2309], [], [3]])
+        self.assertEqual(len(matrix), 3)
+        self.assertEqual([row.tolist() for row in matrix], [[2309, 5409, 54909], [], [3]])
+        self.assertEqual(matrix[-1].tolist(), [3])
+        np.testing.assert_array_equal(matrix.lengths, [3, 0, 1])
+
+    def test_load_rating(self):
+        """Test that the binary copy holds the rows of the text file."""
+        path = rating_path(ITEM_USER_FILEPATH, self.data_store)
+        self.assertEqual(path, binary_rating_path(ITEM_USER_FILEPATH))
+        self.assertEqual(rating_path('test_load_rating.txt', self.data_store),
+                         'test_load_rating.txt')
+        matrix = load_rating(path, self.data_store)
+        self.assertIsInstance(matrix.indices, np.ndarray)
+        self.assertFalse(matrix.indices.flags.writeable)
+        rows = load_rating(ITEM_USER_FILEPATH, self.data_store)
+        self.assertEqual([sorted(row) for row in rows], [row.tolist() for row in matrix])
+        with open(os.path.join(self.data_dir, path), 'rb') as binary_file:
+            from_buffer = RatingMatrix.from_buffer(binary_file.read())
+        np.testing.assert_array_equal(from_buffer.indptr, matrix.indptr)
+
+    def test_parse_rating_text(self):
+        """Test that the chunked parser gives the rows of load_rating whatever the chunk size."""
+        text = b"\n4 54909 2309 5409 2054\n0 7 8\n3\t12 12  5\r\n1 0\n0\n\n"
+        expected = [[2054, 2309, 5409, 54909], [], [5, 12], [0], []]
+        for chunk_size in (1, 3, 7, 1 << 20):
+            matrix = parse_rating_text(io.BytesIO(text), chunk_size)
+            self.assertEqual([row.tolist() for row in matrix], expected)
+            self.assertEqual(matrix.indptr[-1], len(matrix.indices))
+        self.assertEqual(len(parse_rating_text(io.BytesIO(b""))), 0)
+        with self.assertRaises(ValueError):
+            parse_rating_text(io.BytesIO(b"2 1 x\n"))
+
+    def test_load_rating_matrix(self):
+        """Test that text and binary rating files load into the same matrix."""
+        for path in (ITEM_USER_FILEPATH, PRECOMPUTED_MANIFEST_PATH):
+            parsed = load_rating_matrix(path, self.data_store)
+            mapped = load_rating_matrix(binary_rating_path(path), self.data_store)
+            np.testing.assert_array_equal(parsed.indptr, mapped.indptr)
+            np.testing.assert_array_equal(parsed.indices, mapped.indices)
+            self.assertEqual([row.tolist() for row in parsed],
+                             [sorted(row) for row in load_rating(path, self.data_store)])
+
+    def test_recommendations_from_binary_ratings(self):
+        """Test that the binary rating files give the same recommendations as the text ones."""
+        binary = pmf_recommendation(self.data_dir)
+        text = pmf_recommendation()
+        self.assertIsInstance(binary.user_stacks, RatingMatrix)
+        for stack in (["nopt"], ["statuses", "debuglog", "unpipe"], ["pon-logger", "nopt"]):
+            self.assertEqual(binary.predict(stack, 3), text.predict(stack, 3))
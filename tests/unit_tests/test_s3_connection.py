@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the S3 connection of the training.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+from rudra.data_store.local_data_store import LocalDataStore
+from recommendation_engine.config.path_constants import ITEM_USER_FILEPATH, MODEL_VERSION
+from recommendation_engine.utils.fileutils import load_rating, load_rating_matrix
+from recommendation_engine.utils.rating_matrix import binary_rating_path
+from training.datastore.s3_connection import GetData
+
+
+class TestGetData(TestCase):
+    """Test storing the training data for the scoring."""
+
+    def setUp(self):
+        """Create a GetData whose bucket is a local directory."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.bucket_dir = os.path.join(self.tmp_dir, 'bucket')
+
+        def upload_folder(folder_path, prefix):
+            shutil.copytree(folder_path, os.path.join(self.bucket_dir, prefix),
+                            dirs_exist_ok=True)
+        with mock.patch('training.datastore.s3_connection.AmazonS3') as s3:
+            s3.return_value.s3_upload_folder.side_effect = upload_folder
+            self.get_data = GetData('key', 'secret', 5, 'bucket', MODEL_VERSION)
+
+    def tearDown(self):
+        """Remove the temporary data."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save_binary_rating_file(self):
+        """Test that the uploaded binary rating file holds the rows of the text one."""
+        content = [[3, 5409, 2309, 54909], [0], [2, "12 7"], [1, 12]]
+        upload_dir = os.path.join(self.tmp_dir, 'upload')
+        self.get_data.save_file_temporary(content, os.path.basename(ITEM_USER_FILEPATH),
+                                          os.path.join(upload_dir, 'data'))
+        self.get_data.save_on_s3(upload_dir)
+        data_store = LocalDataStore(self.bucket_dir)
+        matrix = load_rating_matrix(binary_rating_path(ITEM_USER_FILEPATH), data_store)
+        self.assertEqual([row.tolist() for row in matrix], [[2309, 5409, 54909], [], [7, 12], [12]])
+        self.assertEqual([row.tolist() for row in matrix],
+                         [sorted(row) for row in load_rating(ITEM_USER_FILEPATH, data_store)])
+        self.assertEqual([row.tolist() for row in matrix],
+                         [row.tolist() for row in load_rating_matrix(ITEM_USER_FILEPATH,
+                                                                     data_store)])
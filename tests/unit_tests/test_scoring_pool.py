@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the scoring thread pool.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+from unittest import TestCase
+from gevent.threadpool import ThreadPool
+from recommendation_engine.utils.scoring_pool import ScoringPool, gevent_patched
+
+
+class TestScoringPool(TestCase):
+    """Test running calls in place or on OS threads."""
+
+    def test_run_in_place(self):
+        """Test that calls run in the calling thread when gevent is not patched in."""
+        self.assertFalse(gevent_patched())
+        pool = ScoringPool(2)
+        self.assertEqual(pool.run(lambda x, y=0: (x + y, threading.get_ident()), 1, y=2),
+                         (3, threading.get_ident()))
+
+    def test_run_on_threads(self):
+        """Test that calls run on the OS threads of the pool and exceptions come back."""
+        pool = ScoringPool(2)
+        pool._pool = ThreadPool(2)
+        self.assertNotEqual(pool.run(threading.get_ident), threading.get_ident())
+        self.assertRaises(ZeroDivisionError, pool.run, lambda: 1 / 0)
+        pool._pool.kill()
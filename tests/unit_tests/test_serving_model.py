@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the serving model artifact.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+from unittest import TestCase, mock
+import numpy as np
+from scipy.io import loadmat
+from recommendation_engine.config.params_scoring import ScoringParams
+from recommendation_engine.config.path_constants import PMF_MODEL_PATH, ID_TO_PACKAGE_MAP, \
+    SERVING_MODEL_PATH
+from recommendation_engine.model.serving_model import export_serving_model, \
+    load_serving_model
+from recommendation_engine.utils.array_bundle import write_array_bundle, read_array_bundle
+from data_fixtures import copy_test_data, pmf_recommendation
+
+
+class TestServingModel(TestCase):
+    """Test writing and memory-mapping the serving model."""
+
+    def setUp(self):
+        """Copy the test data next to a freshly exported serving model."""
+        self.tmp_dir, self.data_dir = copy_test_data(self)
+        export_serving_model(os.path.join(self.data_dir, PMF_MODEL_PATH),
+                             os.path.join(self.data_dir, ID_TO_PACKAGE_MAP),
+                             os.path.join(self.data_dir, SERVING_MODEL_PATH))
+
+    def test_array_bundle(self):
+        """Test that arrays survive a bundle round trip."""
+        path = os.path.join(self.tmp_dir, 'bundle.bin')
+        arrays = {"floats": np.arange(12, dtype=np.float32).reshape(3, 4),
+                  "ints": np.array([1, -2, 3], dtype=np.int64),
+                  "empty": np.array([], dtype=np.uint8)}
+        write_array_bundle(path, arrays)
+        loaded = read_array_bundle(path)
+        self.assertEqual(set(loaded), set(arrays))
+        for name, array in arrays.items():
+            self.assertEqual(loaded[name].dtype, array.dtype)
+            np.testing.assert_array_equal(loaded[name], array)
+        self.assertFalse(loaded["floats"].flags.writeable)
+        self.assertEqual(loaded["floats"].ctypes.data % 64, 0)
+
+    def test_load_serving_model(self):
+        """Test that the artifact holds the trained matrices and the package names."""
+        model_dict = load_serving_model(os.path.join(self.data_dir, SERVING_MODEL_PATH))
+        mat = loadmat(os.path.join(self.data_dir, PMF_MODEL_PATH))
+        np.testing.assert_array_equal(model_dict["m_V"], mat["m_V"])
+        np.testing.assert_array_equal(model_dict["m_U"], mat["m_U"])
+        self.assertIsNone(model_dict["m_theta"])
+        self.assertEqual(len(model_dict["package_index"]), mat["m_V"].shape[0])
+
+    def test_recommendations_from_serving_model(self):
+        """Test that the mapped model gives the same recommendations as the matlab one."""
+        # The test model is stored in float32, a matrix of the scoring precision stays mapped.
+        with mock.patch.object(ScoringParams, 'scoring_precision', 'float32'):
+            mapped = pmf_recommendation(self.data_dir)
+        parsed = pmf_recommendation()
+        self.assertIsInstance(mapped.latent_item_rep_mat.matrix, np.ndarray)
+        self.assertFalse(mapped.latent_item_rep_mat.matrix.flags.writeable)
+        self.assertEqual(list(mapped.package_index), list(parsed.package_index))
+        for stack in (["nopt"], ["statuses", "debuglog", "unpipe"]):
+            mapped_recommendations = mapped.predict(stack)[1]
+            parsed_recommendations = parsed.predict(stack)[1]
+            self.assertEqual([r["package_name"] for r in mapped_recommendations],
+                             [r["package_name"] for r in parsed_recommendations])
+            for mapped_rec, parsed_rec in zip(mapped_recommendations, parsed_recommendations):
+                self.assertAlmostEqual(mapped_rec["cooccurrence_probability"],
+                                       parsed_rec["cooccurrence_probability"], places=3)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for scoring an item matrix split across shard processes.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import signal
+import time
+from unittest import TestCase, mock
+import numpy as np
+from recommendation_engine.config.params_scoring import ScoringParams
+from recommendation_engine.model.item_factors import ItemFactorMatrix
+from recommendation_engine.utils.array_bundle import write_shared_array_bundle
+from recommendation_engine.model.sharded_scoring import ShardedItemScorer, top_k_rows
+from data_fixtures import pmf_recommendation, temporary_directory
+
+
+class TestShardedItemScorer(TestCase):
+    """Test merging the best items of every shard."""
+
+    def setUp(self):
+        """Create random item and user vectors."""
+        rng = np.random.RandomState(0)
+        self.m_V, self.users = rng.normal(size=(100, 6)), rng.normal(size=(4, 6))
+        self.tmp_dir = temporary_directory(self)
+
+    def _bundle(self, precision='float32'):
+        path = os.path.join(self.tmp_dir, 'scoring-{}.bin'.format(precision))
+        write_shared_array_bundle(
+            path, lambda: ItemFactorMatrix(self.m_V, precision).to_arrays("m_V"))
+        return path
+
+    def test_shared_bundle(self):
+        """Test that a shared bundle is only built by the first process writing it."""
+        path = self._bundle()
+        built = []
+        write_shared_array_bundle(path, lambda: built.append(True))
+        self.assertEqual(built, [])
+
+    def test_top_k_rows(self):
+        """Test the selection of the best scores of every row, -inf being left out."""
+        scores = np.array([[1, 3, 2, -np.inf], [0, 0, 5, 0]])
+        selected = top_k_rows(scores, [3, 2], np.array([10, 11, 12, 13]))
+        self.assertEqual([ids.tolist() for ids, _ in selected], [[11, 12, 10], [12, 10]])
+        self.assertEqual(top_k_rows(scores, [9], np.arange(4))[0][0].tolist(), [1, 2, 0])
+
+    def test_top_k(self):
+        """Test that the shards find the best items of the whole matrix."""
+        path = self._bundle()
+        scorer = ShardedItemScorer(path, 3)
+        try:
+            self.assertEqual(scorer.num_shards, 3)
+            stacks = [[0, 1], [], [50, 99], list(range(90))]
+            counts = [5, 5, 3, 20]
+            scores = ItemFactorMatrix(self.m_V).score(self.users)
+            for (ids, top_scores), stack, count, row in zip(
+                    scorer.top_k(self.users, stacks, counts), stacks, counts, scores):
+                row[stack] = -np.inf
+                expected = np.argsort(-row, kind='stable')[:min(count, 100 - len(stack))]
+                self.assertEqual(ids.tolist(), expected.tolist())
+                np.testing.assert_allclose(top_scores, row[expected], rtol=1e-5)
+            self.assertRaises(RuntimeError, scorer.top_k, self.users[:, :3], [[]] * 4, [1] * 4)
+            self.assertEqual(len(scorer.top_k(self.users[:1], [[]], [1])), 1)
+        finally:
+            scorer.close()
+        self.assertEqual(scorer.num_shards, 0)
+        # The bundle is left to the other workers mapping it.
+        self.assertTrue(os.path.exists(path))
+
+    def test_restart(self):
+        """Test that a shard whose process died is started again."""
+        scorer = ShardedItemScorer(self._bundle('int8'), 2)
+        try:
+            expected = scorer.top_k(self.users, [[]] * 4, [5] * 4)
+            for _ in range(2):
+                dead = scorer._processes[1]
+                dead.kill()
+                dead.join()
+                try:
+                    selected = scorer.top_k(self.users, [[]] * 4, [5] * 4)
+                except RuntimeError:
+                    # A shard found dead while replying fails the request it was asked.
+                    selected = scorer.top_k(self.users, [[]] * 4, [5] * 4)
+                self.assertIsNot(scorer._processes[1], dead)
+                for (ids, scores), (expected_ids, expected_scores) in zip(selected, expected):
+                    self.assertEqual(ids.tolist(), expected_ids.tolist())
+                    np.testing.assert_array_equal(scores, expected_scores)
+        finally:
+            scorer.close()
+
+    def test_timeout(self):
+        """Test that a hung shard fails the request by its deadline and is started again."""
+        scorer = ShardedItemScorer(self._bundle(), 2, timeout_seconds=60)
+        try:
+            expected = scorer.top_k(self.users, [[]] * 4, [5] * 4)
+            hung = scorer._processes[0]
+            os.kill(hung.pid, signal.SIGSTOP)
+            start = time.monotonic()
+            self.assertRaises(RuntimeError, scorer.top_k, self.users, [[]] * 4, [5] * 4,
+                              time.monotonic() + 0.2)
+            self.assertLess(time.monotonic() - start, 10)
+            self.assertIsNot(scorer._processes[0], hung)
+            self.assertFalse(hung.is_alive())
+            # The late reply of the shard that was not waited for is dropped.
+            for (ids, _), (expected_ids, _) in zip(scorer.top_k(self.users, [[]] * 4, [5] * 4),
+                                                   expected):
+                self.assertEqual(ids.tolist(), expected_ids.tolist())
+        finally:
+            scorer.close()
+
+    def test_sharded_recommendations(self):
+        """Test that a sharded model recommends what the unsharded one does."""
+        stacks = [["nopt"], ["statuses", "debuglog", "unpipe"]]
+        expected = pmf_recommendation().predict_batch(stacks, [5, 5])
+        with mock.patch.object(ScoringParams, 'scoring_shards', 2):
+            recommender = pmf_recommendation()
+            other = pmf_recommendation()
+        processes = recommender.sharded_scorer._processes
+        self.assertFalse(recommender.latent_item_rep_mat.matrix.flags.writeable)
+        # The workers of a node map the item matrix and the package fragments of one bundle.
+        self.assertEqual(other.sharded_scorer.path, recommender.sharded_scorer.path)
+        self.assertIs(recommender.model_dict["m_V"], recommender.latent_item_rep_mat)
+        self.assertEqual(recommender.predict_batch_json(stacks, [5, 5]),
+                         other.predict_batch_json(stacks, [5, 5]))
+        other.close()
+        try:
+            for (_, recommendations, _), (_, unsharded, _) in zip(
+                    recommender.predict_batch(stacks, [5, 5]), expected):
+                np.testing.assert_allclose(
+                    [r["cooccurrence_probability"] for r in recommendations],
+                    [r["cooccurrence_probability"] for r in unsharded], rtol=1e-5)
+            # The worker scores the stacks itself when the shards fail.
+            recommender.result_cache.clear()
+            with mock.patch.object(recommender.sharded_scorer, 'top_k',
+                                   side_effect=RuntimeError("shard died")):
+                for (_, recommendations, _), (_, unsharded, _) in zip(
+                        recommender.predict_batch(stacks, [5, 5]), expected):
+                    np.testing.assert_allclose(
+                        [r["cooccurrence_probability"] for r in recommendations],
+                        [r["cooccurrence_probability"] for r in unsharded], rtol=1e-5)
+        finally:
+            recommender.close()
+        self.assertFalse(any(process.is_alive() for process in processes))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the string tables and the package name index.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+from recommendation_engine.utils.array_bundle import write_array_bundle, read_array_bundle
+from recommendation_engine.utils.string_table import StringTable, PackageNameIndex
+
+
+class TestStringTable(TestCase):
+    """Test packing strings and looking up package names."""
+
+    def setUp(self):
+        """Create names that share long prefixes."""
+        self.names = ["@angular/core", "@angular/common", "@angular/cli", "lodash", "a",
+                      "@angular", "résumé", "@types/node", "@types/nodemailer", "zone.js"]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary data."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_string_table(self):
+        """Test that strings come back in order."""
+        table = StringTable.from_strings(self.names)
+        self.assertEqual(len(table), len(self.names))
+        self.assertEqual(list(table), self.names)
+        self.assertEqual(table[6], "résumé")
+        self.assertRaises(IndexError, table.__getitem__, len(self.names))
+        self.assertEqual(list(StringTable.from_strings([])), [])
+
+    def test_lookup(self):
+        """Test that every name maps to its id and unknown names to -1."""
+        index = PackageNameIndex.from_strings(self.names)
+        np.testing.assert_array_equal(index.lookup(self.names), np.arange(len(self.names)))
+        np.testing.assert_array_equal(
+            index.lookup(["@angular/c", "@angular/corex", "", "zzz", 5, "@types/nod"]),
+            [-1] * 6)
+        self.assertEqual(index.get("@types/node"), 7)
+        self.assertIsNone(index.get("missing", None))
+        self.assertIn("résumé", index)
+        self.assertNotIn("resume", index)
+        self.assertEqual(len(PackageNameIndex.from_strings([]).lookup(["a"])), 1)
+
+    def test_memory_mapped_index(self):
+        """Test that an index stored in an array bundle is looked up in place."""
+        path = os.path.join(self.tmp_dir, 'names.bin')
+        write_array_bundle(path, PackageNameIndex.from_strings(self.names).to_arrays("names"))
+        index = PackageNameIndex.from_arrays(read_array_bundle(path), "names")
+        self.assertFalse(index.blob.flags.writeable)
+        self.assertEqual(list(index), self.names)
+        self.assertEqual(index.get("@angular/cli"), 2)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the top-K table of the training stacks.
+
+Copyright © 2018 Red Hat Inc.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+from unittest import TestCase
+import numpy as np
+from recommendation_engine.config.path_constants import PMF_MODEL_PATH, TOP_K_TABLE_PATH
+from recommendation_engine.model.item_factors import ItemFactorMatrix
+from recommendation_engine.model.top_k_table import TopKTable, export_top_k_table
+from data_fixtures import copy_test_data, pmf_recommendation
+
+
+class TestTopKTable(TestCase):
+    """Test computing the table and serving precomputed stacks out of it."""
+
+    def setUp(self):
+        """Copy the test data next to a freshly exported top-K table."""
+        self.tmp_dir, self.data_dir = copy_test_data(self)
+        export_top_k_table(os.path.join(self.data_dir, PMF_MODEL_PATH),
+                           os.path.join(self.data_dir, TOP_K_TABLE_PATH), 8)
+
+    def test_compute(self):
+        """Test that every row holds the best scores of its user, best first."""
+        rng = np.random.RandomState(0)
+        user_matrix, item_matrix = rng.randn(10, 4), ItemFactorMatrix(rng.randn(30, 4))
+        table = TopKTable.compute(user_matrix, item_matrix, 5, block_size=3)
+        scores = item_matrix.score(user_matrix)
+        np.testing.assert_allclose(table.logits, -np.sort(-scores, axis=1)[:, :5], rtol=1e-6)
+        np.testing.assert_allclose(np.take_along_axis(scores, table.ids, axis=1),
+                                   table.logits, rtol=1e-6)
+        self.assertEqual(TopKTable.compute(user_matrix, item_matrix, 50).k, 30)
+        ids, logits = table.top(0, table.ids[0, :2], 3)
+        np.testing.assert_array_equal(ids, table.ids[0, 2:5])
+        self.assertIsNone(table.top(0, table.ids[0, :2], 4))
+
+    def test_predict_from_table(self):
+        """Test that precomputed stacks get the recommendations of the full scoring."""
+        with_table = pmf_recommendation(self.data_dir)
+        without_table = pmf_recommendation()
+        self.assertFalse(with_table.top_k_table.ids.flags.writeable)
+        with_table.validate()
+        stacks = [with_table.sample_stacks(1)[0], ["nopt"], ["parseurl", "qs"], ["send"]]
+        expected = without_table.predict_batch(stacks, [3] * len(stacks))
+        with_table._score_stacks = None
+        for (_, recommendations, _), (_, full, _) in zip(
+                with_table.predict_batch(stacks, [3] * len(stacks)), expected):
+            np.testing.assert_allclose(
+                [r["cooccurrence_probability"] for r in recommendations],
+                [r["cooccurrence_probability"] for r in full], rtol=1e-5)
+
+    def test_short_table(self):
+        """Test that stacks the table runs out of packages for are scored in full."""
+        recommender = pmf_recommendation(self.data_dir)
+        stack = recommender.sample_stacks(1)[0]
+        _, recommendations, _ = recommender.predict(stack, 20)
+        self.assertGreater(len(recommendations), 8)
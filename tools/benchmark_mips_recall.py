@@ -0,0 +1,89 @@
+"""Benchmark the recall and latency of the approximate item index against exact scoring.
+
+The items are either random vectors of a given catalog size or the latent
+item matrix of a model stored in a local directory laid out like the S3
+bucket, and the queries are random user vectors of the same scale.
+
+Usage:
+python3 tools/benchmark_mips_recall.py --num-items 200000 --nlist 512
+python3 tools/benchmark_mips_recall.py --data-dir tests/test_data --nlist 8
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from rudra.data_store.local_data_store import LocalDataStore
+
+from recommendation_engine.config.path_constants import PMF_MODEL_PATH, versioned_path
+from recommendation_engine.model.mips_index import IVFInnerProductIndex
+
+
+def get_arguments():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data-dir', help='local directory holding the model versions')
+    parser.add_argument('--model-version', default='2019-01-03')
+    parser.add_argument('--num-items', type=int, default=100000)
+    parser.add_argument('--num-latent', type=int, default=50)
+    parser.add_argument('--num-queries', type=int, default=200)
+    parser.add_argument('--nlist', type=int, default=256)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def get_item_vectors(arguments, rng):
+    """Load the item vectors of a model or generate random ones."""
+    if arguments.data_dir:
+        data_store = LocalDataStore(os.path.abspath(arguments.data_dir))
+        return np.asarray(data_store.load_matlab_multi_matrix(
+            versioned_path(PMF_MODEL_PATH, arguments.model_version))["m_V"], dtype=np.float32)
+    norms = rng.lognormal(sigma=0.5, size=(arguments.num_items, 1))
+    return (rng.normal(size=(arguments.num_items, arguments.num_latent)) * norms).astype(
+        np.float32)
+
+
+def benchmark(index, item_vectors, queries, k, nprobe):
+    """Get the mean recall@k and the mean search latency in ms of an nprobe setting."""
+    recalls = []
+    elapsed = 0.0
+    for query in queries:
+        exact = np.argpartition(-np.dot(item_vectors, query), k - 1)[:k]
+        start = time.perf_counter()
+        candidates, scores = index.search(query, nprobe)
+        top = candidates[np.argpartition(-scores, min(k, len(scores)) - 1)[:k]]
+        elapsed += time.perf_counter() - start
+        recalls.append(len(np.intersect1d(exact, top)) / k)
+    return np.mean(recalls), elapsed * 1000 / len(queries)
+
+
+def main():
+    """Print recall@k and latency for increasing nprobe values."""
+    arguments = get_arguments()
+    rng = np.random.RandomState(arguments.seed)
+    item_vectors = get_item_vectors(arguments, rng)
+    k = min(arguments.k, len(item_vectors))
+    queries = rng.normal(size=(arguments.num_queries, item_vectors.shape[1])).astype(np.float32)
+    start = time.perf_counter()
+    index = IVFInnerProductIndex(item_vectors, arguments.nlist, seed=arguments.seed)
+    print("Indexed {} items into {} lists in {:.2f}s".format(
+        len(item_vectors), index.nlist, time.perf_counter() - start))
+    start = time.perf_counter()
+    for query in queries:
+        np.argpartition(-np.dot(item_vectors, query), k - 1)[:k]
+    print("exact          latency {:8.3f} ms".format(
+        (time.perf_counter() - start) * 1000 / len(queries)))
+    nprobe = 1
+    while True:
+        recall, latency = benchmark(index, item_vectors, queries, k, nprobe)
+        print("nprobe {:6d}   latency {:8.3f} ms   recall@{} {:.4f}".format(
+            nprobe, latency, k, recall))
+        if nprobe >= index.nlist:
+            break
+        nprobe = min(nprobe * 2, index.nlist)
+
+
+if __name__ == "__main__":
+    main()
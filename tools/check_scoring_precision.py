@@ -0,0 +1,68 @@
+"""Check how much reduced precision scoring changes the recommended packages.
+
+The script folds in a sample of the precomputed stacks of a model stored in
+a local directory laid out like the S3 bucket and reports, for every scoring
+precision, how many of the float64 top-k packages are still in its top-k.
+
+Usage:
+python3 tools/check_scoring_precision.py --data-dir tests/test_data --model-version 2019-01-03
+"""
+
+import argparse
+import os
+
+import numpy as np
+from rudra.data_store.local_data_store import LocalDataStore
+
+from recommendation_engine.config.path_constants import PMF_MODEL_PATH, ITEM_USER_FILEPATH, \
+    PRECOMPUTED_MANIFEST_PATH, versioned_path
+from recommendation_engine.model.item_factors import SCORING_PRECISIONS, top_k_overlap
+from recommendation_engine.model.pmf_prediction import PMFScoring
+from recommendation_engine.utils.fileutils import load_rating
+
+
+def get_arguments():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data-dir', default='tests/test_data',
+                        help='local directory holding the model versions')
+    parser.add_argument('--model-version', default='2019-01-03')
+    parser.add_argument('--sample-size', type=int, default=1000,
+                        help='number of precomputed stacks to check')
+    parser.add_argument('-k', type=int, default=10, help='number of top packages to compare')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def sample_user_vectors(data_store, model_version, sample_size, seed):
+    """Fold in a random sample of the precomputed stacks of a model."""
+    model_dict = data_store.load_matlab_multi_matrix(
+        versioned_path(PMF_MODEL_PATH, model_version))
+    items = load_rating(versioned_path(ITEM_USER_FILEPATH, model_version), data_store)
+    stacks = [stack for stack in load_rating(
+        versioned_path(PRECOMPUTED_MANIFEST_PATH, model_version), data_store) if stack]
+    rng = np.random.RandomState(seed)
+    sample = rng.choice(len(stacks), size=min(sample_size, len(stacks)), replace=False)
+    scoring = PMFScoring(model_dict, items)
+    num_latent = model_dict["m_V"].shape[1]
+    user_matrix = np.vstack([scoring.predict_transform(stacks[idx], num_latent)
+                             for idx in sample])
+    return model_dict["m_V"], user_matrix
+
+
+def main():
+    """Print the top-k overlap of every scoring precision."""
+    arguments = get_arguments()
+    data_store = LocalDataStore(os.path.abspath(arguments.data_dir))
+    m_V, user_matrix = sample_user_vectors(data_store, arguments.model_version,
+                                           arguments.sample_size, arguments.seed)
+    print("Checked {} stacks against {} items, k={}".format(
+        len(user_matrix), len(m_V), arguments.k))
+    for precision in SCORING_PRECISIONS:
+        overlap = top_k_overlap(m_V, user_matrix, precision, arguments.k)
+        print("{:8s} mean top-k overlap {:.4f}, min {:.4f}".format(
+            precision, overlap.mean(), overlap.min()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Compare the item neighbours scoring mode with the PMF fold-in on held-out packages.
+
+The script takes the training stacks of a model stored in a local directory
+laid out like the S3 bucket, scores them with the PMF fold-in and with the
+item neighbour lists, and reports for both how many of the packages of the
+matching packagedata-test stacks make their top-k, how long scoring a stack
+takes, and how much the two top-k lists overlap.
+
+Usage:
+python3 tools/compare_scoring_modes.py --data-dir tests/test_data --model-version 2019-01-03
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from rudra.data_store.local_data_store import LocalDataStore
+
+from recommendation_engine.config.path_constants import PMF_MODEL_PATH, ITEM_USER_FILEPATH, \
+    USER_ITEM_FILEPATH, versioned_path
+from recommendation_engine.model.item_factors import ItemFactorMatrix
+from recommendation_engine.model.item_neighbours import ItemNeighbours, NEIGHBOUR_METRICS
+from recommendation_engine.model.pmf_prediction import PMFScoring
+from recommendation_engine.utils.fileutils import load_rating
+
+
+def get_arguments():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data-dir', default='tests/test_data',
+                        help='local directory holding the model versions')
+    parser.add_argument('--model-version', default='2019-01-03')
+    parser.add_argument('--sample-size', type=int, default=1000,
+                        help='number of training stacks to score')
+    parser.add_argument('-k', type=int, default=10, help='number of top packages to compare')
+    parser.add_argument('--num-neighbours', type=int, default=50,
+                        help='number of neighbours kept per item')
+    parser.add_argument('--metric', default='cosine', choices=NEIGHBOUR_METRICS)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def load_stacks(data_store, model_version, sample_size, seed):
+    """Get a sample of the training stacks along with their held-out packages."""
+    user_item_path = versioned_path(USER_ITEM_FILEPATH, model_version)
+    train = load_rating(user_item_path, data_store)
+    test = load_rating(user_item_path.replace('-train-', '-test-'), data_store)
+    users = [user for user in range(min(len(train), len(test))) if train[user] and test[user]]
+    rng = np.random.RandomState(seed)
+    sample = rng.choice(len(users), size=min(sample_size, len(users)), replace=False)
+    return [(list(train[users[idx]]), set(test[users[idx]])) for idx in sample]
+
+
+def pmf_scorer(data_store, model_version, model_dict):
+    """Get a function scoring a stack with the fold-in and a product with all items."""
+    scoring = PMFScoring(model_dict, load_rating(
+        versioned_path(ITEM_USER_FILEPATH, model_version), data_store))
+    item_matrix = ItemFactorMatrix(model_dict["m_V"])
+    num_latent = model_dict["m_V"].shape[1]
+
+    def score(stack, k):
+        user_vector = scoring.predict_transform(stack, num_latent)
+        scores = item_matrix.score(np.reshape(user_vector, (1, num_latent)))[0]
+        scores[stack] = -np.inf
+        return np.argsort(-scores, kind='stable')[:k]
+    return score
+
+
+def evaluate(score, stacks, k):
+    """Get the mean recall at k, the mean seconds per stack and the top-k of every stack."""
+    recalls, top_ks = [], []
+    start = time.perf_counter()
+    for stack, _ in stacks:
+        top_k = score(stack, k)
+        top_ks.append(set(np.asarray(top_k).tolist()))
+    elapsed = (time.perf_counter() - start) / max(len(stacks), 1)
+    for (_, held_out), top_k in zip(stacks, top_ks):
+        recalls.append(len(top_k & held_out) / min(k, len(held_out)))
+    return np.mean(recalls), elapsed, top_ks
+
+
+def main():
+    """Print the recall and the latency of both scoring modes."""
+    arguments = get_arguments()
+    data_store = LocalDataStore(os.path.abspath(arguments.data_dir))
+    model_dict = data_store.load_matlab_multi_matrix(
+        versioned_path(PMF_MODEL_PATH, arguments.model_version))
+    stacks = load_stacks(data_store, arguments.model_version, arguments.sample_size,
+                         arguments.seed)
+    start = time.perf_counter()
+    neighbours = ItemNeighbours.compute(model_dict["m_V"], arguments.num_neighbours,
+                                        arguments.metric)
+    print("Computed {} neighbours of {} items in {:.2f}s".format(
+        arguments.num_neighbours, len(neighbours), time.perf_counter() - start))
+    print("Scored {} stacks, k={}".format(len(stacks), arguments.k))
+    modes = {
+        "pmf": pmf_scorer(data_store, arguments.model_version, model_dict),
+        "item_neighbours": lambda stack, k: neighbours.score(stack, k)[0]
+    }
+    top_ks = {}
+    for mode, score in modes.items():
+        recall, seconds, top_ks[mode] = evaluate(score, stacks, arguments.k)
+        print("{:16s} mean recall@k {:.4f}, {:.1f}us per stack".format(
+            mode, recall, seconds * 1e6))
+    overlap = [len(pmf & other) / arguments.k
+               for pmf, other in zip(top_ks["pmf"], top_ks["item_neighbours"])]
+    print("mean top-k overlap of the modes {:.4f}".format(np.mean(overlap)))
+
+
+if __name__ == "__main__":
+    main()
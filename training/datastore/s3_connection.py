@@ -21,6 +21,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from rudra.data_store.aws import AmazonS3
 from training.datastore.utils import Utility
 from recommendation_engine.config.path_constants import TEMPORARY_DATA_PATH
+from recommendation_engine.utils.rating_matrix import RatingMatrix, binary_rating_path
 from rudra import logger
 import numpy as np
 import time
@@ -188,6 +189,20 @@ class GetData:
         except Exception as e:
             raise e
 
+    @staticmethod
+    def save_binary_rating_file(content, path):
+        """Store the rows of a rating file next to it in the binary format read at scoring time.
+
+        :content: Rows of the rating count followed by the ids, or by a
+                  string of space separated ids.
+        :path: The path of the text rating file.
+        """
+        rows = []
+        for lst in content:
+            ids = " ".join(str(x) for x in lst[1:]).split() if int(lst[0]) else []
+            rows.append([int(x) for x in ids])
+        RatingMatrix.from_rows(rows).save(binary_rating_path(path))
+
     def save_file_temporary(self, content, filename, datastore):
         """Store data file in temporary storage."""
         path = self.check_path(datastore)
@@ -196,6 +211,7 @@ class GetData:
                 for lst in content:
                     ele_str = " ".join([str(x) for x in lst[1:]])
                     f.write("{} {}\n".format(lst[0], ele_str))
+            self.save_binary_rating_file(content, os.path.join(path, filename))
             logger.info("File has been stored successfully.")
         except Exception as e:
             raise e
@@ -207,6 +223,7 @@ class GetData:
             with open(os.path.join(path, filename), 'w') as f:
                 for lst in content:
                     f.write("{} {}\n".format(lst[0], " ".join(str(x) for x in lst[1:])))
+            self.save_binary_rating_file(content, os.path.join(path, filename))
             logger.info("Manifest File has been stored successfully.")
 
         except Exception as e: